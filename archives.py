@@ -0,0 +1,279 @@
+"""
+Batches read straight from a zip or tar archive.
+
+The HTML members of the archive are read one at a time, in archive order,
+and handed to the workers as bytes, so nothing is extracted to disk. A tar
+archive (plain or compressed) is read as a stream and never seeked. The
+PDFs either go to a directory, mirroring the member paths, or are appended
+to a single zip file as they are finished, in the order of the input.
+
+Only a bounded window of members is in flight, so memory use does not
+grow with the size of the archive. Members have no location on disk, so
+relative URLs in them cannot be resolved; documents should reference
+their assets by absolute URL.
+"""
+import collections
+import concurrent.futures
+import os
+import posixpath
+import tarfile
+import time
+import zipfile
+
+from main import BatchEvent, DEFAULT_RETRIES, atomic_output, decode_html, print_progress, render_html
+from metrics import ConversionMetrics, JsonlReport, peak_rss, reset_peak_rss
+from pool import ConverterPool, DEFAULT_MAX_TASKS_PER_WORKER, WorkerCrashedError
+from profiles import profile_options
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+_HTML_EXTENSIONS = ('.html', '.htm')
+
+
+def is_archive(path):
+    """True if path names a zip or tar archive file (by extension)."""
+    return (isinstance(path, (str, os.PathLike)) and os.fspath(path).lower().endswith(ARCHIVE_EXTENSIONS)
+            and os.path.isfile(path))
+
+
+def _archive_stem(path):
+    name = os.path.basename(path)
+    for extension in sorted(ARCHIVE_EXTENSIONS, key=len, reverse=True):
+        if name.lower().endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def member_pdf_name(name):
+    """
+    Return the relative PDF path for an archive member, or None if the
+    member path is absolute or leaves the archive root.
+    """
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or '..' in parts or name.startswith('/'):
+        return None
+    return posixpath.splitext('/'.join(parts))[0] + '.pdf'
+
+
+def iter_members(archive_path):
+    """
+    Yield (name, bytes, date_time) for every HTML member of a zip or tar
+    archive, in archive order, reading one member at a time.
+    """
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(_HTML_EXTENSIONS):
+                    continue
+                yield info.filename, archive.read(info), info.date_time
+        return
+
+    # 'r|*' reads the tar sequentially, whatever its compression
+    with tarfile.open(archive_path, 'r|*') as archive:
+        for member in archive:
+            if not member.isfile() or not member.name.lower().endswith(_HTML_EXTENSIONS):
+                continue
+            with archive.extractfile(member) as f:
+                data = f.read()
+            yield member.name, data, time.localtime(member.mtime)[:6]
+
+
+def render_member(data, url_fetcher=None, profile=None):
+    """
+    Worker task: convert one HTML document held as bytes.
+
+    Returns:
+        (PDF bytes, dict with elapsed seconds, stage timings, page count,
+        input and output sizes and peak RSS)
+    """
+    start_time = time.time()
+    metrics = ConversionMetrics()
+    reset_peak_rss()
+    with metrics.stage('decode'):
+        html_content = decode_html(data)
+    pdf_bytes = render_html(html_content, None, metrics=metrics, url_fetcher=url_fetcher, profile=profile)
+    return pdf_bytes, {
+        'elapsed': round(time.time() - start_time, 4),
+        'stages': metrics.stage_seconds(),
+        'pages': metrics.pages,
+        'input_bytes': len(data),
+        'output_bytes': len(pdf_bytes),
+        'peak_rss': peak_rss(),
+    }
+
+
+class _DirectoryOutput:
+    """Writes each PDF to its member path below a directory."""
+
+    def __init__(self, directory):
+        self.location = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, pdf_name, pdf_bytes, date_time):
+        pdf_path = os.path.join(self.location, *pdf_name.split('/'))
+        os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+        with atomic_output(pdf_path) as temp_path, open(temp_path, 'wb') as f:
+            f.write(pdf_bytes)
+        return pdf_path
+
+    def close(self, completed):
+        pass
+
+
+class _ZipOutput:
+    """Appends each PDF to a zip file, which appears under its name once complete."""
+
+    def __init__(self, zip_path):
+        self.location = zip_path
+        os.makedirs(os.path.dirname(os.path.abspath(zip_path)), exist_ok=True)
+        self._temp_path = f"{zip_path}.{os.getpid()}.tmp"
+        # PDF streams are compressed already; storing them is much faster
+        self._zip = zipfile.ZipFile(self._temp_path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True)
+
+    def add(self, pdf_name, pdf_bytes, date_time):
+        self._zip.writestr(zipfile.ZipInfo(pdf_name, date_time=date_time), pdf_bytes)
+        return f"{self.location}!{pdf_name}"
+
+    def close(self, completed):
+        self._zip.close()
+        if completed:
+            os.replace(self._temp_path, self.location)
+        else:
+            os.unlink(self._temp_path)
+
+
+def convert_archive(archive_path, output=None, workers=None, pool=None,
+                    max_tasks_per_worker=DEFAULT_MAX_TASKS_PER_WORKER, max_in_flight=None,
+                    progress=print_progress, report_path=None, timeout=None, max_worker_rss=None,
+                    retries=DEFAULT_RETRIES, retry_errors=False, url_fetcher=None, profile=None):
+    """
+    Convert the HTML members of a zip or tar archive to PDFs.
+
+    Members are converted in parallel, but their PDFs are written in
+    archive order: a finished member waits until every member before it
+    is written. At most max_in_flight members (and their PDFs) are held at
+    once.
+
+    Args:
+        archive_path: .zip, .tar or compressed .tar file
+        output: Directory for the PDFs, or a path ending in .zip to write
+                them into one zip file (default: a directory named after
+                the archive, next to it)
+        workers: Number of parallel workers (default: CPU count, max 4)
+        pool: Existing ConverterPool to run on
+        max_tasks_per_worker: Documents a worker converts before it is
+              recycled (only used when no pool is given)
+        max_in_flight: Members read but not yet written (default: 4 per worker)
+        progress: Callable receiving a BatchEvent for every step, or None
+        report_path: JSON-lines file that receives one record per member
+        timeout: Seconds one document may take before its worker is killed
+              (only used when no pool is given)
+        max_worker_rss: Bytes of resident memory a worker may use (only
+              used when no pool is given)
+        retries: Extra attempts for a member whose worker crashed, timed
+              out or ran out of memory
+        retry_errors: Also retry members that raised an ordinary error
+        url_fetcher: Fetcher for images and stylesheets
+        profile: Output profile name (see profiles.py)
+
+    Returns:
+        A dict with the found, completed, failed and retried (members that
+        were tried again) counts, the output location and the elapsed time
+
+    Raises:
+        OSError: If a PDF cannot be written to the output; a zip output is
+            then discarded
+    """
+    start_time = time.time()
+    profile_options(profile)  # fail early on an unknown profile
+    if output is None:
+        output = os.path.join(os.path.dirname(os.path.abspath(archive_path)), _archive_stem(archive_path))
+    if workers is None:
+        workers = pool.workers if pool is not None else min(os.cpu_count(), 4)
+    if max_in_flight is None:
+        max_in_flight = workers * 4
+
+    stats = {'found': 0, 'completed': 0, 'failed': 0, 'cached': 0, 'retried': 0}
+    scanning = True
+    run_report = JsonlReport(report_path) if report_path else None
+
+    def report(kind, html_path=None, pdf_path=None, elapsed=None, error=None, metrics=None):
+        if run_report is not None and kind in ('done', 'failed'):
+            record = {'status': kind, 'html_path': html_path, 'pdf_path': pdf_path, **(metrics or {})}
+            if error is not None:
+                record['error'] = error
+            run_report.write(record)
+        if progress is not None:
+            progress(BatchEvent(kind, html_path, pdf_path, elapsed, stats['completed'], stats['failed'],
+                                stats['cached'], stats['found'], scanning, error, metrics))
+
+    own_pool = pool is None
+    if own_pool:
+        pool = ConverterPool(workers, max_tasks_per_worker=max_tasks_per_worker, task_timeout=timeout,
+                             max_worker_rss=max_worker_rss)
+    writer = _ZipOutput(output) if output.lower().endswith('.zip') else _DirectoryOutput(output)
+    # [name, data, date_time, pdf_name, future, attempt] in archive order
+    window = collections.deque()
+    finished = False
+
+    def submit(entry):
+        entry[4] = pool.submit(render_member, entry[1], url_fetcher, profile)
+        entry[4].add_start_callback(lambda future: report('started', entry[0], entry[3]))
+
+    def write_finished(keep):
+        """Write out the finished members at the head of the window, in order, until at most keep are left."""
+        while window:
+            entry = window[0]
+            name, data, date_time, pdf_name, future, attempt = entry
+            if not future.done():
+                if len(window) <= keep:
+                    return
+                concurrent.futures.wait([future])
+            try:
+                pdf_bytes, record = future.result()
+            except Exception as e:
+                # Crashes, timeouts and memory kills may not happen again
+                if attempt <= retries and (retry_errors or isinstance(e, WorkerCrashedError)):
+                    if attempt == 1:
+                        stats['retried'] += 1
+                    report('retry', name, pdf_name, error=f"attempt {attempt} failed: {str(e)}")
+                    entry[5] += 1
+                    submit(entry)
+                    continue
+                window.popleft()
+                stats['failed'] += 1
+                report('failed', name, pdf_name, error=str(e))
+                continue
+            # Not a conversion failure: an output that cannot be written fails the whole archive
+            pdf_path = writer.add(pdf_name, pdf_bytes, date_time)
+            window.popleft()
+            stats['completed'] += 1
+            report('done', name, pdf_path, record['elapsed'], metrics=record)
+
+    try:
+        for name, data, date_time in iter_members(archive_path):
+            stats['found'] += 1
+            pdf_name = member_pdf_name(name)
+            if pdf_name is None:
+                stats['failed'] += 1
+                report('failed', name, error="member path leaves the archive root")
+                continue
+            entry = [name, data, date_time, pdf_name, None, 1]
+            submit(entry)
+            window.append(entry)
+            write_finished(keep=max_in_flight - 1)
+        scanning = False
+        report('scanned')
+        write_finished(keep=0)
+        finished = True
+    finally:
+        if own_pool:
+            pool.shutdown(cancel_futures=True)
+        writer.close(finished)
+        if run_report is not None:
+            run_report.close()
+
+    stats['elapsed'] = time.time() - start_time
+    stats['output'] = writer.location
+    report('finished', pdf_path=writer.location, elapsed=stats['elapsed'], metrics=stats)
+    return stats
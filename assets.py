@@ -0,0 +1,264 @@
+"""
+Asset fetching and caching shared by every conversion.
+
+AssetFetcher is the url_fetcher documents are rendered with. Relative URLs
+reach it already resolved against the source file (its path is the
+document's base URL). Local stylesheets are served from the per-process
+stylesheet cache, and remote assets are kept in an on-disk cache that every
+worker process shares, so a logo referenced by a thousand reports is
+downloaded once. In offline mode network fetches are refused outright, so a
+render can never block on the network; cached copies are still served.
+RemoteOnlyFetcher wraps a fetcher for documents from untrusted callers and
+refuses everything but http, https and data URLs, so they cannot read
+local files.
+
+ImageCache is a size-bounded LRU of decoded images that WeasyPrint uses
+through its ``cache`` option. It lives for the whole worker process and is
+only trimmed between documents, because images written lazily into the PDF
+read their data back from it while the document is being written.
+"""
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import stylesheets
+
+# Seconds a cached remote asset is used before it is fetched again
+DEFAULT_MAX_AGE = 24 * 60 * 60
+
+# Decoded images and bytes of image data kept per worker process
+DEFAULT_MAX_IMAGES = 64
+DEFAULT_MAX_IMAGE_BYTES = 256 * 1024 * 1024
+
+# Schemes that never touch the network
+_LOCAL_SCHEMES = ('file', 'data')
+
+# Schemes a RemoteOnlyFetcher lets through
+_REMOTE_SCHEMES = ('http', 'https', 'data')
+
+
+class OfflineFetchError(ValueError):
+    """Raised by an offline AssetFetcher for a URL that needs the network."""
+
+
+class LocalFileFetchError(ValueError):
+    """Raised by a RemoteOnlyFetcher for a URL that could read a local file."""
+
+
+class AssetFetcher:
+    """
+    WeasyPrint url_fetcher with an on-disk cache for remote assets.
+
+    Instances only hold their settings, so they are cheap to send to worker
+    processes with every task.
+
+    Args:
+        cache_dir: Directory for cached remote assets, shared between
+                   processes (None to fetch remote assets every time)
+        offline: Refuse to fetch anything over the network
+        max_age: Seconds before a cached remote asset is fetched again
+        timeout: Network timeout in seconds
+    """
+
+    def __init__(self, cache_dir=None, offline=False, max_age=DEFAULT_MAX_AGE, timeout=10):
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.max_age = max_age
+        self.timeout = timeout
+
+    def __call__(self, url, timeout=None, ssl_context=None):
+        scheme = urlsplit(url).scheme.lower()
+        if scheme in _LOCAL_SCHEMES or not scheme:
+            return stylesheets.url_fetcher(url, timeout=timeout or self.timeout, ssl_context=ssl_context)
+
+        cached = self._read_cached(url)
+        if cached is not None:
+            result, fresh = cached
+            if fresh or self.offline:
+                return result
+        elif self.offline:
+            raise OfflineFetchError(f"Offline mode: refusing to fetch {url}")
+
+        from weasyprint import default_url_fetcher
+        try:
+            result = default_url_fetcher(url, timeout=timeout or self.timeout, ssl_context=ssl_context)
+        except Exception:
+            # A stale copy beats a missing asset
+            if cached is not None:
+                return cached[0]
+            raise
+        if 'file_obj' in result:
+            with result.pop('file_obj') as file_obj:
+                result['string'] = file_obj.read()
+        self._write_cached(url, result)
+        return result
+
+    def _paths(self, url):
+        digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        directory = os.path.join(self.cache_dir, digest[:2])
+        return directory, os.path.join(directory, digest)
+
+    def _read_cached(self, url):
+        """Return (result, fresh) for a cached asset, or None."""
+        if self.cache_dir is None:
+            return None
+        _, path = self._paths(url)
+        try:
+            with open(path + '.json', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (OSError, ValueError):
+            return None
+        fresh = time.time() - meta.get('fetched', 0) < self.max_age
+        return {**meta['result'], 'string': data}, fresh
+
+    def _write_cached(self, url, result):
+        """Store a fetched asset; concurrent writers are safe because files are renamed into place."""
+        if self.cache_dir is None:
+            return
+        directory, path = self._paths(url)
+        meta = {
+            'url': url,
+            'fetched': time.time(),
+            'result': {key: result.get(key) for key in ('mime_type', 'encoding', 'redirected_url', 'filename')},
+        }
+        suffix = f".{os.getpid()}.tmp"
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(path + suffix, 'wb') as f:
+                f.write(result['string'])
+            os.replace(path + suffix, path)
+            with open(path + '.json' + suffix, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(path + '.json' + suffix, path + '.json')
+        except OSError as e:
+            print(f"Warning: could not cache {url}: {str(e)}")
+
+
+class RemoteOnlyFetcher:
+    """
+    url_fetcher that refuses file: URLs, bare paths and other schemes that
+    could read the local machine, and passes http, https and data URLs on.
+
+    Args:
+        url_fetcher: Fetcher for the URLs that are let through (default:
+                     stylesheets.url_fetcher)
+    """
+
+    def __init__(self, url_fetcher=None):
+        self.url_fetcher = url_fetcher
+
+    def __call__(self, url, timeout=10, ssl_context=None):
+        if urlsplit(url).scheme.lower() not in _REMOTE_SCHEMES:
+            raise LocalFileFetchError(f"Refusing to fetch {url}: local files are not allowed")
+        return (self.url_fetcher or stylesheets.url_fetcher)(url, timeout=timeout, ssl_context=ssl_context)
+
+
+class ImageCache(dict):
+    """
+    WeasyPrint image cache that keeps decoded images between documents.
+
+    WeasyPrint stores two kinds of entries: an image object (or None when
+    loading failed) per URL, and the raw data of lazily written images under
+    ``'<image id>-<slot>-<dpi>'`` keys, which are read back while the PDF is
+    written. trim() must therefore only be called between documents, and
+    evicts an image together with its data entries.
+
+    Args:
+        max_images: Images kept after trim()
+        max_bytes: Bytes of image data kept after trim()
+    """
+
+    def __init__(self, max_images=DEFAULT_MAX_IMAGES, max_bytes=DEFAULT_MAX_IMAGE_BYTES):
+        super().__init__()
+        self.max_images = max_images
+        self.max_bytes = max_bytes
+        # URL keys, least recently used first
+        self._recent = collections.OrderedDict()
+        # Image id -> data keys of that image
+        self._data_keys = collections.defaultdict(set)
+        self._data_bytes = 0
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if key in self._recent:
+            self._recent.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self:
+            self._forget(key)
+        super().__setitem__(key, value)
+        if isinstance(value, bytes):
+            self._data_keys[key.split('-', 1)[0]].add(key)
+            self._data_bytes += len(value)
+        else:
+            self._recent[key] = True
+
+    def _forget(self, key):
+        value = super().pop(key)
+        if isinstance(value, bytes):
+            self._data_bytes -= len(value)
+            image_keys = self._data_keys.get(key.split('-', 1)[0])
+            if image_keys is not None:
+                image_keys.discard(key)
+        else:
+            self._recent.pop(key, None)
+        return value
+
+    def _evict(self, url):
+        image = self._forget(url)
+        image_id = getattr(image, 'id', None)
+        for key in self._data_keys.pop(image_id, ()):
+            if key in self:
+                self._forget(key)
+
+    def trim(self):
+        """Drop entries that must not outlive a document, then the least recently used images."""
+        from weasyprint.images import RasterImage
+
+        # Failed loads may succeed next time, and vector images keep a
+        # reference to the layout of the document they were loaded for
+        for url in list(self._recent):
+            if not isinstance(dict.get(self, url), RasterImage):
+                self._evict(url)
+        # Data entries whose image is gone
+        for image_id in list(self._data_keys):
+            if not self._data_keys[image_id]:
+                del self._data_keys[image_id]
+
+        while self._recent and (len(self._recent) > self.max_images or self._data_bytes > self.max_bytes):
+            self._evict(next(iter(self._recent)))
+
+
+_image_caches = {}
+
+# Image caches of the threads that render documents side by side
+_thread_state = threading.local()
+
+
+def image_cache(variant=None, per_thread=False):
+    """
+    Return this process's ImageCache.
+
+    Args:
+        variant: Hashable description of the options images are decoded
+                 with; documents rendered with different options get
+                 separate caches
+        per_thread: Return the calling thread's own cache instead, so that
+                 trimming it cannot drop images another thread is writing
+    """
+    caches = _image_caches
+    if per_thread:
+        caches = getattr(_thread_state, 'image_caches', None)
+        if caches is None:
+            caches = _thread_state.image_caches = {}
+    cache = caches.get(variant)
+    if cache is None:
+        cache = caches[variant] = ImageCache()
+    return cache
@@ -0,0 +1,300 @@
+"""
+asyncio interface to the converter, for embedding it in async applications.
+
+Conversions run on a ConverterPool of warm worker processes, so awaiting
+one never blocks the event loop:
+
+    async with AsyncConverter(workers=4, timeout=60) as converter:
+        record = await converter.convert('report.html', 'report.pdf')
+        pdf_bytes = await converter.convert(b'<html>...</html>')
+        async for result in converter.convert_many(paths):
+            ...
+
+convert_async() and convert_many_async() do the same on a converter shared
+by the whole process, created on first use.
+
+A conversion that is cancelled or runs past its timeout is taken off the
+pool: if it has not started it is dropped, otherwise its worker is killed
+and replaced, so abandoned documents never keep a worker busy. Progress is
+reported through a callback (a plain function or a coroutine function)
+receiving main.BatchEvent values; nothing is printed.
+"""
+import asyncio
+import atexit
+import collections
+import functools
+import inspect
+import os
+import weakref
+
+from main import BatchEvent, convert_file, convert_html
+from pool import ConverterPool, DEFAULT_MAX_TASKS_PER_WORKER
+
+
+class ConversionResult(collections.namedtuple('ConversionResult', [
+        'index', 'source', 'pdf_path', 'result', 'error', 'elapsed'])):
+    """
+    Outcome of one document of AsyncConverter.convert_many().
+
+    index is the position of the source in the input, source the HTML file
+    or bytes as given and pdf_path where the PDF was written (None for HTML
+    given as bytes). result is the convert_file record for files or the PDF
+    bytes for HTML given as bytes; if the conversion failed or timed out it
+    is None and error holds the exception. elapsed is the wall-clock time in
+    seconds, including any wait for a free worker.
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _split_source(source, pdf_path=None):
+    """
+    Return (html_path, pdf_path, content) for a source: an HTML file path,
+    an (html_path, pdf_path) pair, or HTML as bytes.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return None, pdf_path, bytes(source)
+    if isinstance(source, tuple):
+        source, pdf_path = source
+    if not isinstance(source, (str, os.PathLike)):
+        raise TypeError(f"Expected an HTML file path or HTML bytes, got {type(source).__name__}")
+    html_path = os.fspath(source)
+    if pdf_path is None:
+        pdf_path = os.path.splitext(html_path)[0] + '.pdf'
+    return html_path, os.fspath(pdf_path), None
+
+
+async def _iterate(sources):
+    """Iterate over a regular or an asynchronous iterable."""
+    if hasattr(sources, '__aiter__'):
+        async for source in sources:
+            yield source
+    else:
+        for source in sources:
+            yield source
+
+
+class AsyncConverter:
+    """
+    Converts documents from asyncio code on a managed ConverterPool.
+
+    Args:
+        workers: Number of worker processes (default: min(CPU count, 4))
+        max_concurrency: Conversions running or queued on the pool at once,
+            per event loop; further calls wait their turn (default: workers)
+        timeout: Default seconds a conversion may take, counted from when
+            it is handed to the pool (None for no limit)
+        max_tasks_per_worker: Documents a worker converts before it is recycled
+        max_worker_rss: Resident memory in bytes a busy worker may use
+        url_fetcher: Fetcher for the images and stylesheets of documents
+        profile: Default output profile (see profiles.py)
+        pool: Existing ConverterPool to use instead of starting one; it is
+            left running by close()
+    """
+
+    def __init__(self, workers=None, max_concurrency=None, timeout=None,
+                 max_tasks_per_worker=DEFAULT_MAX_TASKS_PER_WORKER, max_worker_rss=None,
+                 url_fetcher=None, profile=None, pool=None):
+        if max_concurrency is not None and max_concurrency <= 0:
+            raise ValueError("max_concurrency must be positive or None")
+        if timeout is not None and timeout <= 0:
+            raise ValueError("timeout must be positive or None")
+
+        self._owns_pool = pool is None
+        self.pool = pool or ConverterPool(workers, max_tasks_per_worker=max_tasks_per_worker,
+                                          max_worker_rss=max_worker_rss)
+        self.max_concurrency = max_concurrency or self.pool.workers
+        self.timeout = timeout
+        self.url_fetcher = url_fetcher
+        self.profile = profile
+        # Event loop -> semaphore; asyncio primitives belong to one loop
+        self._limits = weakref.WeakKeyDictionary()
+        # Progress coroutines still running, kept referenced until done
+        self._progress_tasks = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+        return False
+
+    async def close(self):
+        """Cancel queued conversions and stop the pool, without blocking the event loop."""
+        if self._owns_pool:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, functools.partial(self.pool.shutdown, wait=True,
+                                                               cancel_futures=True))
+
+    def _limit(self):
+        loop = asyncio.get_running_loop()
+        limit = self._limits.get(loop)
+        if limit is None:
+            limit = self._limits[loop] = asyncio.Semaphore(self.max_concurrency)
+        return limit
+
+    def _report(self, progress, event):
+        """Hand event to the progress callback; coroutines run as their own task."""
+        if progress is None:
+            return
+        try:
+            outcome = progress(event)
+            if inspect.isawaitable(outcome):
+                task = asyncio.ensure_future(outcome)
+                self._progress_tasks.add(task)
+                task.add_done_callback(self._progress_tasks.discard)
+        except Exception as e:
+            print(f"Error in progress callback: {str(e)}")
+
+    async def _run(self, html_path, pdf_path, content, base_url, timeout, profile, on_start=None):
+        """Submit one conversion and wait for it, taking it off the pool if we stop waiting."""
+        if content is None:
+            future = self.pool.submit(convert_file, html_path, pdf_path, self.url_fetcher, profile)
+        else:
+            future = self.pool.submit(convert_html, content, base_url=base_url,
+                                      url_fetcher=self.url_fetcher, profile=profile)
+        if on_start is not None:
+            future.add_start_callback(on_start)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self.pool.cancel(future)
+            raise
+
+    async def convert(self, source, pdf_path=None, *, base_url=None, timeout=None, profile=None):
+        """
+        Convert one document.
+
+        Args:
+            source: Path of an HTML file, or HTML as bytes
+            pdf_path: Output path for a file (default: next to it, with .pdf);
+                ignored for HTML given as bytes
+            base_url: Base for relative URLs of HTML given as bytes
+            timeout: Seconds the conversion may take (default: the converter's)
+            profile: Output profile (default: the converter's)
+
+        Returns:
+            The convert_file record for a file, or the PDF as bytes
+
+        Raises:
+            asyncio.TimeoutError: If the conversion ran past the timeout
+            Exception: Whatever the conversion raised
+        """
+        html_path, pdf_path, content = _split_source(source, pdf_path)
+        async with self._limit():
+            return await self._run(html_path, pdf_path, content, base_url,
+                                   timeout or self.timeout, profile or self.profile)
+
+    async def convert_many(self, sources, *, base_url=None, timeout=None, profile=None, progress=None):
+        """
+        Convert many documents, yielding a ConversionResult for each as it
+        completes. Failures are reported in the result rather than raised.
+
+        Only max_concurrency sources are read ahead of the results, so
+        sources may be a long (or asynchronous) generator. Leaving the loop
+        early cancels the conversions still in flight.
+
+        Args:
+            sources: Iterable or async iterable of HTML file paths,
+                (html_path, pdf_path) pairs or HTML bytes
+            base_url: Base for relative URLs of HTML given as bytes
+            timeout: Seconds each conversion may take (default: the converter's)
+            profile: Output profile (default: the converter's)
+            progress: Callable (or coroutine function) receiving a BatchEvent
+                for every step: 'started', 'done', 'failed' and 'finished'
+        """
+        loop = asyncio.get_running_loop()
+        timeout = timeout or self.timeout
+        profile = profile or self.profile
+        limit = self._limit()
+        counts = {'completed': 0, 'failed': 0, 'found': 0, 'scanning': True}
+        start_time = loop.time()
+
+        def event(kind, html_path=None, pdf_path=None, elapsed=None, error=None, metrics=None):
+            return BatchEvent(kind, html_path, pdf_path, elapsed, counts['completed'], counts['failed'], 0,
+                              counts['found'], counts['scanning'], error, metrics)
+
+        async def convert_one(index, source):
+            submitted = loop.time()
+            html_path = pdf_path = None
+            try:
+                html_path, pdf_path, content = _split_source(source)
+                on_start = None
+                if progress is not None:
+                    started = event('started', html_path, pdf_path)
+                    # Start callbacks run on the pool's manager thread
+                    on_start = lambda future: loop.call_soon_threadsafe(self._report, progress, started)
+                async with limit:
+                    result = await self._run(html_path, pdf_path, content, base_url, timeout, profile,
+                                             on_start=on_start)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                counts['failed'] += 1
+                elapsed = loop.time() - submitted
+                error = str(e) or type(e).__name__
+                self._report(progress, event('failed', html_path, pdf_path, elapsed, error=error))
+                return ConversionResult(index, source, pdf_path, None, e, elapsed)
+            counts['completed'] += 1
+            elapsed = loop.time() - submitted
+            self._report(progress, event('done', html_path, pdf_path, elapsed,
+                                         metrics=result if isinstance(result, dict) else None))
+            return ConversionResult(index, source, pdf_path if content is None else None, result, None, elapsed)
+
+        in_flight = set()
+        try:
+            async for source in _iterate(sources):
+                # Read ahead no further than the pool can take
+                while len(in_flight) >= self.max_concurrency:
+                    done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+                in_flight.add(loop.create_task(convert_one(counts['found'], source)))
+                counts['found'] += 1
+            counts['scanning'] = False
+
+            while in_flight:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+            self._report(progress, event('finished', elapsed=loop.time() - start_time))
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+
+_default_converter = None
+
+
+def default_converter():
+    """Return the converter shared by convert_async() and convert_many_async(), starting it on first use."""
+    global _default_converter
+    if _default_converter is None:
+        _default_converter = AsyncConverter()
+        atexit.register(_default_converter.pool.shutdown, wait=False, cancel_futures=True)
+    return _default_converter
+
+
+async def convert_async(source, pdf_path=None, *, converter=None, **options):
+    """
+    Convert one document without blocking the event loop.
+
+    See AsyncConverter.convert() for the arguments; converter defaults to
+    the shared default_converter().
+    """
+    return await (converter or default_converter()).convert(source, pdf_path, **options)
+
+
+async def convert_many_async(sources, *, converter=None, **options):
+    """
+    Async iterator converting many documents, yielding a ConversionResult
+    for each as it completes.
+
+    See AsyncConverter.convert_many() for the arguments; converter defaults
+    to the shared default_converter().
+    """
+    async for result in (converter or default_converter()).convert_many(sources, **options):
+        yield result
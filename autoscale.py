@@ -0,0 +1,167 @@
+"""
+Memory-aware sizing of a ConverterPool while a batch runs.
+
+The fixed default of min(CPU count, 4) workers leaves most cores of a big
+machine idle on light documents, and can still run out of memory on heavy
+ones. AutoScaler reads the memory the system has available
+(/proc/meminfo) and the resident memory of every worker (/proc/<pid>/statm),
+together with the peak memory of each finished document, and resizes the
+pool so that the workers, each assumed to grow as large as the largest of
+the recent peaks, stay within a memory budget. It grows the pool
+gradually, so every step is measured before the next, and shrinks it at
+once; surplus workers retire after their current document.
+
+Without /proc (i.e. outside Linux) the pool keeps its initial size.
+"""
+import collections
+import os
+import time
+
+from pool import process_rss
+
+# Seconds between memory samples
+AUTOSCALE_INTERVAL = 2.0
+
+# Share of the memory available at the start that the workers may use
+# when no budget is given
+DEFAULT_BUDGET_FRACTION = 0.75
+
+# Share of total memory always left free for the rest of the system
+MEMORY_RESERVE_FRACTION = 0.05
+
+# Worker memory samples and document peaks the per-worker estimate is taken
+# from; older ones age out, so one huge document does not shrink the pool
+# for the rest of the run
+RECENT_PEAKS = 64
+
+
+def system_memory():
+    """
+    Return (total, available) system memory in bytes from /proc/meminfo,
+    or None where it cannot be read.
+    """
+    values = {}
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                name, _, rest = line.partition(':')
+                if name in ('MemTotal', 'MemAvailable'):
+                    values[name] = int(rest.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        return None
+    if len(values) < 2:
+        return None
+    return values['MemTotal'], values['MemAvailable']
+
+
+class AutoScaler:
+    """
+    Resizes a ConverterPool to keep its workers within a memory budget.
+
+    Call update() regularly (at least every AUTOSCALE_INTERVAL seconds)
+    from the thread driving the batch; it samples memory at most that
+    often. observe() adds the peak memory of a finished document, which a
+    sample may have missed. Every change of size is recorded in history.
+
+    Args:
+        pool: ConverterPool to resize
+        memory_budget: Bytes of resident memory all workers together may
+            use (default: DEFAULT_BUDGET_FRACTION of the memory available
+            when the scaler starts, plus what the workers already use)
+        min_workers: Fewest workers to keep
+        max_workers: Most workers to run (default: CPU count)
+        interval: Seconds between memory samples
+    """
+
+    def __init__(self, pool, memory_budget=None, min_workers=1, max_workers=None, interval=AUTOSCALE_INTERVAL):
+        if memory_budget is not None and memory_budget <= 0:
+            raise ValueError("memory_budget must be positive")
+        self.pool = pool
+        self.min_workers = min_workers
+        self.max_workers = max_workers or os.cpu_count()
+        self.interval = interval
+        self.start_time = time.monotonic()
+        self.last_sample = None
+        self._recent = collections.deque(maxlen=RECENT_PEAKS)
+        # One dict per change of size: time (seconds since start), workers,
+        # available memory and worker_rss (the per-worker estimate) in bytes
+        self.history = []
+
+        memory = system_memory()
+        self.enabled = memory is not None
+        if memory is not None:
+            total, available = memory
+            self.reserve = total * MEMORY_RESERVE_FRACTION
+            if memory_budget is None:
+                memory_budget = available * DEFAULT_BUDGET_FRACTION + self._worker_rss()[0]
+        self.memory_budget = memory_budget
+        self._record(pool.workers, memory[1] if memory else None)
+
+    @property
+    def worker_peak(self):
+        """Largest recent resident memory of one worker in bytes (0 before any sample)."""
+        return max(self._recent, default=0)
+
+    def observe(self, peak_rss):
+        """Add the peak resident memory of a worker that finished a document."""
+        if peak_rss:
+            self._recent.append(peak_rss)
+
+    def _worker_rss(self):
+        """Return (total, largest) resident memory of the current workers in bytes."""
+        sizes = [rss for rss in map(process_rss, self.pool.worker_pids()) if rss is not None]
+        return sum(sizes), max(sizes, default=0)
+
+    def _record(self, workers, available):
+        self.history.append({
+            'time': round(time.monotonic() - self.start_time, 1),
+            'workers': workers,
+            'available': available,
+            'worker_rss': self.worker_peak,
+        })
+
+    def target(self, available, used):
+        """
+        Number of workers that fit in memory.
+
+        Args:
+            available: Bytes of memory the system has available
+            used: Bytes the workers use at the moment
+
+        Returns:
+            The worker count, between min_workers and max_workers
+        """
+        if not self.worker_peak:
+            return self.pool.workers
+        # What the workers may use: the budget, and never more than is left
+        limit = min(self.memory_budget, used + available - self.reserve)
+        return max(self.min_workers, min(self.max_workers, int(limit // self.worker_peak)))
+
+    def update(self):
+        """
+        Sample memory if the interval has passed and resize the pool.
+
+        Returns:
+            The new number of workers if it changed, else None
+        """
+        now = time.monotonic()
+        if not self.enabled or (self.last_sample is not None and now - self.last_sample < self.interval):
+            return None
+        self.last_sample = now
+        memory = system_memory()
+        if memory is None:
+            return None
+        available = memory[1]
+        used, largest = self._worker_rss()
+        self.observe(largest)
+
+        current = self.pool.workers
+        target = self.target(available, used)
+        if target > current:
+            # Grow by at most half again, so the new workers are measured before the next step
+            target = min(target, current + max(1, current // 2))
+        if target == current:
+            return None
+        self.pool.resize(target)
+        self._record(target, available)
+        return target
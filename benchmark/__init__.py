@@ -0,0 +1,5 @@
+"""
+Benchmarks for the HTML to PDF converter.
+
+Run a benchmark module directly, e.g. ``python -m benchmark.expand``.
+"""
@@ -0,0 +1,194 @@
+"""
+Synthetic HTML corpus shaped like the reports we convert.
+
+Documents are built from nested ``.collapsible``/``.content`` sections with
+``display:none`` blocks, ``#hid`` divs, checkboxes, tables and images, so
+every expansion rule and the expensive parts of layout get exercised. The
+output only depends on the arguments and the seed, so two runs of the
+benchmark on different machines or versions convert the same bytes.
+
+Usage:
+    python -m benchmark.corpus OUTPUT_DIR [--count 20] [--size small|medium|large] [--seed 1]
+"""
+import argparse
+import os
+import random
+import struct
+import zlib
+
+# Document shapes: sections per document, nesting depth, table rows, images
+SIZES = {
+    'small': {'sections': 10, 'depth': 1, 'table_rows': 10, 'images': 1},
+    'medium': {'sections': 40, 'depth': 2, 'table_rows': 50, 'images': 4},
+    'large': {'sections': 80, 'depth': 3, 'table_rows': 160, 'images': 8},
+}
+
+IMAGE_DIR = 'images'
+IMAGE_COUNT = 8
+
+# Sections of the flat report used by the expansion benchmark
+SECTION = """
+<button type="button" class="collapsible">Section {i}</button>
+<div class="content" style="display: none">
+  <p>Item {i}: <input type="checkbox" name="c{i}"> reviewed</p>
+  <div id="hid" style="display:none">Hidden details for item {i}</div>
+  <table>
+    <tr><th>Key</th><th>Value</th></tr>
+    <tr><td>alpha</td><td>{i}</td></tr>
+    <tr><td>beta</td><td style="color: red; display:none">{i}</td></tr>
+  </table>
+</div>
+"""
+
+STYLE = """
+    body { font-family: sans-serif; font-size: 10pt; }
+    .collapsible { background: #eee; border: none; width: 100%; text-align: left; }
+    .collapsible:after { content: "+"; float: right; }
+    .content { display: none; padding: 0 12px; border-left: 2px solid #ccc; }
+    table { border-collapse: collapse; width: 100%; }
+    td, th { border: 1px solid #999; padding: 2px 4px; }
+    img { width: 120px; height: 80px; }
+"""
+
+WORDS = ('account balance transfer ledger invoice payment currency settlement review '
+         'pending approved rejected customer merchant fee rate reference statement').split()
+
+
+def synthetic_report(size_mb):
+    """Build a flat report of roughly ``size_mb`` megabytes of collapsible sections."""
+    sections = []
+    size = 0
+    i = 0
+    while size < size_mb * 1024 * 1024:
+        section = SECTION.format(i=i)
+        sections.append(section)
+        size += len(section)
+        i += 1
+    return f"<html><head><title>Report</title></head><body>{''.join(sections)}</body></html>"
+
+
+def png_bytes(width, height, color):
+    """Encode a solid-colour RGB PNG without any imaging library."""
+    row = b'\x00' + bytes(color) * width
+    raw = zlib.compress(row * height, 9)
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', raw) + chunk(b'IEND', b'')
+
+
+def write_images(output_dir, count=IMAGE_COUNT, seed=1):
+    """Write ``count`` PNG files to ``output_dir/images`` and return their relative paths."""
+    rng = random.Random(seed)
+    image_dir = os.path.join(output_dir, IMAGE_DIR)
+    os.makedirs(image_dir, exist_ok=True)
+    paths = []
+    for n in range(count):
+        rel_path = f"{IMAGE_DIR}/image{n}.png"
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        with open(os.path.join(output_dir, rel_path), 'wb') as f:
+            f.write(png_bytes(240, 160, color))
+        paths.append(rel_path)
+    return paths
+
+
+def _sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def _table(rng, rows):
+    lines = ['<table>', '<tr><th>Reference</th><th>Account</th><th>Amount</th><th>Status</th></tr>']
+    for r in range(rows):
+        hidden = ' style="display:none"' if r % 7 == 3 else ''
+        lines.append(f'<tr{hidden}><td>REF-{rng.randrange(10**6):06d}</td><td>{rng.choice(WORDS)}</td>'
+                     f'<td>{rng.uniform(1, 10000):.2f}</td><td>{rng.choice(WORDS)}</td></tr>')
+    lines.append('</table>')
+    return '\n'.join(lines)
+
+
+def _section(rng, label, depth, table_rows, images):
+    parts = [
+        f'<button type="button" class="collapsible">{label}</button>',
+        '<div class="content" style="display: none">',
+        f'<p><input type="checkbox" name="{label}"> {_sentence(rng)}</p>',
+        f'<div id="hid" style="display:none">{_sentence(rng, 30)}</div>',
+    ]
+    if images and rng.random() < 0.5:
+        parts.append(f'<img src="{rng.choice(images)}" alt="{label}">')
+    if table_rows:
+        parts.append(_table(rng, rng.randint(table_rows // 2, table_rows)))
+    if depth > 1:
+        for n in range(rng.randint(1, 3)):
+            parts.append(_section(rng, f"{label}.{n + 1}", depth - 1, table_rows // 4, images))
+    parts.append('</div>')
+    return '\n'.join(parts)
+
+
+def generate_document(seed, sections=10, depth=1, table_rows=10, images=()):
+    """
+    Build one synthetic report.
+
+    Args:
+        seed: Seed for the document's content
+        sections: Top-level collapsible sections
+        depth: Nesting depth of collapsible sections
+        table_rows: Upper bound of rows in each top-level section's table
+        images: Relative image paths the document may reference
+    """
+    rng = random.Random(seed)
+    body = '\n'.join(_section(rng, f"Section {n + 1}", depth, table_rows, images) for n in range(sections))
+    return (f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>Report {seed}</title>'
+            f'<style>{STYLE}</style></head>\n<body>\n<h1>Report {seed}</h1>\n{body}\n</body></html>\n')
+
+
+def generate_corpus(output_dir, count=20, size='medium', seed=1):
+    """
+    Write ``count`` reports of the given size to ``output_dir``.
+
+    Args:
+        output_dir: Directory for the corpus (created if needed)
+        count: Number of documents
+        size: One of SIZES, or a dict with the same keys
+        seed: Seed for the whole corpus
+
+    Returns:
+        The paths of the generated HTML files, in order
+    """
+    shape = SIZES[size] if isinstance(size, str) else size
+    os.makedirs(output_dir, exist_ok=True)
+    images = write_images(output_dir, seed=seed) if shape['images'] else []
+
+    paths = []
+    for n in range(count):
+        html_content = generate_document(
+            seed * 100003 + n,
+            sections=shape['sections'],
+            depth=shape['depth'],
+            table_rows=shape['table_rows'],
+            images=images[:shape['images']],
+        )
+        path = os.path.join(output_dir, f"report{n:05d}.html")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic HTML corpus.')
+    parser.add_argument('output_dir', help='Directory for the generated documents')
+    parser.add_argument('--count', type=int, default=20, help='Number of documents (default: %(default)s)')
+    parser.add_argument('--size', choices=sorted(SIZES), default='medium', help='Document size (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=1, help='Seed for the corpus (default: %(default)s)')
+    args = parser.parse_args()
+
+    paths = generate_corpus(args.output_dir, args.count, args.size, args.seed)
+    total = sum(os.path.getsize(path) for path in paths)
+    print(f"Wrote {len(paths)} documents ({total / (1024 * 1024):.1f} MB) to {args.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
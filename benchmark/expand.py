@@ -0,0 +1,78 @@
+"""
+Compare the single-pass DOM expansion with the original regex path.
+
+Both paths end with a parsed tree ready for WeasyPrint: the regex path
+rewrites the text and then parses it (as ``HTML(string=...)`` does), the DOM
+path parses once and expands the tree in place.
+
+Usage:
+    python -m benchmark.expand [--size-mb 5] [--repeat 5] [file.html ...]
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tinyhtml5  # noqa: E402
+
+from benchmark.corpus import synthetic_report  # noqa: E402
+from expand import expand_html_text, parse_expanded  # noqa: E402
+
+
+def regex_path(html_content):
+    modified_html = expand_html_text(html_content)
+    return tinyhtml5.parse(modified_html, namespace_html_elements=False)
+
+
+def dom_path(html_content):
+    return parse_expanded(html_content)
+
+
+def measure(fn, html_content, repeat):
+    """Return (best seconds, peak traced bytes) for ``fn(html_content)``."""
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn(html_content)
+        best = min(best, time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    fn(html_content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DOM expansion against the regex path.')
+    parser.add_argument('files', nargs='*', help='HTML files to benchmark (default: a synthetic report)')
+    parser.add_argument('--size-mb', type=float, default=5, help='Size of the synthetic report in MB')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per path (best is reported)')
+    args = parser.parse_args()
+
+    if args.files:
+        documents = []
+        for path in args.files:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                documents.append((path, f.read()))
+    else:
+        documents = [(f"synthetic {args.size_mb:g} MB", synthetic_report(args.size_mb))]
+
+    for name, html_content in documents:
+        print(f"{name} ({len(html_content) / (1024 * 1024):.1f} MB)")
+        results = {}
+        for label, fn in (('regex', regex_path), ('dom', dom_path)):
+            seconds, peak = measure(fn, html_content, args.repeat)
+            results[label] = seconds
+            print(f"  {label:5}  {seconds:8.3f} s   peak {peak / (1024 * 1024):8.1f} MB")
+        print(f"  speedup {results['regex'] / results['dom']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+"""
+End-to-end conversion benchmark.
+
+Generates a synthetic corpus (or uses an existing directory), then measures:
+
+- single-document latency: each document is converted in this process, as
+  ``html_to_pdf`` does without a pool, and min/mean/p50/p90/p95/p99/max
+  are reported for the total and for every stage;
+- batch throughput: ``batch_convert_html_to_pdf`` over the whole corpus for
+  each worker count, in documents and pages per second;
+- peak memory: the largest per-document RSS high water mark, in this
+  process for the latency run and in any worker for each batch;
+- output profiles: every document converted in this process with each
+  output profile (see profiles.py), with the time and total PDF size of
+  each, so their size/speed trade-off can be compared.
+
+Results are saved as JSON together with the environment they were measured
+in, and ``--compare`` prints the change against an earlier results file.
+
+Usage:
+    python -m benchmark.run [--count 20] [--size medium] [--workers 1,2,4] [--output results.json]
+    python -m benchmark.run --corpus ./html_files --compare baseline.json
+    python -m benchmark.run --profiles fast,balanced --workers ''
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark.corpus import SIZES, generate_corpus  # noqa: E402
+from profiles import PROFILES  # noqa: E402
+
+
+def percentile(values, fraction):
+    """Return the ``fraction`` percentile of ``values`` with linear interpolation."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values):
+    """Return min/mean/percentiles/max of a list of seconds, rounded to 0.1 ms."""
+    if not values:
+        return {}
+    summary = {
+        'min': min(values),
+        'mean': sum(values) / len(values),
+        'p50': percentile(values, 0.50),
+        'p90': percentile(values, 0.90),
+        'p95': percentile(values, 0.95),
+        'p99': percentile(values, 0.99),
+        'max': max(values),
+    }
+    return {name: round(value, 4) for name, value in summary.items()}
+
+
+def html_files_in(corpus_dir):
+    from main import iter_html_files
+    return sorted(iter_html_files(corpus_dir))
+
+
+def measure_latency(html_files, output_dir, warmup=1):
+    """
+    Convert each document in this process and summarize the latencies.
+
+    The first ``warmup`` conversions load fonts and fill the per-process
+    caches, as the first document in a fresh worker does; they are not
+    counted.
+    """
+    from main import convert_file
+
+    os.makedirs(output_dir, exist_ok=True)
+    for html_path in html_files[:warmup]:
+        convert_file(html_path, os.path.join(output_dir, 'warmup.pdf'))
+
+    totals = []
+    stages = {}
+    peak = 0
+    for n, html_path in enumerate(html_files):
+        record = convert_file(html_path, os.path.join(output_dir, f"latency{n}.pdf"))
+        totals.append(record['elapsed'])
+        peak = max(peak, record['peak_rss'] or 0)
+        for name, seconds in record['stages'].items():
+            stages.setdefault(name, []).append(seconds)
+
+    return {
+        'documents': len(totals),
+        'seconds': summarize(totals),
+        'stages': {name: summarize(values) for name, values in stages.items()},
+        'peak_rss': peak,
+    }
+
+
+def measure_profiles(html_files, output_dir, profiles, warmup=1):
+    """
+    Convert every document with each output profile in this process.
+
+    Returns:
+        One dict per profile with its mean seconds per document and the
+        total and mean size of the PDFs it wrote
+    """
+    from main import convert_file
+
+    os.makedirs(output_dir, exist_ok=True)
+    runs = []
+    for profile in profiles:
+        # Images are cached per profile, so each profile gets its own warmup
+        for html_path in html_files[:warmup]:
+            convert_file(html_path, os.path.join(output_dir, 'warmup.pdf'), profile=profile)
+
+        seconds = 0.0
+        output_bytes = 0
+        for n, html_path in enumerate(html_files):
+            record = convert_file(html_path, os.path.join(output_dir, f"{profile}{n}.pdf"), profile=profile)
+            seconds += record['elapsed']
+            output_bytes += record['output_bytes']
+        runs.append({
+            'profile': profile,
+            'documents': len(html_files),
+            'seconds': round(seconds, 3),
+            'seconds_per_document': round(seconds / len(html_files), 4),
+            'output_bytes': output_bytes,
+            'bytes_per_document': output_bytes // len(html_files),
+        })
+    return runs
+
+
+def measure_throughput(corpus_dir, output_dir, workers):
+    """Run one batch over the corpus and return its throughput and memory figures."""
+    from main import batch_convert_html_to_pdf
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    report_path = os.path.join(output_dir, 'report.jsonl')
+    stats = batch_convert_html_to_pdf(corpus_dir, output_dir, workers=workers, progress=None,
+                                      report_path=report_path)
+    if stats is None:
+        raise SystemExit(f"No HTML files found in {corpus_dir}")
+
+    pages = 0
+    worker_peak = 0
+    with open(report_path, encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            pages += record.get('pages') or 0
+            worker_peak = max(worker_peak, record.get('peak_rss') or 0)
+
+    elapsed = stats['elapsed']
+    return {
+        'workers': workers,
+        'documents': stats['completed'],
+        'failed': stats['failed'],
+        'pages': pages,
+        'seconds': round(elapsed, 3),
+        'documents_per_second': round(stats['completed'] / elapsed, 3),
+        'pages_per_second': round(pages / elapsed, 3),
+        'worker_peak_rss': worker_peak,
+    }
+
+
+def environment():
+    """Describe where the benchmark ran, so results can be compared fairly."""
+    import weasyprint
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'weasyprint': weasyprint.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, baseline):
+    """Print how ``results`` changed relative to ``baseline``."""
+    def change(new, old):
+        if not old or new is None:
+            return 'n/a'
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print(f"\nCompared with {baseline['environment'].get('commit') or 'baseline'} "
+          f"({baseline['environment'].get('timestamp')}):")
+    if results['corpus'] != baseline.get('corpus'):
+        print("  Warning: the corpus differs from the baseline's; figures are not directly comparable")
+    if 'latency' in results and 'latency' in baseline:
+        for name in ('p50', 'p95', 'p99'):
+            new = results['latency']['seconds'].get(name)
+            old = baseline['latency']['seconds'].get(name)
+            print(f"  latency {name:4} {new:8.3f} s  (was {old:.3f} s, {change(new, old)})")
+
+    old_runs = {run['workers']: run for run in baseline.get('throughput', [])}
+    for run in results.get('throughput', []):
+        old = old_runs.get(run['workers'])
+        if old is not None:
+            print(f"  {run['workers']:2} workers  {run['documents_per_second']:8.2f} docs/s  "
+                  f"(was {old['documents_per_second']:.2f}, "
+                  f"{change(run['documents_per_second'], old['documents_per_second'])}), "
+                  f"worker peak RSS {change(run['worker_peak_rss'], old['worker_peak_rss'])}")
+
+    if 'latency' in results and 'latency' in baseline:
+        print(f"  peak RSS {change(results['latency']['peak_rss'], baseline['latency']['peak_rss'])}")
+
+    old_profiles = {run['profile']: run for run in baseline.get('profiles', [])}
+    for run in results.get('profiles', []):
+        old = old_profiles.get(run['profile'])
+        if old is not None:
+            print(f"  profile {run['profile']:8} {change(run['seconds_per_document'], old['seconds_per_document'])} "
+                  f"time, {change(run['bytes_per_document'], old['bytes_per_document'])} size")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark HTML to PDF conversion latency and throughput.')
+    parser.add_argument('--corpus', help='Directory of HTML files to use instead of a generated corpus')
+    parser.add_argument('--count', type=int, default=20, help='Documents in the generated corpus (default: %(default)s)')
+    parser.add_argument('--size', choices=sorted(SIZES), default='medium',
+                        help='Size of the generated documents (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=1, help='Seed for the generated corpus (default: %(default)s)')
+    parser.add_argument('--workers', default='1,2,4',
+                        help='Comma-separated worker counts for the throughput runs (default: %(default)s)')
+    parser.add_argument('--skip-latency', action='store_true', help='Only measure batch throughput')
+    parser.add_argument('--profiles', default=','.join(PROFILES),
+                        help="Comma-separated output profiles to compare, '' to skip (default: %(default)s)")
+    parser.add_argument('--output', default='benchmark_results.json', help='Results file (default: %(default)s)')
+    parser.add_argument('--compare', metavar='BASELINE', help='Earlier results file to compare against')
+    args = parser.parse_args()
+
+    worker_counts = [int(n) for n in args.workers.split(',') if n.strip()]
+    profiles = [name.strip() for name in args.profiles.split(',') if name.strip()]
+    unknown = [name for name in profiles if name not in PROFILES]
+    if unknown:
+        parser.error(f"unknown profile(s): {', '.join(unknown)}")
+    work_dir = tempfile.mkdtemp(prefix='html2pdf-bench-')
+    try:
+        # 1. Corpus
+        corpus_dir = args.corpus
+        if corpus_dir is None:
+            corpus_dir = os.path.join(work_dir, 'corpus')
+            generate_corpus(corpus_dir, args.count, args.size, args.seed)
+        html_files = html_files_in(corpus_dir)
+        corpus_bytes = sum(os.path.getsize(path) for path in html_files)
+        print(f"Corpus: {len(html_files)} documents, {corpus_bytes / (1024 * 1024):.1f} MB")
+
+        results = {
+            'environment': environment(),
+            'corpus': {
+                'path': args.corpus,
+                'count': len(html_files),
+                'size': None if args.corpus else args.size,
+                'seed': None if args.corpus else args.seed,
+                'bytes': corpus_bytes,
+            },
+        }
+
+        # 2. Single-document latency
+        if not args.skip_latency:
+            latency = measure_latency(html_files, os.path.join(work_dir, 'latency'))
+            results['latency'] = latency
+            seconds = latency['seconds']
+            print(f"Latency: p50 {seconds['p50']:.3f} s, p90 {seconds['p90']:.3f} s, "
+                  f"p99 {seconds['p99']:.3f} s, max {seconds['max']:.3f} s, "
+                  f"peak RSS {latency['peak_rss'] / (1024 * 1024):.0f} MB")
+            for name, summary in latency['stages'].items():
+                print(f"  {name:7} p50 {summary['p50']:.4f} s  p99 {summary['p99']:.4f} s")
+
+        # 3. Batch throughput per worker count
+        results['throughput'] = []
+        for workers in worker_counts:
+            run = measure_throughput(corpus_dir, os.path.join(work_dir, f"batch{workers}"), workers)
+            results['throughput'].append(run)
+            print(f"{workers:2} workers: {run['documents_per_second']:.2f} docs/s, "
+                  f"{run['pages_per_second']:.2f} pages/s, worker peak RSS "
+                  f"{run['worker_peak_rss'] / (1024 * 1024):.0f} MB")
+
+        # 4. Size and speed of each output profile
+        if profiles:
+            results['profiles'] = measure_profiles(html_files, os.path.join(work_dir, 'profiles'), profiles)
+            for run in results['profiles']:
+                print(f"Profile {run['profile']:8}: {run['seconds_per_document']:.3f} s per document, "
+                      f"{run['bytes_per_document'] / 1024:.0f} KB per PDF "
+                      f"({run['output_bytes'] / (1024 * 1024):.1f} MB total)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Cold start benchmark.
+
+Runs each command in a fresh interpreter several times and reports the
+min/median/max wall-clock time:
+
+- ``python -c pass``: the interpreter alone, the floor for everything else;
+- ``cli.py --help``: what every cron invocation pays before doing any work;
+- ``import main``: the conversion API without WeasyPrint;
+- ``main.load_weasyprint()``: the extra cost of the first conversion in a
+  process, when WeasyPrint and its native libraries are loaded.
+
+The modules that take longest to import for ``cli.py --help`` are listed
+from ``python -X importtime``. With ``--max-seconds`` the run fails (exit
+status 1) when the median ``cli.py --help`` time exceeds the budget, so it
+can guard startup time in CI.
+
+Usage:
+    python -m benchmark.startup [--runs 10] [--max-seconds 0.3] [--output startup.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    'interpreter': ['-c', 'pass'],
+    'cli_help': ['cli.py', '--help'],
+    'import_main': ['-c', 'import main'],
+    'load_weasyprint': ['-c', 'import main; main.load_weasyprint()'],
+}
+
+
+def time_command(args, runs):
+    """Run ``python <args>`` ``runs`` times and return min/median/max seconds."""
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=ROOT, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        seconds.append(time.perf_counter() - start)
+    return {
+        'min': round(min(seconds), 4),
+        'median': round(statistics.median(seconds), 4),
+        'max': round(max(seconds), 4),
+    }
+
+
+def slowest_imports(args, limit=10):
+    """Return (module, cumulative seconds) of the top-level imports that take longest for ``python <args>``."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', *args], cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Only modules imported directly by the script, not their dependencies
+        if not name.strip() or name.startswith('  ') or not cumulative.strip().isdigit():
+            continue
+        imports.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(imports, key=lambda entry: entry[1], reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold start time of the CLI and the conversion API.')
+    parser.add_argument('--runs', type=int, default=10, help='Runs of each command (default: %(default)s)')
+    parser.add_argument('--max-seconds', type=float,
+                        help='Fail if the median cli.py --help time is above this many seconds')
+    parser.add_argument('--output', help='Save the results as JSON')
+    args = parser.parse_args()
+
+    results = {}
+    for name, command in COMMANDS.items():
+        try:
+            results[name] = time_command(command, args.runs)
+        except subprocess.CalledProcessError:
+            # WeasyPrint's native libraries may be missing on this machine
+            print(f"{name:16} failed")
+            continue
+        timing = results[name]
+        print(f"{name:16} median {timing['median'] * 1000:7.1f} ms  "
+              f"(min {timing['min'] * 1000:.1f}, max {timing['max'] * 1000:.1f})")
+
+    imports = slowest_imports(COMMANDS['cli_help'])
+    results['cli_help_imports'] = [{'module': module, 'seconds': seconds} for module, seconds in imports]
+    print("Slowest imports for cli.py --help:")
+    for module, seconds in imports:
+        print(f"  {module:24} {seconds * 1000:7.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+    if args.max_seconds is not None and 'cli_help' in results:
+        median = results['cli_help']['median']
+        if median > args.max_seconds:
+            print(f"cli.py --help took {median:.3f} s, over the {args.max_seconds:.3f} s budget")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+"""
+Splitting one batch across several hosts that share a filesystem.
+
+Two ways to divide the work, which can be combined:
+
+Sharding: ``--shard i/N`` makes a batch convert only the documents whose
+relative path hashes to shard i of N. Every host gets a fixed, disjoint
+part of the tree with no coordination at all, but a slow host finishes
+last.
+
+Claiming: with WorkClaims every host scans the whole tree and takes
+documents one at a time by creating a lease file in the output directory
+with O_CREAT | O_EXCL, which exactly one host can win. A finished
+document gets a marker file (written to a temporary name and renamed into
+place, so it is never seen half written) recording the input it was
+converted from, and its lease is removed. Hosts renew their leases while
+they work; a lease left behind by a host that died stops being renewed and
+is reclaimed by renaming it away, which again only one host can do, once
+it is older than the lease timeout.
+
+Leases and markers live in ``.leases`` in the output directory, one file
+per document named after the hash of its relative path. The timeout should
+comfortably exceed the clock skew between hosts.
+"""
+import hashlib
+import json
+import os
+import socket
+import time
+
+LEASE_DIR = '.leases'
+
+# Seconds without renewal after which a lease is considered abandoned
+DEFAULT_LEASE_TIMEOUT = 600
+
+
+def parse_shard(text):
+    """
+    Parse a shard specification like '2/4' into (2, 4).
+
+    Raises:
+        ValueError: If the text is not 'i/N' with 1 <= i <= N
+    """
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard {text!r}, expected i/N (e.g. 1/4)") from None
+    if not 1 <= index <= count:
+        raise ValueError(f"Invalid shard {text!r}, i must be between 1 and N")
+    return index, count
+
+
+def _path_key(rel_path):
+    """Stable key of a relative path, the same on every host and OS."""
+    return rel_path.replace(os.sep, '/')
+
+
+def shard_of(rel_path, count):
+    """Return the shard (1 to count) a document belongs to."""
+    digest = hashlib.sha1(_path_key(rel_path).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count + 1
+
+
+def in_shard(rel_path, shard):
+    """True if rel_path belongs to shard (index, count)."""
+    index, count = shard
+    return shard_of(rel_path, count) == index
+
+
+def shard_file_name(file_name, shard):
+    """Per-shard name of a state file, e.g. journal.shard-2-of-4.sqlite3."""
+    if shard is None:
+        return file_name
+    stem, extension = os.path.splitext(file_name)
+    return f"{stem}.shard-{shard[0]}-of-{shard[1]}{extension}"
+
+
+class WorkClaims:
+    """
+    Lease and completion files shared by every host working on one tree.
+
+    Args:
+        directory: Directory for the lease and marker files
+        lease_timeout: Seconds without renewal before a lease is reclaimed
+        owner: Identifies this process in its leases (default: host:pid)
+    """
+
+    def __init__(self, directory, lease_timeout=DEFAULT_LEASE_TIMEOUT, owner=None):
+        self.directory = directory
+        self.lease_timeout = lease_timeout
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        # Relative path -> lease file, for the leases this process holds
+        self.held = {}
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def in_directory(cls, output_dir, **kwargs):
+        return cls(os.path.join(output_dir, LEASE_DIR), **kwargs)
+
+    def _paths(self, rel_path):
+        name = hashlib.sha1(_path_key(rel_path).encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, name)
+        return base + '.lease', base + '.done'
+
+    def finished(self, rel_path, input_fingerprint):
+        """Return the completion marker of rel_path if it matches the input as it is now, else None."""
+        _, done_path = self._paths(rel_path)
+        try:
+            with open(done_path, encoding='utf-8') as f:
+                marker = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if input_fingerprint is None or marker.get('fingerprint') != list(input_fingerprint):
+            return None
+        return marker
+
+    def acquire(self, rel_path, input_fingerprint, retry_failed=False):
+        """
+        Decide who converts rel_path.
+
+        Returns:
+            (marker, claimed): the completion marker if the document is
+            already finished for this input, and whether this process now
+            holds its lease. (None, False) means another host is on it.
+        """
+        marker = self.finished(rel_path, input_fingerprint)
+        retry = retry_failed and marker is not None and marker['status'] == 'failed'
+        if marker is not None and not retry:
+            return marker, False
+        if not self.claim(rel_path):
+            return None, False
+        # The previous holder may have finished between our check and claim
+        latest = self.finished(rel_path, input_fingerprint)
+        if latest is not None and (not retry or latest['time'] != marker['time']):
+            self.release(rel_path)
+            return latest, False
+        return marker, True
+
+    def claim(self, rel_path):
+        """
+        Try to take the lease of rel_path.
+
+        Returns:
+            True if this process now holds the lease, False if another
+            live process does
+        """
+        lease_path, _ = self._paths(rel_path)
+        for _ in range(2):
+            try:
+                fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._reclaim(lease_path):
+                    return False
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'owner': self.owner, 'rel_path': _path_key(rel_path), 'time': time.time()}, f)
+            self.held[rel_path] = lease_path
+            return True
+        return False
+
+    def _reclaim(self, lease_path):
+        """Remove a lease whose owner stopped renewing it; True if it is gone."""
+        try:
+            if time.time() - os.stat(lease_path).st_mtime < self.lease_timeout:
+                return False
+        except FileNotFoundError:
+            return True
+        # Only one process can rename the lease away
+        stale_path = f"{lease_path}.stale.{self.owner.replace(os.sep, '_')}"
+        try:
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            return True
+        try:
+            # Another host may have reclaimed it and taken a fresh lease
+            # between our stat and rename; give that one back
+            if time.time() - os.stat(stale_path).st_mtime < self.lease_timeout:
+                try:
+                    os.link(stale_path, lease_path)
+                except FileExistsError:
+                    pass
+                return False
+            print(f"Reclaimed abandoned lease {os.path.basename(lease_path)}")
+            return True
+        finally:
+            os.unlink(stale_path)
+
+    def renew(self):
+        """Refresh the leases this process holds, so no other host reclaims them."""
+        for lease_path in self.held.values():
+            try:
+                os.utime(lease_path)
+            except OSError:
+                pass
+
+    def finish(self, rel_path, input_fingerprint, status, error=None):
+        """Record rel_path as 'done' or 'failed' for this input and drop its lease."""
+        _, done_path = self._paths(rel_path)
+        marker = {
+            'rel_path': _path_key(rel_path),
+            'fingerprint': list(input_fingerprint) if input_fingerprint else None,
+            'status': status,
+            'error': error,
+            'owner': self.owner,
+            'time': time.time(),
+        }
+        temp_path = f"{done_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(marker, f)
+        os.replace(temp_path, done_path)
+        self.release(rel_path)
+
+    def release(self, rel_path):
+        """Give up the lease of rel_path, if this process holds it."""
+        lease_path = self.held.pop(rel_path, None)
+        if lease_path is None:
+            return
+        try:
+            with open(lease_path, encoding='utf-8') as f:
+                if json.load(f).get('owner') != self.owner:
+                    return  # reclaimed by another host meanwhile
+            os.unlink(lease_path)
+        except (OSError, ValueError):
+            pass
+
+    def release_all(self):
+        for rel_path in list(self.held):
+            self.release(rel_path)
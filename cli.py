@@ -2,7 +2,19 @@
 import argparse
 import os
 import sys
-from main import html_to_pdf, batch_convert_html_to_pdf
+from main import DEFAULT_RETRIES, html_to_pdf, batch_convert_html_to_pdf, convert_html, convert_file, merge_html_to_pdf, MERGE_ORDERS
+from metrics import profile_conversion
+from pool import DEFAULT_MAX_TASKS_PER_WORKER
+from render_cache import RenderCache, DEFAULT_CACHE_SIZE
+import server
+from assets import AssetFetcher
+from profiles import PROFILES, DEFAULT_PROFILE
+import watch
+import templates
+import sections
+import routing
+from archives import is_archive
+from claims import DEFAULT_LEASE_TIMEOUT, parse_shard
 
 def get_user_input(prompt, validator=None, error_message=None):
     """Get and validate user input."""
@@ -31,6 +43,52 @@ def create_directory_if_not_exists(path):
             return False
     return True
 
+def shard_argument(text):
+    """argparse type for --shard i/N."""
+    try:
+        return parse_shard(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def workers_argument(text):
+    """argparse type for --workers: a positive number or 'auto'."""
+    if text == 'auto':
+        return text
+    try:
+        workers = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a number or 'auto', got {text!r}")
+    if workers <= 0:
+        raise argparse.ArgumentTypeError("the number of workers must be positive")
+    return workers
+
+def convert_stream(input_path, output_path, profile=None, url_fetcher=None):
+    """
+    Convert a single document where '-' means stdin (input) or stdout (output).
+    Status messages go to stderr so they never mix with PDF data on stdout.
+    Relative URLs of a named input file resolve against its location; those
+    of stdin resolve against the current directory.
+    """
+    try:
+        base_url = None
+        if input_path == '-':
+            source = sys.stdin.buffer.read()
+        else:
+            base_url = input_path
+            with open(input_path, 'rb') as f:
+                source = f.read()
+        
+        if output_path is None or output_path == '-':
+            convert_html(source, sys.stdout.buffer, base_url=base_url, url_fetcher=url_fetcher, profile=profile)
+            sys.stdout.buffer.flush()
+        else:
+            with open(output_path, 'wb') as f:
+                convert_html(source, f, base_url=base_url, url_fetcher=url_fetcher, profile=profile)
+            print(f"Conversion successful! PDF saved to: {output_path}", file=sys.stderr)
+    except Exception as e:
+        print(f"Conversion failed: {e}", file=sys.stderr)
+        sys.exit(1)
+
 def interactive_mode():
     """Run the CLI in interactive mode."""
     print("HTML to PDF Converter")
@@ -106,14 +164,115 @@ def interactive_mode():
         # Convert the files
         batch_convert_html_to_pdf(input_dir, output_dir, workers)
 
+def common_options():
+    """
+    Options shared by the converter and the serve command, declared once.
+    
+    Nothing here has a default, so an option given before 'serve' is not
+    reset by the subcommand; main() sets the defaults on the top-level parser.
+    Parsers share the actions of a parent, so each needs its own copy.
+    """
+    common = argparse.ArgumentParser(add_help=False, argument_default=argparse.SUPPRESS)
+    common.add_argument('--workers', '-w', type=workers_argument,
+                        help="Number of parallel workers, or 'auto' to raise and lower it during a batch "
+                             "to fit --memory-budget (Linux)")
+    common.add_argument('--timeout', type=float,
+                        help=f'Seconds a document may take before its worker is killed '
+                             f'(default: none; {server.DEFAULT_TIMEOUT:g} for serve)')
+    common.add_argument('--max-tasks-per-worker', type=int,
+                        help=f'Documents each worker converts before it is recycled '
+                             f'(default: {DEFAULT_MAX_TASKS_PER_WORKER})')
+    common.add_argument('--asset-cache', help='Directory for an on-disk cache of remote images, fonts and stylesheets')
+    common.add_argument('--offline', action='store_true',
+                        help='Never fetch assets over the network; only local files and cached copies are used')
+    common.add_argument('--output-profile', choices=list(PROFILES),
+                        help=f'Trade PDF size against speed: fast, balanced (smaller images) or archive (PDF/A); '
+                             f'serve uses it for requests without a profile parameter (default: {DEFAULT_PROFILE})')
+    return common
+
 def main():
     """Main entry point for the CLI."""
-    parser = argparse.ArgumentParser(description='Convert HTML files to PDF with expanded content.')
-    parser.add_argument('--file', '-f', help='Path to a single HTML file to convert')
-    parser.add_argument('--output', '-o', help='Output PDF file path (for single file conversion)')
-    parser.add_argument('--input-dir', '-i', help='Input directory containing HTML files')
-    parser.add_argument('--output-dir', '-d', help='Output directory for PDF files')
-    parser.add_argument('--workers', '-w', type=int, help='Number of parallel workers for batch conversion')
+    parser = argparse.ArgumentParser(description='Convert HTML files to PDF with expanded content.',
+                                     parents=[common_options()])
+    parser.set_defaults(workers=None, timeout=None, max_tasks_per_worker=DEFAULT_MAX_TASKS_PER_WORKER,
+                        asset_cache=None, offline=False, output_profile=DEFAULT_PROFILE)
+    parser.add_argument('--file', '-f', help="Path to a single HTML file to convert ('-' for stdin)")
+    parser.add_argument('--output', '-o', help="Output PDF file path (for single file conversion, '-' for stdout)")
+    parser.add_argument('--input-dir', '-i', help='Input directory containing HTML files, or a .zip or .tar(.gz) archive of them')
+    parser.add_argument('--output-dir', '-d', help='Output directory for PDF files (a path ending in .zip collects '
+                                                   'the PDFs of an archive input in one zip file)')
+    parser.add_argument('--memory-budget', type=int,
+                        help="Resident memory in MB all workers together may use with --workers auto "
+                             "(default: 3/4 of the memory available at the start)")
+    parser.add_argument('--cache-dir', help='Directory for the render cache; unchanged documents are not re-rendered')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+                        help='Maximum render cache size in MB (default: %(default)s)')
+    parser.add_argument('--max-worker-memory', type=int,
+                        help='Resident memory in MB a worker may use before it is killed (batch conversion, Linux)')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help='Extra attempts for documents whose worker crashed, timed out or ran out of memory '
+                             '(default: %(default)s)')
+    parser.add_argument('--retry-quarantined', action='store_true',
+                        help='Convert documents quarantined by earlier batches anyway')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip documents an earlier batch into the same output directory already converted')
+    parser.add_argument('--schedule', choices=['largest-first', 'scan'], default='largest-first',
+                        help='Batch order: costliest documents first, or in the order they are found (default: %(default)s)')
+    parser.add_argument('--small-cost', type=float, default=routing.DEFAULT_SMALL_COST,
+                        help='Estimated cost below which a document is small and shares a worker round trip with '
+                             'others, or renders in this process with --local-threads; 0 to disable (default: %(default)s)')
+    parser.add_argument('--small-batch', type=int, default=routing.DEFAULT_SMALL_BATCH,
+                        help='Most small documents sent to a worker at a time (default: %(default)s)')
+    parser.add_argument('--local-threads', type=int, default=0,
+                        help='Threads in this process that render small documents (batch conversion, default: %(default)s)')
+    parser.add_argument('--shard', type=shard_argument, metavar='I/N',
+                        help='Convert only shard I of N of the input tree (by hash of relative path), e.g. 2/4')
+    parser.add_argument('--claim', action='store_true',
+                        help='Share the batch with other hosts through lease files in the output directory')
+    parser.add_argument('--lease-timeout', type=float, default=DEFAULT_LEASE_TIMEOUT,
+                        help='Seconds before the lease of a host that stopped working is taken over (default: %(default)s)')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and convert files in --input-dir as they are created or changed')
+    parser.add_argument('--debounce', type=float, default=watch.DEFAULT_DEBOUNCE,
+                        help='Seconds a file must stay unchanged before it is converted in watch mode (default: %(default)s)')
+    parser.add_argument('--poll-interval', type=float,
+                        help='Poll for changes every this many seconds instead of using inotify (watch mode)')
+    parser.add_argument('--split-sections', type=float, nargs='?', const=sections.DEFAULT_CHUNK_BYTES / (1024 * 1024),
+                        metavar='MB',
+                        help='Lay out the top-level sections of one large --file on several workers, in chunks '
+                             'of at most MB of HTML (default: %(const)s), and join the pages')
+    parser.add_argument('--template', '-t',
+                        help='HTML template with $field placeholders, rendered once per record of --data into --output-dir')
+    parser.add_argument('--data', help="JSON-lines or CSV file of records for --template ('-' for stdin)")
+    parser.add_argument('--data-format', choices=templates.DATA_FORMATS,
+                        help='Format of --data (default: from its extension; jsonl for stdin)')
+    parser.add_argument('--name', default=templates.DEFAULT_NAME_PATTERN,
+                        help='Output file name for each record, with $field placeholders and $index '
+                             '(default: %(default)s)')
+    parser.add_argument('--chunk-size', type=int, default=templates.DEFAULT_CHUNK_SIZE,
+                        help='Records sent to a worker at a time (default: %(default)s)')
+    parser.add_argument('--merge', metavar='OUTPUT_PDF',
+                        help='Render all HTML files in --input-dir into this single PDF')
+    parser.add_argument('--order', choices=MERGE_ORDERS, default='path',
+                        help='Order of the documents in a merged PDF (default: %(default)s)')
+    parser.add_argument('--toc', action='store_true', help='Start a merged PDF with a table of contents')
+    parser.add_argument('--report', help='Write a JSON-lines report with per-document timings and memory (batch conversion)')
+    parser.add_argument('--profile', metavar='PREFIX',
+                        help='Profile a single file conversion with cProfile and tracemalloc; '
+                             'results are written to PREFIX.prof, PREFIX.txt and PREFIX.memory.txt')
+    
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser('serve', help='Run a local HTTP conversion service',
+                                         parents=[common_options()])
+    serve_parser.add_argument('--host', default=server.DEFAULT_HOST, help='Interface to listen on (default: %(default)s)')
+    serve_parser.add_argument('--port', type=int, default=server.DEFAULT_PORT, help='Port to listen on (default: %(default)s)')
+    serve_parser.add_argument('--queue-depth', type=int, default=server.DEFAULT_QUEUE_DEPTH,
+                              help='Requests that may wait for a worker before new ones get 429 (default: %(default)s)')
+    serve_parser.add_argument('--max-body', type=int, default=server.DEFAULT_MAX_BODY // (1024 * 1024),
+                              help='Largest request body in MB; bigger ones get 413 (default: %(default)s)')
+    serve_parser.add_argument('--allow-local-files', action='store_true',
+                              help='Let requests read files on the server through file: URLs and base_url '
+                                   '(only for trusted callers)')
     
     args = parser.parse_args()
     
@@ -122,26 +281,121 @@ def main():
         interactive_mode()
         return
     
+    url_fetcher = None
+    if args.asset_cache or args.offline:
+        url_fetcher = AssetFetcher(args.asset_cache, offline=args.offline)
+    
+    if args.command == 'serve':
+        # The pool of the service has a fixed size
+        workers = None if args.workers == 'auto' else args.workers
+        timeout = server.DEFAULT_TIMEOUT if args.timeout is None else args.timeout
+        server.serve(args.host, args.port, workers, args.queue_depth, timeout,
+                     args.max_tasks_per_worker, url_fetcher=url_fetcher, profile=args.output_profile,
+                     max_body=args.max_body * 1024 * 1024, local_files=args.allow_local_files)
+        return
+    
+    cache = None
+    if args.cache_dir:
+        cache = RenderCache(args.cache_dir, max_size=args.cache_size * 1024 * 1024)
+    
+    # Only directory batches size their pool by memory; other modes use the default
+    workers = None if args.workers == 'auto' else args.workers
+    
     # Handle command-line arguments
     if args.file:
+        # Streamed conversion from stdin and/or to stdout
+        if args.file == '-' or args.output == '-':
+            convert_stream(args.file, args.output, args.output_profile, url_fetcher)
+            return
+        
         # Single file conversion
         if not os.path.isfile(args.file):
             print(f"Error: File not found: {args.file}")
             return
         
-        result = html_to_pdf(args.file, args.output)
+        # Profiled conversion runs in this process so every stage is captured
+        if args.profile:
+            pdf_path = args.output or os.path.splitext(args.file)[0] + '.pdf'
+            try:
+                record = profile_conversion(convert_file, (args.file, pdf_path, url_fetcher, args.output_profile),
+                                            args.profile)
+            except Exception as e:
+                print(f"Conversion failed: {e}")
+                return
+            stages = ', '.join(f"{name} {seconds:.3f}s" for name, seconds in record['stages'].items())
+            print(f"Converted {args.file} to {pdf_path} in {record['elapsed']:.2f} seconds ({stages})")
+            return
+        
+        if args.split_sections:
+            sections.chunked_html_to_pdf(args.file, args.output, workers,
+                                         chunk_bytes=int(args.split_sections * 1024 * 1024),
+                                         max_tasks_per_worker=args.max_tasks_per_worker, url_fetcher=url_fetcher,
+                                         profile=args.output_profile)
+            return
+        
+        result = html_to_pdf(args.file, args.output, cache=cache, url_fetcher=url_fetcher,
+                             profile=args.output_profile)
         if result:
             print(f"Conversion successful! PDF saved to: {result}")
         else:
             print("Conversion failed.")
     
+    elif args.template:
+        # One PDF per record of the data feed
+        if not os.path.isfile(args.template):
+            print(f"Error: File not found: {args.template}")
+            return
+        if not args.data:
+            print("Error: --template needs --data")
+            return
+        max_worker_rss = args.max_worker_memory * 1024 * 1024 if args.max_worker_memory else None
+        try:
+            templates.render_template(args.template, args.data, args.output_dir or '.', workers,
+                                      chunk_size=args.chunk_size, name_pattern=args.name,
+                                      data_format=args.data_format, max_tasks_per_worker=args.max_tasks_per_worker,
+                                      timeout=args.timeout, max_worker_rss=max_worker_rss, url_fetcher=url_fetcher,
+                                      profile=args.output_profile)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+    
     elif args.input_dir:
         # Batch conversion
-        if not os.path.isdir(args.input_dir):
+        if is_archive(args.input_dir):
+            if args.merge or args.watch or args.claim or args.shard or args.resume or cache is not None:
+                print("Error: --merge, --watch, --claim, --shard, --resume and --cache-dir need a directory, "
+                      "not an archive")
+                return
+        elif not os.path.isdir(args.input_dir):
             print(f"Error: Directory not found: {args.input_dir}")
             return
         
-        batch_convert_html_to_pdf(args.input_dir, args.output_dir, args.workers)
+        if args.merge:
+            merge_html_to_pdf(args.input_dir, args.merge, workers, order=args.order, toc=args.toc,
+                              max_tasks_per_worker=args.max_tasks_per_worker, url_fetcher=url_fetcher,
+                              profile=args.output_profile)
+            return
+        
+        max_worker_rss = args.max_worker_memory * 1024 * 1024 if args.max_worker_memory else None
+        if args.watch:
+            watch.watch(args.input_dir, args.output_dir, workers, debounce=args.debounce,
+                        poll_interval=args.poll_interval, max_tasks_per_worker=args.max_tasks_per_worker,
+                        timeout=args.timeout, max_worker_rss=max_worker_rss, cache=cache,
+                        report_path=args.report, schedule=args.schedule, retries=args.retries,
+                        retry_quarantined=args.retry_quarantined, url_fetcher=url_fetcher,
+                        profile=args.output_profile, small_cost=args.small_cost, small_batch=args.small_batch,
+                        local_threads=args.local_threads)
+            return
+        
+        batch_convert_html_to_pdf(args.input_dir, args.output_dir, args.workers,
+                                  max_tasks_per_worker=args.max_tasks_per_worker, cache=cache,
+                                  report_path=args.report, schedule=args.schedule, timeout=args.timeout,
+                                  max_worker_rss=max_worker_rss,
+                                  retries=args.retries, retry_quarantined=args.retry_quarantined,
+                                  resume=args.resume, url_fetcher=url_fetcher, profile=args.output_profile,
+                                  shard=args.shard, claims=args.claim, lease_timeout=args.lease_timeout,
+                                  small_cost=args.small_cost, small_batch=args.small_batch,
+                                  local_threads=args.local_threads,
+                                  memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget else None)
     
     else:
         parser.print_help()
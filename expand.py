@@ -0,0 +1,142 @@
+"""
+Expansion of hidden content in HTML documents.
+
+``parse_expanded`` parses a document once with tinyhtml5 and applies every
+expansion rule in a single walk over the tree, which can then be handed to
+WeasyPrint directly. ``expand_html_text`` is the original text-based path,
+four regex/replace passes over the whole document; it is kept as the
+reference the benchmark compares against.
+"""
+import re
+from xml.etree.ElementTree import Element
+
+# Comprehensive CSS for expanding all hidden content
+EXPAND_CSS = """
+    /* Show all collapsible content */
+    .content { display: block !important; }
+    .collapsible:after { content: "\\26C5" !important; }
+    
+    /* Show any elements with display:none */
+    [style*="display: none"],
+    [style*="display:none"] { display: block !important; }
+    
+    /* Check all checkboxes */
+    input[type="checkbox"] { 
+        -webkit-appearance: checkbox !important;
+        -moz-appearance: checkbox !important;
+        appearance: checkbox !important;
+        opacity: 1 !important;
+        display: inline-block !important;
+        margin: 2px !important;
+        position: static !important;
+        visibility: visible !important;
+        box-sizing: border-box !important;
+    }
+    
+    /* Show any hidden content by ID */
+    #hid { display: block !important; }
+"""
+
+# Show-hidden-content CSS injected into the document's <head>
+INJECTED_CSS = """
+        .content { display: block !important; }
+        #hid, [style*="display: none"], [style*="display:none"] { display: block !important; }
+        input[type="checkbox"] { checked: checked; }
+        """
+CSS_INJECTION = f"<style>{INJECTED_CSS}</style>"
+
+_DISPLAY_NONE_RE = re.compile(r'display:\s*none')
+
+
+def expand_element(element):
+    """Apply the per-element expansion rules to one element, in place."""
+    # Replace display:none with display:block in style attributes
+    style = element.get('style')
+    if style and 'none' in style:
+        expanded = _DISPLAY_NONE_RE.sub('display:block', style)
+        if expanded != style:
+            element.set('style', expanded)
+
+    # Check all checkboxes
+    if element.tag == 'input' and element.get('type', '').lower() == 'checkbox':
+        element.set('checked', 'checked')
+
+
+def expand_tree(root, injected_css=INJECTED_CSS):
+    """
+    Expand hidden content in a parsed HTML tree, in place.
+
+    Args:
+        root: Root element returned by tinyhtml5.parse
+        injected_css: CSS text added to the document's <head>
+    """
+    head = None
+    for element in root.iter():
+        tag = element.tag
+        if tag == 'head':
+            if head is None:
+                head = element
+            continue
+        expand_element(element)
+
+    # tinyhtml5 always creates a <head>, but be defensive about odd trees
+    if head is None:
+        head = Element('head')
+        root.insert(0, head)
+    style_element = Element('style')
+    style_element.text = injected_css
+    head.append(style_element)
+    return root
+
+
+def parse_expanded(html_content, injected_css=INJECTED_CSS, **parse_options):
+    """
+    Parse an HTML document and expand its hidden content in a single walk.
+
+    Args:
+        html_content: HTML document as str or bytes
+        injected_css: CSS text added to the document's <head>
+        parse_options: Extra tinyhtml5.parse options (e.g. encodings for bytes)
+
+    Returns:
+        The root element of the expanded tree
+    """
+    import tinyhtml5
+
+    root = tinyhtml5.parse(html_content, namespace_html_elements=False, **parse_options)
+    return expand_tree(root, injected_css)
+
+
+def expand_html_text(html_content, css_injection=CSS_INJECTION):
+    """
+    Expand hidden content with text substitutions on the raw document.
+
+    This is the original preprocessing path, kept for comparison.
+
+    Args:
+        html_content: HTML document as str
+        css_injection: <style> element added before </head>
+    """
+    modified_html = html_content
+
+    # 1. Replace display:none with display:block in style attributes
+    modified_html = re.sub(r'style=(["\'])([^"\']*?)display:\s*none([^"\']*?)(\1)',
+                          r'style=\1\2display:block\3\1', modified_html)
+
+    # 2. Add show-hidden-content CSS to head or create a head if not present
+    if "</head>" in modified_html:
+        modified_html = modified_html.replace("</head>", f"{css_injection}</head>")
+    elif "<html" in modified_html:
+        modified_html = modified_html.replace("<html", f"<html><head>{css_injection}</head>")
+    else:
+        modified_html = f"<html><head>{css_injection}</head>{modified_html}</html>"
+
+    # 3. Directly modify any script-hidden content to be visible
+    modified_html = modified_html.replace('id="hid" style="display:none"', 'id="hid" style="display:block"')
+
+    # 4. Check all checkboxes
+    modified_html = re.sub(r'<input type=["\']checkbox["\']',
+                         r'<input type="checkbox" checked="checked"',
+                         modified_html)
+
+    return modified_html
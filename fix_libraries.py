@@ -1,11 +1,16 @@
+"""
+Help WeasyPrint find Homebrew's Pango, Cairo and friends on macOS.
+
+Importing this module applies the workaround on macOS only; elsewhere the
+system's library lookup is left alone. It must be imported before
+WeasyPrint loads its native libraries.
+"""
 import os
 import sys
-import ctypes
-from ctypes.util import find_library
-from functools import partial
+import ctypes.util
 
 # Original find_library function
-orig_find_library = find_library
+orig_find_library = ctypes.util.find_library
 
 # Define the library paths
 library_paths = [
@@ -16,9 +21,6 @@ library_paths = [
     "/usr/local/opt/freetype/lib",
 ]
 
-# Add these paths to DYLD_LIBRARY_PATH
-os.environ['DYLD_LIBRARY_PATH'] = ':'.join(library_paths + [os.environ.get('DYLD_LIBRARY_PATH', '')])
-
 # Map library names to actual files
 library_mapping = {
     'libpango-1.0-0': '/usr/local/opt/pango/lib/libpango-1.0.dylib',
@@ -30,18 +32,26 @@ library_mapping = {
 
 # Overriding find_library function
 def custom_find_library(name):
-    if name in library_mapping:
+    if name in library_mapping and os.path.exists(library_mapping[name]):
         return library_mapping[name]
-    
+
     # Try to find in our known library paths
     for path in library_paths:
         if os.path.exists(f"{path}/lib{name}.dylib"):
             return f"{path}/lib{name}.dylib"
         if os.path.exists(f"{path}/lib{name}.0.dylib"):
             return f"{path}/lib{name}.0.dylib"
-    
+
     # Fall back to original function
     return orig_find_library(name)
 
-# Replace the standard find_library function
-ctypes.util.find_library = custom_find_library
\ No newline at end of file
+def apply():
+    """Point the library search at the Homebrew paths (macOS only, idempotent)."""
+    if sys.platform != 'darwin' or ctypes.util.find_library is custom_find_library:
+        return
+    # Add these paths to DYLD_LIBRARY_PATH
+    os.environ['DYLD_LIBRARY_PATH'] = ':'.join(library_paths + [os.environ.get('DYLD_LIBRARY_PATH', '')])
+    # Replace the standard find_library function
+    ctypes.util.find_library = custom_find_library
+
+apply()
@@ -6,6 +6,7 @@ from tkinter import ttk, filedialog, messagebox
 import threading
 import platform
 from main import html_to_pdf, batch_convert_html_to_pdf
+from profiles import PROFILES, DEFAULT_PROFILE
 
 class HTMLtoPDFConverter(tk.Tk):
     def __init__(self):
@@ -26,6 +27,9 @@ class HTMLtoPDFConverter(tk.Tk):
         self.notebook.add(self.single_file_tab, text="Single File")
         self.notebook.add(self.batch_tab, text="Batch Conversion")
         
+        # Output profile, shared by both tabs
+        self.profile_var = tk.StringVar(value=DEFAULT_PROFILE)
+        
         # Setup UI for each tab
         self.setup_single_file_tab()
         self.setup_batch_tab()
@@ -72,9 +76,12 @@ class HTMLtoPDFConverter(tk.Tk):
         pdf_entry.grid(column=1, row=1, sticky=(tk.W, tk.E), padx=5, pady=5)
         ttk.Button(frame, text="Browse...", command=self.browse_pdf_file).grid(column=2, row=1, padx=5, pady=5)
         
+        # Output profile selection
+        self.add_profile_selector(frame, row=2)
+        
         # Convert button
         convert_btn = ttk.Button(frame, text="Convert", command=self.convert_single_file)
-        convert_btn.grid(column=1, row=2, pady=20)
+        convert_btn.grid(column=1, row=3, pady=20)
         
         # Configure grid
         frame.columnconfigure(1, weight=1)
@@ -104,13 +111,23 @@ class HTMLtoPDFConverter(tk.Tk):
         workers_spinbox = ttk.Spinbox(frame, from_=1, to=16, textvariable=self.workers_var, width=5)
         workers_spinbox.grid(column=1, row=2, sticky=tk.W, padx=5, pady=5)
         
+        # Output profile selection
+        self.add_profile_selector(frame, row=3)
+        
         # Convert button
         convert_btn = ttk.Button(frame, text="Convert All", command=self.convert_batch)
-        convert_btn.grid(column=1, row=3, pady=20)
+        convert_btn.grid(column=1, row=4, pady=20)
         
         # Configure grid
         frame.columnconfigure(1, weight=1)
     
+    def add_profile_selector(self, frame, row):
+        """Add the output profile drop-down to a tab."""
+        ttk.Label(frame, text="Output Profile:").grid(column=0, row=row, sticky=tk.W, pady=5)
+        profile_box = ttk.Combobox(frame, textvariable=self.profile_var, values=list(PROFILES),
+                                   state="readonly", width=12)
+        profile_box.grid(column=1, row=row, sticky=tk.W, padx=5, pady=5)
+    
     def browse_html_file(self):
         """Open file dialog to select HTML file."""
         # Fix for macOS: Don't specify filetypes if on Mac
@@ -156,6 +173,7 @@ class HTMLtoPDFConverter(tk.Tk):
         """Convert a single HTML file to PDF."""
         html_file = self.html_file_var.get()
         pdf_file = self.pdf_file_var.get()
+        profile = self.profile_var.get()
         
         if not html_file:
             messagebox.showerror("Error", "Please select an HTML file.")
@@ -181,7 +199,7 @@ class HTMLtoPDFConverter(tk.Tk):
         # Run conversion in a separate thread to keep UI responsive
         def conversion_thread():
             try:
-                result = html_to_pdf(html_file, pdf_file)
+                result = html_to_pdf(html_file, pdf_file, profile=profile)
                 
                 # Update UI from the main thread
                 self.after(0, lambda: self.progress_var.set(100))
@@ -202,6 +220,7 @@ class HTMLtoPDFConverter(tk.Tk):
         """Convert all HTML files in a directory to PDFs."""
         input_dir = self.input_dir_var.get()
         output_dir = self.output_dir_var.get()
+        profile = self.profile_var.get()
         
         if not input_dir:
             messagebox.showerror("Error", "Please select an input directory.")
@@ -235,50 +254,32 @@ class HTMLtoPDFConverter(tk.Tk):
         self.progress_var.set(0)
         
         # Run conversion in a separate thread to keep UI responsive
+        def on_progress(event):
+            # Called from background threads; hand the update to the Tk loop
+            self.after(0, lambda: self.show_batch_progress(event))
+        
         def batch_conversion_thread():
             try:
-                # Find all HTML files
-                html_files = []
-                for root, _, files in os.walk(input_dir):
-                    for file in files:
-                        if file.lower().endswith(('.html', '.htm')):
-                            html_files.append(os.path.join(root, file))
+                # Same multi-process engine as the CLI, using the Workers setting
+                stats = batch_convert_html_to_pdf(input_dir, output_dir, workers, progress=on_progress,
+                                                  profile=profile)
                 
-                if not html_files:
+                if stats is None:
                     self.after(0, lambda: self.status_var.set(f"No HTML files found in {input_dir}"))
                     self.after(0, lambda: messagebox.showinfo("Info", f"No HTML files found in {input_dir}"))
                     return
                 
-                total_files = len(html_files)
-                self.after(0, lambda: self.status_var.set(f"Converting {total_files} HTML files..."))
-                
-                # Custom callback to update progress
-                completed = 0
-                
-                def progress_callback():
-                    nonlocal completed
-                    completed += 1
-                    progress = (completed / total_files) * 100
-                    self.after(0, lambda: self.progress_var.set(progress))
-                    self.after(0, lambda: self.status_var.set(f"Converting files: {completed}/{total_files}"))
-                
-                # Process each file
-                for i, html_file in enumerate(html_files):
-                    # Determine relative path to maintain directory structure
-                    rel_path = os.path.relpath(html_file, input_dir)
-                    pdf_file = os.path.join(output_dir, os.path.splitext(rel_path)[0] + '.pdf')
-                    
-                    # Create subdirectory if needed
-                    pdf_dir = os.path.dirname(pdf_file)
-                    if pdf_dir and not os.path.exists(pdf_dir):
-                        os.makedirs(pdf_dir, exist_ok=True)
-                    
-                    # Convert file
-                    html_to_pdf(html_file, pdf_file)
-                    progress_callback()
-                
-                self.after(0, lambda: self.status_var.set(f"Conversion complete. {total_files} files converted."))
-                self.after(0, lambda: messagebox.showinfo("Success", f"All {total_files} files converted successfully!"))
+                converted = stats['completed']
+                failed = stats['failed']
+                self.after(0, lambda: self.progress_var.set(100))
+                if failed:
+                    self.after(0, lambda: self.status_var.set(
+                        f"Conversion complete. {converted} files converted, {failed} failed."))
+                    self.after(0, lambda: messagebox.showwarning(
+                        "Finished with errors", f"{converted} files converted, {failed} failed."))
+                else:
+                    self.after(0, lambda: self.status_var.set(f"Conversion complete. {converted} files converted."))
+                    self.after(0, lambda: messagebox.showinfo("Success", f"All {converted} files converted successfully!"))
                 
             except Exception as e:
                 self.after(0, lambda: self.status_var.set(f"Error: {str(e)}"))
@@ -286,6 +287,18 @@ class HTMLtoPDFConverter(tk.Tk):
         
         threading.Thread(target=batch_conversion_thread, daemon=True).start()
 
+    def show_batch_progress(self, event):
+        """Update the progress bar and status line from a BatchEvent (Tk thread only)."""
+        finished = event.completed + event.failed
+        if event.kind == 'started':
+            self.status_var.set(f"Converting {os.path.basename(event.html_path)} ({finished} done)")
+        elif event.kind in ('done', 'failed', 'cached', 'skipped', 'scanned'):
+            if event.scanning:
+                self.status_var.set(f"Converting files: {finished} done, {event.found} found so far")
+            elif event.found:
+                self.progress_var.set((finished / event.found) * 100)
+                self.status_var.set(f"Converting files: {finished}/{event.found}")
+
 if __name__ == "__main__":
     app = HTMLtoPDFConverter()
     app.mainloop() 
\ No newline at end of file
@@ -0,0 +1,115 @@
+"""
+On-disk journal of batch conversions, for resuming interrupted runs.
+
+Every document that finishes (converted, served from the cache or failed)
+is recorded in a SQLite database in the output directory together with the
+size and modification time of its input. A resumed batch skips documents
+recorded as done whose input is unchanged and whose PDF is still there,
+and converts everything else again, including earlier failures.
+
+Writes are committed at most once per commit_interval, so a run that is
+killed loses at most that much of the journal; those documents are simply
+converted again. Only the process running the batch writes to the journal.
+"""
+import os
+import sqlite3
+import time
+
+JOURNAL_FILE = 'journal.sqlite3'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    html_path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    status TEXT NOT NULL,
+    pdf_path TEXT,
+    error TEXT,
+    updated REAL NOT NULL
+)
+"""
+
+
+def fingerprint(html_path):
+    """Return (size, mtime_ns) of an input file, or None if it cannot be read."""
+    try:
+        st = os.stat(html_path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class Journal:
+    """
+    Record of finished documents in one output directory.
+
+    Args:
+        path: SQLite database file (created if needed)
+        commit_interval: Seconds between commits
+    """
+
+    def __init__(self, path, commit_interval=1.0):
+        self.path = path
+        self.commit_interval = commit_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+        self._last_commit = time.monotonic()
+
+    @classmethod
+    def in_directory(cls, directory, **kwargs):
+        return cls(os.path.join(directory, JOURNAL_FILE), **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def is_done(self, html_path, input_fingerprint):
+        """True if html_path was converted from an identical input and its PDF still exists."""
+        if input_fingerprint is None:
+            return False
+        row = self._db.execute(
+            'SELECT size, mtime_ns, pdf_path FROM documents WHERE html_path = ? AND status = ?',
+            (os.path.abspath(html_path), 'done')).fetchone()
+        return (row is not None and tuple(row[:2]) == tuple(input_fingerprint)
+                and row[2] is not None and os.path.exists(row[2]))
+
+    def record(self, html_path, input_fingerprint, status, pdf_path=None, error=None):
+        """Record that html_path finished with status 'done' or 'failed'."""
+        size, mtime_ns = input_fingerprint or (None, None)
+        self._db.execute(
+            'INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (os.path.abspath(html_path), size, mtime_ns, status,
+             os.path.abspath(pdf_path) if pdf_path else None, error, time.time()))
+        if time.monotonic() - self._last_commit >= self.commit_interval:
+            self.commit()
+
+    def documents_under(self, path):
+        """Return (html_path, pdf_path) of every recorded document at or below path."""
+        path = os.path.abspath(path)
+        prefix = path.rstrip(os.sep) + os.sep
+        return self._db.execute(
+            'SELECT html_path, pdf_path FROM documents WHERE html_path = ? OR substr(html_path, 1, ?) = ?',
+            (path, len(prefix), prefix)).fetchall()
+
+    def forget(self, html_path):
+        """Remove the record of html_path, e.g. once its input is deleted."""
+        self._db.execute('DELETE FROM documents WHERE html_path = ?', (os.path.abspath(html_path),))
+
+    def counts(self):
+        """Return the number of recorded documents per status."""
+        return dict(self._db.execute('SELECT status, COUNT(*) FROM documents GROUP BY status'))
+
+    def commit(self):
+        self._db.commit()
+        self._last_commit = time.monotonic()
+
+    def close(self):
+        self.commit()
+        self._db.close()
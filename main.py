@@ -1,159 +1,1305 @@
-import fix_libraries  # Keep your existing import
-from weasyprint import HTML, CSS
 import os
-from pathlib import Path
+from urllib.parse import urljoin
+import collections
+import contextlib
+import functools
+import html
+import io
 import concurrent.futures
-import time
+import dataclasses
+import heapq
+import codecs
+import itertools
 import re
+import time
+from pool import ConverterPool, DEFAULT_MAX_TASKS_PER_WORKER, WorkerCrashedError
+from quarantine import Quarantine, QUARANTINE_FILE
+from journal import Journal, JOURNAL_FILE, fingerprint
+from claims import WorkClaims, DEFAULT_LEASE_TIMEOUT, in_shard, shard_file_name
+from render_cache import RenderCache
+import stylesheets
+import assets
+from expand import EXPAND_CSS, INJECTED_CSS, expand_tree
+from cost import estimate_cost
+from metrics import ConversionMetrics, JsonlReport, peak_rss, reset_peak_rss
+from profiles import profile_options
+
+# WeasyPrint, its native libraries, the HTML parser and pypdf are imported
+# on first use, so the CLI and GUI start without loading them; warm pool
+# workers load them before their first task (see pool.warm_up)
+
+# <meta charset="..."> or <meta http-equiv=... content="...; charset=...">
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?([A-Za-z0-9_.:-]+)', re.IGNORECASE)
 
-def html_to_pdf(html_path, pdf_path=None):
+# Bump when preprocessing changes the rendered output, to invalidate cached PDFs
+RENDER_PIPELINE_VERSION = 3
+
+def load_weasyprint():
+    """Import WeasyPrint, applying the library path workaround first where needed."""
+    import fix_libraries  # noqa: F401
+    import weasyprint
+    return weasyprint
+
+def load_pypdf():
+    """Return the pypdf module, or None if it is not installed (callers then fall back to one worker)."""
+    try:
+        import pypdf
+    except ImportError:
+        return None
+    return pypdf
+
+@functools.lru_cache(maxsize=None)
+def weasyprint_version():
+    """WeasyPrint's version, read from its metadata without loading the library."""
+    import importlib.metadata
+    
+    try:
+        return importlib.metadata.version('weasyprint')
+    except importlib.metadata.PackageNotFoundError:
+        return load_weasyprint().__version__
+
+def tree_html(root, base_url=None, url_fetcher=None, media_type='print'):
+    """
+    Return a WeasyPrint HTML document built from an already parsed tinyhtml5
+    tree, so the expanded tree is rendered without being serialised and
+    parsed again.
+    """
+    import cssselect2
+    from weasyprint import HTML, default_url_fetcher
+    from weasyprint.urls import ensure_url
+    
+    if base_url is not None:
+        base_url = ensure_url(str(base_url))
+    # Honour <base href> like HTML() does
+    base_element = next(iter(root.iter('base')), None)
+    if base_element is not None and base_element.get('href', '').strip():
+        base_url = urljoin(base_url, base_element.get('href').strip())
+    # Set the attributes HTML.__init__ would, without parsing anything
+    html_obj = HTML.__new__(HTML)
+    html_obj.base_url = base_url
+    html_obj.url_fetcher = url_fetcher or default_url_fetcher
+    html_obj.media_type = media_type
+    html_obj.wrapper_element = cssselect2.ElementWrapper.from_html_root(root, content_language=None)
+    html_obj.etree_element = html_obj.wrapper_element.etree_element
+    return html_obj
+
+def render_cache_key(cache, html_path, url_fetcher=None, profile=None):
+    """Return the render cache key for an HTML file."""
+    with open(html_path, 'rb') as f:
+        html_bytes = f.read()
+    # Offline renders leave remote assets out, so they are cached separately
+    offline = getattr(url_fetcher, 'offline', False)
+    return cache.key(html_bytes, os.path.dirname(os.path.abspath(html_path)),
+                     EXPAND_CSS, INJECTED_CSS, RENDER_PIPELINE_VERSION, weasyprint_version(),
+                     f"offline={offline}", sorted(profile_options(profile).items()))
+
+def html_to_pdf(html_path, pdf_path=None, pool=None, cache=None, url_fetcher=None, profile=None):
     """
     Convert HTML file to PDF with all hidden content expanded.
     Handles collapsible sections, checkboxes, and hidden divs.
+
+    If a ConverterPool is given, the conversion runs on one of its warm
+    workers instead of in the calling process. With a
+    routing.AdaptiveExecutor instead, small documents are rendered in the
+    calling process or batched with those of other callers, and heavy ones
+    go to the pool. If a RenderCache (or cache
+    directory) is given, unchanged documents are served from the cache
+    instead of being rendered again. url_fetcher (e.g. an
+    assets.AssetFetcher) loads the images and stylesheets the document
+    references, and profile names the output profile (see profiles.py).
     """
+    if isinstance(cache, (str, os.PathLike)):
+        cache = RenderCache(cache)
+
     # If pdf_path is not specified, use the same name with .pdf extension
     if pdf_path is None:
         pdf_path = os.path.splitext(html_path)[0] + '.pdf'
+
+    if cache is not None:
+        key = render_cache_key(cache, html_path, url_fetcher, profile)
+        if cache.get(key, pdf_path):
+            print(f"Reused cached PDF for {html_path}")
+            return pdf_path
+        result = html_to_pdf(html_path, pdf_path, pool=pool, url_fetcher=url_fetcher, profile=profile)
+        if result:
+            cache.put(key, result)
+        return result
+
+    if pool is not None:
+        import routing
+        if isinstance(pool, routing.AdaptiveExecutor):
+            try:
+                try:
+                    record = pool.submit_file(html_path, pdf_path, url_fetcher, profile).result()
+                except routing.BatchFailedError:
+                    # Another document of its batch may be to blame
+                    record = pool.submit_file(html_path, pdf_path, url_fetcher, profile, alone=True).result()
+            except Exception as e:
+                print(f"Error converting {html_path}: {str(e)}")
+                return None
+            print(f"Converted {html_path} to {pdf_path} in {record['elapsed']:.2f} seconds ({record['route']})")
+            return pdf_path
+        return pool.submit(html_to_pdf, html_path, pdf_path, url_fetcher=url_fetcher, profile=profile).result()
+    
+    # Convert modified HTML to PDF with optimized settings
+    try:
+        record = convert_file(html_path, pdf_path, url_fetcher, profile)
+        print(f"Converted {html_path} to {pdf_path} in {record['elapsed']:.2f} seconds")
+        return pdf_path
+    except Exception as e:
+        print(f"Error converting {html_path}: {str(e)}")
+        return None
+
+def convert_file(html_path, pdf_path, url_fetcher=None, profile=None, per_thread=False):
+    """
+    Convert one HTML file to pdf_path, raising any error to the caller.
+    Relative URLs in the document resolve against the file's location.
+    
+    With per_thread the document is rendered with the calling thread's own
+    image cache and font configuration, for threads that convert documents
+    at the same time in one process (see routing.py); the peak RSS, which
+    belongs to the whole process, is then neither reset nor reported.
+    
+    Returns:
+        A dict describing the conversion: elapsed seconds, per-stage
+        timings, page count, input and output sizes and peak RSS
+    """
+    start_time = time.time()
+    metrics = ConversionMetrics()
+    if not per_thread:
+        reset_peak_rss()
+    
+    # Read the HTML file once; the encoding is detected from the raw bytes
+    with metrics.stage('read'):
+        with open(html_path, 'rb') as f:
+            raw = f.read()
+    with metrics.stage('decode'):
+        html_content = decode_html(raw)
+    
+    # Render to a temporary file and rename it into place, so a partial PDF
+    # never appears under pdf_path and a hard link into the render cache is
+    # replaced rather than written through
+    with atomic_output(pdf_path) as temp_path:
+        source_path = os.path.abspath(html_path)
+        render_html(html_content, temp_path, base_dir=os.path.dirname(source_path), base_url=source_path,
+                    metrics=metrics, url_fetcher=url_fetcher, profile=profile, per_thread=per_thread)
+    
+    return {
+        'html_path': html_path,
+        'pdf_path': pdf_path,
+        'profile': profile,
+        'elapsed': round(time.time() - start_time, 4),
+        'stages': metrics.stage_seconds(),
+        'pages': metrics.pages,
+        'input_bytes': len(raw),
+        'output_bytes': os.path.getsize(pdf_path),
+        'peak_rss': None if per_thread else peak_rss(),
+    }
+
+@contextlib.contextmanager
+def atomic_output(path):
+    """
+    Yield a temporary path next to path; it replaces path only if the
+    block completes, and is removed otherwise.
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+def decode_html(raw):
+    """
+    Decode raw HTML bytes in a single pass over the data already in memory.
+
+    A byte order mark wins, then UTF-8, then a <meta> charset declaration,
+    and finally Latin-1, which accepts any byte sequence.
+    """
+    for bom, encoding in ((codecs.BOM_UTF8, 'utf-8'),
+                          (codecs.BOM_UTF16_LE, 'utf-16-le'),
+                          (codecs.BOM_UTF16_BE, 'utf-16-be')):
+        if raw.startswith(bom):
+            return raw[len(bom):].decode(encoding, errors='replace')
     
-    # Read the HTML file - optimize by only reading once
     try:
-        with open(html_path, 'r', encoding='utf-8') as f:
-            html_content = f.read()
+        return raw.decode('utf-8')
     except UnicodeDecodeError:
-        # Try another encoding if UTF-8 fails
-        with open(html_path, 'r', encoding='latin-1') as f:
-            html_content = f.read()
-    
-    # Create comprehensive CSS for expanding all hidden content
-    expand_css = CSS(string="""
-        /* Show all collapsible content */
-        .content { display: block !important; }
-        .collapsible:after { content: "\\26C5" !important; }
-        
-        /* Show any elements with display:none */
-        [style*="display: none"],
-        [style*="display:none"] { display: block !important; }
-        
-        /* Check all checkboxes */
-        input[type="checkbox"] { 
-            -webkit-appearance: checkbox !important;
-            -moz-appearance: checkbox !important;
-            appearance: checkbox !important;
-            opacity: 1 !important;
-            display: inline-block !important;
-            margin: 2px !important;
-            position: static !important;
-            visibility: visible !important;
-            box-sizing: border-box !important;
-        }
-        
-        /* Show any hidden content by ID */
-        #hid { display: block !important; }
-    """)
+        pass
     
-    # Convert modified HTML to PDF with optimized settings
+    declared = _META_CHARSET_RE.search(raw[:4096])
+    if declared:
+        try:
+            return raw.decode(declared.group(1).decode('ascii'), errors='replace')
+        except LookupError:
+            pass
+    return raw.decode('latin-1')
+
+# Options shared by every render and write, plus those of the output profile
+def _render_options(profile=None):
+    return {
+        **profile_options(profile),
+        # Parsed once per process and shared by every conversion in it
+        'stylesheets': [stylesheets.parsed_stylesheet(EXPAND_CSS)],
+        'presentational_hints': True,
+    }
+
+def render_document(html_content, base_dir=None, base_url=None, metrics=None, image_cache=None,
+                    url_fetcher=None, profile=None, per_thread=False):
+    """
+    Expand and lay out an HTML string. Errors are raised to the caller.
+
+    Args:
+        html_content: HTML document as str
+        base_dir: Directory of the source document, if it has one
+        base_url: Base used to resolve relative URLs in the document
+        metrics: Optional ConversionMetrics that receives stage timings
+                 and the page count
+        image_cache: Optional dict shared between documents so that an
+                 image used by several of them is loaded and decoded once
+                 (see assets.ImageCache)
+        url_fetcher: Fetcher for images and stylesheets (default: local
+                 stylesheets from the per-process cache, the rest as usual)
+        profile: Output profile name (see profiles.py); image_cache must
+                 only be shared between documents of the same profile
+        per_thread: Share the calling thread's font configuration rather
+                 than the process's (see stylesheets.font_config_for)
+
+    Returns:
+        (WeasyPrint Document, expanded root element)
+    """
+    if metrics is None:
+        metrics = ConversionMetrics()
+    
+    with metrics.stage('setup'):
+        load_weasyprint()
+        import tinyhtml5
+        font_config = stylesheets.font_config_for(html_content, base_dir, per_thread=per_thread)
+    
+    # Parse once and expand hidden content in a single walk over the tree
+    with metrics.stage('parse'):
+        root = tinyhtml5.parse(html_content, namespace_html_elements=False)
+    with metrics.stage('expand'):
+        expand_tree(root, INJECTED_CSS)
+    
+    document = render_tree(root, font_config, base_url, metrics, image_cache, url_fetcher, profile)
+    return document, root
+
+def render_tree(root, font_config, base_url=None, metrics=None, image_cache=None, url_fetcher=None,
+                profile=None):
+    """
+    Lay out an already parsed and expanded tree. Errors are raised to the caller.
+
+    Args:
+        root: Root element of the expanded tree
+        font_config: FontConfiguration to render with (see stylesheets.font_config_for)
+        base_url, metrics, image_cache, url_fetcher, profile: As for render_document
+
+    Returns:
+        The WeasyPrint Document
+    """
+    if metrics is None:
+        metrics = ConversionMetrics()
+    
+    # Hand the expanded tree straight to WeasyPrint, no re-serialising
+    html_obj = tree_html(root, base_url=base_url, url_fetcher=url_fetcher or stylesheets.url_fetcher)
+    
+    # Apply the CSS and render with optimized settings
+    options = _render_options(profile)
+    if image_cache is not None:
+        options['cache'] = image_cache
+    with metrics.stage('layout'):
+        document = html_obj.render(font_config=font_config, **options)
+    metrics.pages = len(document.pages)
+    return document
+
+def render_html(html_content, target, base_dir=None, base_url=None, metrics=None, url_fetcher=None,
+                profile=None, per_thread=False):
+    """
+    Expand and render an HTML string to PDF. Errors are raised to the caller.
+
+    Images are decoded once per worker process and kept in its image cache
+    for the documents that follow.
+
+    Args:
+        html_content: HTML document as str
+        target: Output path or writable binary stream; None to return bytes
+        base_dir: Directory of the source document, if it has one
+        base_url: Base used to resolve relative URLs in the document
+        metrics: Optional ConversionMetrics that receives stage timings
+                 and the page count
+        url_fetcher: Fetcher for images and stylesheets
+        profile: Output profile name (see profiles.py)
+        per_thread: Use the calling thread's image cache and font
+                 configuration, not the process's
+    """
+    if metrics is None:
+        metrics = ConversionMetrics()
+    # Decoded images depend on the profile's image options
+    image_cache = assets.image_cache(profile, per_thread)
     try:
+        document, _ = render_document(html_content, base_dir, base_url, metrics, image_cache, url_fetcher,
+                                      profile, per_thread)
+        with metrics.stage('write'):
+            return document.write_pdf(target, **_render_options(profile))
+    finally:
+        # The document is written, so its lazily loaded images are no longer read
+        image_cache.trim()
+
+def convert_html(source, target=None, base_url=None, pool=None, url_fetcher=None, profile=None):
+    """
+    Convert HTML held in memory to PDF, without temporary files.
+    
+    Args:
+        source: HTML as bytes, str, or a binary or text file-like object
+        target: Writable binary stream to write the PDF to; when omitted
+                the PDF is returned as bytes
+        base_url: Base used to resolve relative URLs in the document
+        pool: Optional ConverterPool to render on
+        url_fetcher: Fetcher for images and stylesheets
+        profile: Output profile name (see profiles.py)
+    
+    Returns:
+        The PDF as bytes when no target is given, otherwise None.
+        Conversion errors are raised.
+    """
+    if hasattr(source, 'read'):
+        source = source.read()
+    
+    if pool is not None:
+        pdf_bytes = pool.submit(convert_html, source, base_url=base_url, url_fetcher=url_fetcher,
+                                profile=profile).result()
+        if target is None:
+            return pdf_bytes
+        target.write(pdf_bytes)
+        return None
+    
+    html_content = decode_html(source) if isinstance(source, bytes) else source
+    return render_html(html_content, target, base_url=base_url, url_fetcher=url_fetcher, profile=profile)
+
+def iter_html_files(input_dir):
+    """
+    Yield the paths of all HTML files under input_dir, recursively.
+
+    Directories are read lazily with os.scandir, so memory use does not
+    depend on the number of files and the first path is available at once.
+    Symlinked directories are not followed.
+    """
+    stack = [input_dir]
+    while stack:
+        directory = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.name.lower().endswith(('.html', '.htm')) and entry.is_file():
+                            yield entry.path
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"Warning: cannot read directory {directory}: {str(e)}")
+        # Visit subdirectories in the order they were listed
+        stack.extend(reversed(subdirs))
+
+def pdf_path_for(html_path, input_dir, output_dir):
+    """Return the output PDF path for html_path, mirroring the input directory structure."""
+    rel_path = os.path.relpath(html_path, input_dir)
+    return os.path.join(output_dir, os.path.splitext(rel_path)[0] + '.pdf')
+
+# Batch scheduling policies
+SCHEDULES = ('largest-first', 'scan')
+
+# Extra attempts for a document whose worker crashed, timed out or ran out of memory
+DEFAULT_RETRIES = 1
+
+# Slowest conversions listed in the batch summary
+SLOWEST_REPORTED = 5
+
+# Seconds between passes over the tree while other hosts hold leases (claims)
+CLAIM_SWEEP_INTERVAL = 10
+
+class BatchEvent(collections.namedtuple('BatchEvent', [
+        'kind', 'html_path', 'pdf_path', 'elapsed', 'completed', 'failed', 'cached', 'found',
+        'scanning', 'error', 'metrics'])):
+    """
+    Progress report from batch_convert_html_to_pdf.
+    
+    kind is one of:
+        'started'  a worker picked up html_path
+        'done'     html_path was converted in elapsed seconds
+        'failed'   html_path could not be converted (see error)
+        'cached'   pdf_path was served from the render cache
+        'skipped'  html_path was converted by an earlier run (resume)
+        'retry'    html_path failed (see error) and will be tried again
+        'scaled'   the number of workers changed (workers='auto'); metrics
+                   holds the new count and the memory readings behind it
+        'scanned'  the input tree has been fully scanned (found is final)
+        'finished' the batch is over; elapsed is the total time
+    
+    completed counts converted, cached and skipped documents, failed counts
+    failures, cached counts documents served from the render cache, and found is the
+    number of HTML files discovered so far. For 'done' events, metrics is
+    the per-document record returned by convert_file (stage timings, page
+    count, sizes and peak worker RSS) plus its predicted_cost and the route
+    it took (see routing.py); for
+    'finished' events it is the stats dict the batch returns.
+    """
+    __slots__ = ()
+
+def print_progress(event):
+    """Default batch progress callback: report on the console."""
+    if event.kind == 'done':
+        print(f"Converted {event.html_path} to {event.pdf_path} in {event.elapsed:.2f} seconds")
+    elif event.kind == 'failed':
+        print(f"Error converting {event.html_path}: {event.error}")
+    elif event.kind == 'retry':
+        print(f"Retrying {event.html_path}: {event.error}")
+    elif event.kind == 'scanned':
+        print(f"Found {event.found} HTML files to convert")
+    elif event.kind == 'scaled':
+        print_concurrency(event.metrics)
+    elif event.kind == 'finished':
+        if event.metrics and event.metrics.get('skipped'):
+            print(f"Skipped {event.metrics['skipped']} files converted by an earlier run")
+        if event.metrics and event.metrics.get('elsewhere'):
+            print(f"Left {event.metrics['elsewhere']} files to other hosts working on them")
+        if event.cached:
+            print(f"Reused {event.cached} cached PDFs")
+        if event.failed:
+            print(f"{event.failed} files failed to convert")
+        if event.metrics and event.metrics.get('quarantined'):
+            print(f"{event.metrics['quarantined']} files are quarantined; "
+                  f"see {event.metrics['quarantine_path']}")
+        print_cost_summary(event.metrics)
+        print_route_summary(event.metrics)
+        if event.metrics and event.metrics.get('concurrency'):
+            levels = ' -> '.join(str(entry['workers']) for entry in event.metrics['concurrency'])
+            print(f"Workers over the run: {levels}")
+        print(f"All conversions complete. PDFs saved to {event.pdf_path}")
+        print(f"Total time: {event.elapsed:.2f} seconds")
+        return
+    
+    if event.kind in ('done', 'failed'):
+        finished = event.completed + event.failed
+        if event.scanning:
+            print(f"Progress: {finished} files (still scanning)")
+        else:
+            print(f"Progress: {finished}/{event.found} files ({(finished/event.found)*100:.1f}%)")
+
+def print_cost_summary(stats):
+    """Print the predicted cost of a batch next to the time it actually took."""
+    if not stats or not stats.get('predicted_cost') or not stats.get('render_seconds'):
+        return
+    rate = stats['render_seconds'] / stats['predicted_cost']
+    print(f"Predicted cost {stats['predicted_cost']:.0f} units, actual render time "
+          f"{stats['render_seconds']:.2f} seconds ({rate * 1000:.2f} ms per unit)")
+    if stats['slowest']:
+        print("Slowest documents (predicted vs actual):")
+        for entry in stats['slowest']:
+            print(f"  {entry['html_path']}: predicted {entry['predicted_cost'] * rate:.2f} s, "
+                  f"actual {entry['elapsed']:.2f} s")
+
+def print_concurrency(entry):
+    """Print one change of the worker count in auto mode."""
+    line = f"Concurrency: {entry['workers']} workers at {entry['time']:.0f} s"
+    if entry['available'] is not None:
+        line += f" ({entry['available'] // (1024 * 1024)} MB available"
+        if entry['worker_rss']:
+            line += f", about {entry['worker_rss'] // (1024 * 1024)} MB per worker"
+        line += ")"
+    print(line)
+
+def print_route_summary(stats):
+    """Print how many documents each route of the adaptive executor took."""
+    routes = stats and stats.get('routes')
+    if not routes or not routes['local'] + routes['batched']:
+        return
+    print(f"Routed {routes['pool']} documents to their own worker, {routes['batched']} small ones in "
+          f"{routes['batches']} batches and {routes['local']} in this process")
+
+@dataclasses.dataclass
+class BatchOptions:
+    """
+    Options of batch_convert_html_to_pdf, which also takes each of them as a
+    keyword argument.
+    
+    Pool (only used when batch_convert_html_to_pdf creates the pool):
+        max_tasks_per_worker: Documents a worker converts before it is recycled
+        timeout: Seconds one document (or batch of small documents) may take
+              before its worker is killed (see ConverterPool)
+        max_worker_rss: Bytes of resident memory a worker may use before it
+              is killed
+        memory_budget: Bytes of resident memory all workers together may use
+              with workers='auto' (default: 3/4 of the memory available when
+              the batch starts)
+    
+    Scheduling:
+        max_in_flight: Conversions submitted but not yet finished (default:
+              4 per worker, or two batches of small documents per worker if
+              that is more)
+        schedule: 'largest-first' to submit the costliest known files first,
+              or 'scan' to submit them in the order they are found
+        lookahead: Files scanned and estimated ahead of submission when
+              scheduling largest-first (default: 8 times max_in_flight)
+        small_cost: Estimated cost below which a document is small (default:
+              routing.DEFAULT_SMALL_COST; 0 gives every document a pool task
+              of its own). Ignored when the pool is a routing.AdaptiveExecutor,
+              as are small_batch and local_threads.
+        small_batch: Most small documents per pool task (default:
+              routing.DEFAULT_SMALL_BATCH)
+        local_threads: Threads in the calling process that render small
+              documents (see routing.AdaptiveExecutor)
+    
+    Failures:
+        retries: Extra attempts for a document whose worker crashed, timed
+              out or ran out of memory
+        retry_errors: Also retry documents that raised an ordinary error
+        quarantine: Record documents that fail every attempt in
+              quarantine.jsonl in output_dir and skip them in later batches
+        retry_quarantined: Convert quarantined documents anyway
+    
+    Records:
+        cache: RenderCache (or cache directory) used to skip unchanged
+              documents; identical documents in the batch render only once
+        report_path: JSON-lines file that receives one record per document
+              (status, timings per stage, pages, sizes, peak RSS), and one
+              per change of the worker count in auto mode
+        journal: Record every finished document with its input fingerprint
+              in journal.sqlite3 in output_dir
+        resume: Skip documents the journal records as converted whose input
+              is unchanged and whose PDF exists; earlier failures are retried
+    
+    Rendering:
+        url_fetcher: Fetcher for images and stylesheets, e.g. an
+              assets.AssetFetcher with a shared on-disk cache
+        profile: Output profile name (see profiles.py)
+    
+    Input:
+        files: HTML files inside input_dir to convert instead of searching
+              input_dir for them (used by watch mode)
+        shard: (index, count) to convert only the files whose relative path
+              hashes to shard index of count (see claims.py); the journal and
+              quarantine files are kept per shard
+        claims: Take every file through a lease in output_dir/.leases, so
+              several hosts can work on one tree without converting a file
+              twice. Completion markers replace the journal and quarantine.
+        lease_timeout: Seconds after which the lease of a host that stopped
+              renewing it is taken over
+    
+    Only the pool, retry, report and rendering options apply to archives
+    (see archives.convert_archive).
+    """
+    max_tasks_per_worker: int = DEFAULT_MAX_TASKS_PER_WORKER
+    timeout: float = None
+    max_worker_rss: int = None
+    memory_budget: int = None
+    max_in_flight: int = None
+    schedule: str = 'largest-first'
+    lookahead: int = None
+    small_cost: float = None
+    small_batch: int = None
+    local_threads: int = 0
+    retries: int = DEFAULT_RETRIES
+    retry_errors: bool = False
+    quarantine: bool = True
+    retry_quarantined: bool = False
+    cache: object = None
+    report_path: str = None
+    journal: bool = True
+    resume: bool = False
+    url_fetcher: object = None
+    profile: str = None
+    files: object = None
+    shard: tuple = None
+    claims: bool = False
+    lease_timeout: float = DEFAULT_LEASE_TIMEOUT
+
+def batch_convert_html_to_pdf(input_dir='.', output_dir=None, workers=None, pool=None, options=None,
+                              progress=print_progress, **option_values):
+    """
+    Convert all HTML files in a directory tree to PDFs using parallel processing.
+    
+    Files are discovered while the batch runs and only a bounded number of
+    conversions is queued at any time, so memory use stays flat however
+    many files there are. The output mirrors the input directory structure.
+    Every file gets a cheap cost estimate before it is queued: by default
+    the costliest file seen so far is submitted first, so a huge report
+    found late does not leave the other workers idle at the end, and small
+    documents share pool tasks or render on local threads (see routing.py).
+    
+    A document that crashes its worker, runs past the timeout or makes its
+    worker exceed max_worker_rss fails on its own and is retried; documents
+    that still fail are quarantined so later batches skip them until they
+    change. A document whose batch of small documents failed as a whole
+    runs again on its own without using up an attempt. With workers='auto'
+    the pool is resized to fit a memory budget (see autoscale.py), and
+    every change is reported as a 'scaled' event.
+    
+    Args:
+        input_dir: Directory containing HTML files (searched recursively),
+              or a .zip or .tar(.gz) archive whose HTML members are
+              converted without extracting them; output_dir may then end in
+              .zip to collect the PDFs in one zip file
+        output_dir: Directory for output PDFs (default: input_dir)
+        workers: Number of parallel workers (default: CPU count, max 4), or
+              'auto' to size the pool by memory use (only used when no pool
+              is given)
+        pool: Existing ConverterPool (or routing.AdaptiveExecutor) to run
+              on; a temporary one is created (and shut down afterwards) when
+              omitted
+        options: BatchOptions for everything else
+        progress: Callable receiving a BatchEvent for every step, or None.
+              'started' events arrive from the pool's manager thread or a
+              local render thread, all others from the calling thread.
+        option_values: BatchOptions fields to set, e.g. retries=0, on top
+              of options
+    
+    Returns:
+        A dict with the found, completed, failed, cached, skipped, retried
+        (documents that failed on their own and were tried again),
+        quarantined and elsewhere (leased by other hosts) counts, the
+        elapsed time, the total predicted cost and render time of converted
+        files and the slowest of them, the number of documents each route
+        converted in this batch (routes) and, with workers='auto', every change of the
+        worker count (concurrency), or None if no HTML files were found.
+    """
+    options = dataclasses.replace(options or BatchOptions(), **option_values)
+    if options.schedule not in SCHEDULES:
+        raise ValueError(f"Unknown schedule {options.schedule!r}, expected one of {', '.join(SCHEDULES)}")
+    profile_options(options.profile)  # fail early on an unknown profile
+    
+    # Route documents by cost, through the caller's executor if there is one
+    import routing
+    router = pool if isinstance(pool, routing.AdaptiveExecutor) else None
+    if router is not None:
+        pool = router.pool
+    
+    # Size the pool by memory use while the batch runs
+    auto_workers = workers == 'auto'
+    if auto_workers:
+        workers = None
+    
+    # Archives are read member by member instead of searched on disk
+    import archives
+    if archives.is_archive(input_dir):
+        if (options.cache is not None or options.resume or options.claims or options.shard is not None
+                or options.files is not None):
+            raise ValueError("cache, resume, claims, shard and files are not supported for archive input")
+        return archives.convert_archive(input_dir, output_dir, workers, pool, options.max_tasks_per_worker,
+                                        options.max_in_flight, progress, options.report_path, options.timeout,
+                                        options.max_worker_rss, options.retries, options.retry_errors,
+                                        options.url_fetcher, options.profile)
+    
+    if output_dir is None:
+        output_dir = input_dir
+    
+    # Create output directory if it doesn't exist
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # Find HTML files lazily as the batch runs
+    html_files = iter(options.files) if options.files is not None else iter_html_files(input_dir)
+    first_file = next(html_files, None)
+    if first_file is None:
+        print(f"No HTML files found in {input_dir}")
+        return None
+    
+    batch = _BatchRun(input_dir, output_dir, options, progress)
+    return batch.run(itertools.chain([first_file], html_files), workers, pool, router, auto_workers)
+
+class _BatchRun:
+    """
+    One run of batch_convert_html_to_pdf: scans the input, keeps a bounded
+    window of conversions in flight and records how each document ended.
+    """
+    
+    def __init__(self, input_dir, output_dir, options, progress):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.options = options
+        self.progress = progress
+        self.cache = options.cache
+        if isinstance(self.cache, (str, os.PathLike)):
+            self.cache = RenderCache(self.cache)
+        self.stats = {'found': 0, 'completed': 0, 'failed': 0, 'cached': 0, 'skipped': 0, 'retried': 0,
+                      'quarantined': 0, 'elsewhere': 0, 'predicted_cost': 0.0, 'render_seconds': 0.0,
+                      'quarantine_path': None, 'concurrency': None}
+        # (elapsed, predicted cost, path) of the slowest conversions, smallest first
+        self.slowest = []
+        self.scanning = True
+        # Input fingerprints taken at scan time, until the document finishes
+        self.fingerprints = {}
+        # Scanned files not yet submitted: (priority, scan order, html, pdf, key, cost, attempt, alone)
+        self.waiting = []
+        self.scan_order = itertools.count()
+        # Submitted futures -> (priority, html, pdf, key, cost, attempt, alone)
+        self.in_flight = {}
+        # Cache key -> outputs of identical documents waiting on one render
+        self.duplicates = {}
+        self.last_dir = None
+        # Files leased by other hosts in the current pass over the tree
+        self.busy_elsewhere = 0
+        self.sweeping = False
+        self.run_report = self.job_journal = self.work_claims = self.quarantined = None
+        self.pool = self.router = self.scaler = None
+        self.own_pool = self.own_router = False
+    
+    def run(self, html_files, workers, pool, router, auto_workers):
+        """Convert html_files and return the stats of the batch."""
         start_time = time.time()
+        try:
+            self.open_records()
+            self.start_router(workers, pool, router, auto_workers)
+            self.convert(html_files)
+        finally:
+            self.close()
         
-        # Apply comprehensive modifications to HTML
-        modified_html = html_content
+        stats = self.stats
+        stats['elapsed'] = time.time() - start_time
+        stats['slowest'] = [{'html_path': html_path, 'predicted_cost': round(cost, 1), 'elapsed': elapsed}
+                            for elapsed, cost, html_path in sorted(self.slowest, reverse=True)]
+        # A caller's router keeps counting across batches; report this one's share
+        stats['routes'] = {route: count - self.routes_before[route] for route, count in self.router.routes.items()}
+        self.report('finished', pdf_path=self.output_dir, elapsed=stats['elapsed'], metrics=stats)
+        return stats
+    
+    def open_records(self):
+        """Open the run report, and the journal and quarantine or the work claims of the output directory."""
+        options = self.options
+        # Only the calling process writes the run report and the journal; with
+        # claims the shared completion markers take the place of both
+        if options.report_path:
+            self.run_report = JsonlReport(options.report_path)
+        if options.claims:
+            self.work_claims = WorkClaims.in_directory(self.output_dir, lease_timeout=options.lease_timeout)
+            self.stats['quarantine_path'] = self.work_claims.directory
+            return
+        if options.journal or options.resume:
+            self.job_journal = Journal(os.path.join(self.output_dir, shard_file_name(JOURNAL_FILE, options.shard)))
+        if options.quarantine:
+            self.quarantined = Quarantine(os.path.join(self.output_dir,
+                                                       shard_file_name(QUARANTINE_FILE, options.shard)))
+            self.stats['quarantine_path'] = self.quarantined.path
+    
+    def start_router(self, workers, pool, router, auto_workers):
+        """Size the window of conversions and start the pool, router and autoscaler this run owns."""
+        import routing
+        options = self.options
+        small_cost, small_batch = options.small_cost, options.small_batch
+        if router is not None:
+            small_cost, small_batch = router.small_cost, router.small_batch
+        elif small_batch is None:
+            small_batch = routing.DEFAULT_SMALL_BATCH
         
-        # 1. Replace display:none with display:block in style attributes
-        modified_html = re.sub(r'style=(["\'])([^"\']*?)display:\s*none([^"\']*?)(\1)', 
-                              r'style=\1\2display:block\3\1', modified_html)
+        # Determine number of workers (use max 4 by default to avoid memory issues)
+        if workers is None:
+            workers = pool.workers if pool is not None else min(os.cpu_count(), 4)
+        auto_workers = auto_workers and pool is None
+        self.max_in_flight = options.max_in_flight
+        if self.max_in_flight is None:
+            # Leave room for small documents to gather into batches, and for
+            # the largest pool auto mode may grow to
+            max_workers = os.cpu_count() if auto_workers else workers
+            self.max_in_flight = max_workers * (4 if small_cost == 0 else max(4, 2 * small_batch))
+        self.lookahead = options.lookahead
+        if options.schedule != 'largest-first':
+            self.lookahead = 1
+        elif self.lookahead is None:
+            # Claimed files wait in the lookahead, where no other host can take them
+            self.lookahead = self.max_in_flight if options.claims else self.max_in_flight * 8
         
-        # 2. Add show-hidden-content CSS to head or create a head if not present
-        css_injection = """<style>
-        .content { display: block !important; }
-        #hid, [style*="display: none"], [style*="display:none"] { display: block !important; }
-        input[type="checkbox"] { checked: checked; }
-        </style>"""
+        # Process files in parallel, reusing the caller's warm pool if there is one
+        self.own_pool = pool is None
+        if self.own_pool:
+            pool = ConverterPool(workers, max_tasks_per_worker=options.max_tasks_per_worker,
+                                 task_timeout=options.timeout, max_worker_rss=options.max_worker_rss)
+        self.pool = pool
+        self.own_router = router is None
+        if self.own_router:
+            router = routing.AdaptiveExecutor(pool, small_cost, small_batch, options.local_threads)
+        self.router = router
+        self.routes_before = dict(router.routes)
         
-        if "</head>" in modified_html:
-            modified_html = modified_html.replace("</head>", f"{css_injection}</head>")
-        elif "<html" in modified_html:
-            modified_html = modified_html.replace("<html", f"<html><head>{css_injection}</head>")
-        else:
-            modified_html = f"<html><head>{css_injection}</head>{modified_html}</html>"
+        # Leases are renewed well before other hosts would consider them abandoned
+        self.renew_interval = options.lease_timeout / 4
+        self.last_renewal = time.monotonic()
+        self.wait_timeout = self.renew_interval if self.work_claims is not None else None
+        if auto_workers:
+            from autoscale import AutoScaler
+            self.scaler = AutoScaler(pool, options.memory_budget)
+            self.stats['concurrency'] = self.scaler.history
+            self.report('scaled', metrics=self.scaler.history[0])
+            # Wake up to sample memory even while every document is still running
+            self.wait_timeout = min(self.wait_timeout or self.scaler.interval, self.scaler.interval)
+    
+    def close(self):
+        """Stop what the run started and close its records."""
+        if self.own_router and self.router is not None:
+            self.router.close()
+        if self.own_pool and self.pool is not None:
+            self.pool.shutdown()
+        if self.run_report is not None:
+            self.run_report.close()
+        if self.job_journal is not None:
+            self.job_journal.close()
+        if self.work_claims is not None:
+            # Hand anything not finished straight to the other hosts
+            self.work_claims.release_all()
+    
+    def report(self, kind, html_path=None, pdf_path=None, elapsed=None, error=None, metrics=None):
+        """Record a step in the journal, claims and run report, and pass it to the progress callback."""
+        if kind in ('done', 'failed', 'cached'):
+            input_fingerprint = self.fingerprints.pop(html_path, None)
+            status = 'failed' if kind == 'failed' else 'done'
+            if self.job_journal is not None:
+                self.job_journal.record(html_path, input_fingerprint, status, pdf_path, error)
+            if self.work_claims is not None:
+                rel_path = os.path.relpath(html_path, self.input_dir)
+                if rel_path in self.work_claims.held:
+                    self.work_claims.finish(rel_path, input_fingerprint, status, error)
+        if self.run_report is not None and kind in ('done', 'failed', 'cached', 'skipped', 'scaled'):
+            record = metrics or {'html_path': html_path, 'pdf_path': pdf_path}
+            record = {'status': kind, **record}
+            if error is not None:
+                record['error'] = error
+            self.run_report.write(record)
+        if self.progress is not None:
+            stats = self.stats
+            self.progress(BatchEvent(kind, html_path, pdf_path, elapsed, stats['completed'], stats['failed'],
+                                     stats['cached'], stats['found'], self.scanning, error, metrics))
+    
+    def report_started(self, html_path, pdf_path):
+        return lambda future: self.report('started', html_path, pdf_path)
+    
+    def convert(self, html_files):
+        """Scan, submit and collect conversions until every file is finished."""
+        options = self.options
+        while True:
+            # Scan ahead of the workers, estimating the cost of each file
+            while self.scanning and len(self.waiting) < self.lookahead:
+                html_path = next(html_files, None)
+                if html_path is None:
+                    self.scanning = False
+                    if not self.sweeping:
+                        self.report('scanned')
+                    break
+                self.scan(html_path)
+            
+            # Top up the window of in-flight conversions, costliest first
+            while self.waiting and len(self.in_flight) < self.max_in_flight:
+                priority, _, html_path, pdf_path, key, cost, attempt, alone = heapq.heappop(self.waiting)
+                future = self.router.submit_file(html_path, pdf_path, options.url_fetcher, options.profile, cost,
+                                                 alone=alone)
+                future.add_start_callback(self.report_started(html_path, pdf_path))
+                self.in_flight[future] = (priority, html_path, pdf_path, key, cost, attempt, alone)
+            
+            if not self.in_flight:
+                if self.busy_elsewhere and not self.scanning:
+                    # Sweep the tree again until every file other hosts held
+                    # is finished, taking over those whose host went away
+                    time.sleep(min(self.renew_interval, CLAIM_SWEEP_INTERVAL))
+                    html_files = iter(options.files) if options.files is not None else iter_html_files(self.input_dir)
+                    self.busy_elsewhere = 0
+                    self.sweeping = self.scanning = True
+                    continue
+                break
+            
+            done, _ = concurrent.futures.wait(self.in_flight, timeout=self.wait_timeout,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            if self.work_claims is not None and time.monotonic() - self.last_renewal >= self.renew_interval:
+                self.work_claims.renew()
+                self.last_renewal = time.monotonic()
+            if self.scaler is not None and self.scaler.update() is not None:
+                self.report('scaled', metrics=self.scaler.history[-1])
+            for future in done:
+                self.finish(future, *self.in_flight.pop(future))
+    
+    def scan(self, html_path):
+        """Queue a scanned file, unless it is another shard's, leased, converted, quarantined or cached."""
+        options, stats = self.options, self.stats
+        rel_path = os.path.relpath(html_path, self.input_dir)
+        if options.shard is not None and not in_shard(rel_path, options.shard):
+            return
         
-        # 3. Directly modify any script-hidden content to be visible
-        modified_html = modified_html.replace('id="hid" style="display:none"', 'id="hid" style="display:block"')
+        marker = None
+        if self.work_claims is not None:
+            input_fingerprint = fingerprint(html_path)
+            marker, claimed = self.work_claims.acquire(rel_path, input_fingerprint,
+                                                       retry_failed=options.retry_quarantined and not self.sweeping)
+            if not claimed and (marker is None or self.sweeping):
+                # Another host is converting it, or a sweep finds it finished
+                if marker is None:
+                    self.busy_elsewhere += 1
+                    if not self.sweeping:
+                        stats['elsewhere'] += 1
+                return
+            if claimed:
+                marker = None
+                if self.sweeping:
+                    # Abandoned by a host that went away
+                    stats['elsewhere'] = max(0, stats['elsewhere'] - 1)
+            self.fingerprints[html_path] = input_fingerprint
+        stats['found'] += 1
         
-        # 4. Check all checkboxes
-        modified_html = re.sub(r'<input type=["\']checkbox["\']', 
-                             r'<input type="checkbox" checked="checked"', 
-                             modified_html)
+        pdf_path = pdf_path_for(html_path, self.input_dir, self.output_dir)
+        pdf_dir = os.path.dirname(pdf_path)
+        if pdf_dir != self.last_dir:
+            os.makedirs(pdf_dir, exist_ok=True)
+            self.last_dir = pdf_dir
         
-        # Use the optimized HTML
-        html_obj = HTML(string=modified_html)
+        if marker is not None:
+            # Another host (or an earlier run) already finished it
+            del self.fingerprints[html_path]
+            if marker['status'] == 'done':
+                stats['completed'] += 1
+                stats['skipped'] += 1
+                self.report('skipped', html_path, pdf_path)
+            else:
+                stats['failed'] += 1
+                stats['quarantined'] += 1
+                self.report('failed', html_path, pdf_path, error=f"failed on {marker['owner']}: {marker['error']}")
+            return
         
-        # Apply the CSS and render with optimized settings
-        html_obj.write_pdf(
-            pdf_path, 
-            stylesheets=[expand_css],
-            presentational_hints=True
-        )
+        if self.job_journal is not None:
+            self.fingerprints[html_path] = fingerprint(html_path)
+            if options.resume and self.job_journal.is_done(html_path, self.fingerprints[html_path]):
+                del self.fingerprints[html_path]
+                stats['completed'] += 1
+                stats['skipped'] += 1
+                self.report('skipped', html_path, pdf_path)
+                return
         
-        end_time = time.time()
-        print(f"Converted {html_path} to {pdf_path} in {end_time - start_time:.2f} seconds")
+        if self.quarantined is not None and not options.retry_quarantined:
+            entry = self.quarantined.lookup(html_path)
+            if entry is not None:
+                stats['failed'] += 1
+                stats['quarantined'] += 1
+                self.report('failed', html_path, pdf_path,
+                            error=f"quarantined after {entry['attempts']} failed attempt(s): {entry['error']}")
+                return
         
-        return pdf_path
-    except Exception as e:
-        print(f"Error converting {html_path}: {str(e)}")
-        return None
+        key = None
+        if self.cache is not None:
+            key = render_cache_key(self.cache, html_path, options.url_fetcher, options.profile)
+            if key in self.duplicates:
+                self.duplicates[key].append((html_path, pdf_path))
+                return
+            if self.cache.get(key, pdf_path):
+                stats['completed'] += 1
+                stats['cached'] += 1
+                self.report('cached', html_path, pdf_path)
+                return
+            self.duplicates[key] = []
+        
+        cost = estimate_cost(html_path)
+        priority = -cost if options.schedule == 'largest-first' else 0
+        heapq.heappush(self.waiting, (priority, next(self.scan_order), html_path, pdf_path, key, cost, 1, False))
+    
+    def finish(self, future, priority, html_path, pdf_path, key, cost, attempt, alone):
+        """Handle the outcome of one submitted conversion: done, retried or failed."""
+        import routing
+        options = self.options
+        try:
+            record = future.result()
+        except routing.BatchFailedError as e:
+            # Another document of the batch may be to blame: find out on its own
+            self.report('retry', html_path, pdf_path, error=str(e))
+            heapq.heappush(self.waiting, (priority, next(self.scan_order), html_path, pdf_path, key, cost,
+                                          attempt, True))
+            return
+        except Exception as e:
+            # Crashes, timeouts and memory kills may not happen again
+            if attempt <= options.retries and (options.retry_errors or isinstance(e, WorkerCrashedError)):
+                if attempt == 1:
+                    self.stats['retried'] += 1
+                self.report('retry', html_path, pdf_path, error=f"attempt {attempt} failed: {str(e)}")
+                # Retried on its own, so no batch-mate shares the next attempt
+                heapq.heappush(self.waiting, (priority, next(self.scan_order), html_path, pdf_path, key, cost,
+                                              attempt + 1, True))
+                return
+            self.failed(html_path, pdf_path, key, attempt, str(e))
+            return
+        self.done(html_path, pdf_path, key, cost, record)
+    
+    def failed(self, html_path, pdf_path, key, attempt, error):
+        """Record a document that failed for good, and the identical documents waiting on it."""
+        stats = self.stats
+        followers = self.duplicates.pop(key) if key is not None else []
+        stats['failed'] += 1 + len(followers)
+        if self.quarantined is not None:
+            self.quarantined.add(html_path, error, attempt)
+            stats['quarantined'] += 1
+        elif self.work_claims is not None:
+            stats['quarantined'] += 1
+        self.report('failed', html_path, pdf_path, error=error)
+        for follower_html, follower_pdf in followers:
+            self.report('failed', follower_html, follower_pdf, error=f"identical to {html_path}, which failed")
+    
+    def done(self, html_path, pdf_path, key, cost, record):
+        """Record a converted document and copy its PDF to the identical documents waiting on it."""
+        stats = self.stats
+        followers = self.duplicates.pop(key) if key is not None else []
+        if self.quarantined is not None:
+            self.quarantined.release(html_path)
+        stats['completed'] += 1
+        if self.scaler is not None:
+            self.scaler.observe(record['peak_rss'])
+        record['predicted_cost'] = round(cost, 1)
+        stats['predicted_cost'] += cost
+        stats['render_seconds'] += record['elapsed']
+        entry = (record['elapsed'], cost, html_path)
+        if len(self.slowest) < SLOWEST_REPORTED:
+            heapq.heappush(self.slowest, entry)
+        else:
+            heapq.heappushpop(self.slowest, entry)
+        self.report('done', html_path, pdf_path, record['elapsed'], metrics=record)
+        if key is not None:
+            self.cache.put(key, pdf_path)
+            for follower_html, follower_pdf in followers:
+                if self.cache.get(key, follower_pdf):
+                    stats['completed'] += 1
+                    stats['cached'] += 1
+                    self.report('cached', follower_html, follower_pdf)
+                else:
+                    stats['failed'] += 1
+                    self.report('failed', follower_html, follower_pdf, error="could not copy cached PDF")
+
+MERGE_ORDERS = ('path', 'name', 'mtime', 'size')
+
+_TOC_TEMPLATE = """<html><head><title>Contents</title><style>
+    h1 {{ font-size: 16pt; }}
+    ol {{ padding-left: 1.5em; }}
+    li {{ margin: 4px 0; }}
+    .page {{ float: right; }}
+</style></head><body><h1>Contents</h1><ol>{entries}</ol></body></html>"""
 
-def batch_convert_html_to_pdf(input_dir='.', output_dir=None, workers=None):
+def order_html_files(html_files, order='path'):
     """
-    Convert all HTML files in a directory to PDFs using parallel processing.
+    Sort HTML file paths for merging.
     
     Args:
-        input_dir: Directory containing HTML files
-        output_dir: Directory for output PDFs
-        workers: Number of parallel workers (default: CPU count)
+        html_files: Paths to sort
+        order: 'path' (full path), 'name' (file name), 'mtime' (oldest
+               first) or 'size' (smallest first); ties keep path order
     """
-    if output_dir is None:
-        output_dir = input_dir
+    if order == 'path':
+        return sorted(html_files)
+    if order == 'name':
+        return sorted(html_files, key=lambda path: (os.path.basename(path), path))
+    if order == 'mtime':
+        return sorted(html_files, key=lambda path: (os.path.getmtime(path), path))
+    if order == 'size':
+        return sorted(html_files, key=lambda path: (os.path.getsize(path), path))
+    raise ValueError(f"Unknown order {order!r}, expected one of {', '.join(MERGE_ORDERS)}")
+
+def document_title(root, html_path):
+    """Return the <title> of a parsed document, or its file name."""
+    title = next(root.iter('title'), None)
+    if title is not None and title.text and title.text.strip():
+        return ' '.join(title.text.split())
+    return os.path.splitext(os.path.basename(html_path))[0]
+
+def render_toc(entries, profile=None):
+    """
+    Lay out a table of contents for merged documents.
     
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
+    Args:
+        entries: (title, page count) of every merged document, in order
+        profile: Output profile name (see profiles.py)
     
-    # Find all HTML files in the input directory
-    input_path = Path(input_dir)
-    html_files = list(input_path.glob('*.html')) + list(input_path.glob('*.htm'))
+    Returns:
+        A WeasyPrint Document whose page numbers account for its own length
+    """
+    toc_pages = 1
+    for _ in range(3):
+        page = toc_pages + 1
+        items = []
+        for title, page_count in entries:
+            items.append(f'<li>{html.escape(title)}<span class="page">{page}</span></li>')
+            page += page_count
+        document, _ = render_document(_TOC_TEMPLATE.format(entries=''.join(items)), profile=profile)
+        if len(document.pages) == toc_pages:
+            break
+        toc_pages = len(document.pages)
+    return document
+
+def render_merge_group(html_paths, toc=False, url_fetcher=None, profile=None):
+    """
+    Render consecutive documents and write their pages as one PDF.
     
-    if not html_files:
-        print(f"No HTML files found in {input_dir}")
-        return
+    Documents in a group share the worker's font configuration and one
+    image cache, and are written with a single write_pdf call, so fonts and
+    images used by several of them are embedded once. A document that fails
+    is left out and reported.
     
-    total_files = len(html_files)
-    print(f"Found {total_files} HTML files to convert")
+    Args:
+        html_paths: Paths of the documents, in output order
+        toc: Prepend a table of contents (used when there is one group)
+        url_fetcher: Fetcher for images and stylesheets
+        profile: Output profile name (see profiles.py)
     
-    # Use parallel processing for faster conversion
+    Returns:
+        A dict with the PDF bytes ('pdf', None if nothing rendered), the
+        (title, page count) of each rendered document ('entries') and
+        (path, message) of each failure ('errors')
+    """
+    image_cache = assets.image_cache(profile)
+    pages = []
+    first_document = None
+    entries = []
+    errors = []
+    
+    for html_path in html_paths:
+        try:
+            with open(html_path, 'rb') as f:
+                html_content = decode_html(f.read())
+            source_path = os.path.abspath(html_path)
+            document, root = render_document(html_content, os.path.dirname(source_path), source_path,
+                                             image_cache=image_cache, url_fetcher=url_fetcher, profile=profile)
+        except Exception as e:
+            errors.append((html_path, str(e)))
+            continue
+        if first_document is None:
+            first_document = document
+        pages.extend(document.pages)
+        entries.append((document_title(root, html_path), len(document.pages)))
+    
+    if first_document is None:
+        image_cache.trim()
+        return {'pdf': None, 'entries': entries, 'errors': errors}
+    
+    try:
+        if toc:
+            pages = render_toc(entries, profile).pages + pages
+        pdf_bytes = first_document.copy(pages).write_pdf(**_render_options(profile))
+    finally:
+        image_cache.trim()
+    return {'pdf': pdf_bytes, 'entries': entries, 'errors': errors}
+
+def _split_groups(html_files, count):
+    """Split html_files into at most count contiguous groups of similar estimated cost."""
+    costs = [estimate_cost(path) for path in html_files]
+    
+    target = sum(costs) / count if count else 0
+    groups = [[]]
+    group_cost = 0
+    for index, (path, cost) in enumerate(zip(html_files, costs)):
+        remaining_files = len(html_files) - index
+        remaining_groups = count - len(groups)
+        # Start a new group once this one is full, keeping at least one
+        # file for every group still to come
+        if groups[-1] and remaining_groups > 0 and (group_cost >= target or remaining_files <= remaining_groups):
+            groups.append([])
+            group_cost = 0
+        groups[-1].append(path)
+        group_cost += cost
+    return groups
+
+def merge_html_to_pdf(sources, output_pdf, workers=None, pool=None, order='path', toc=False,
+                      max_tasks_per_worker=DEFAULT_MAX_TASKS_PER_WORKER, url_fetcher=None, profile=None):
+    """
+    Render many HTML files into a single PDF, without a PDF per document.
+    
+    The ordered documents are split into one contiguous group per worker.
+    Each worker lays out its group and writes it with one write_pdf call,
+    and the group PDFs are concatenated with pypdf. Without pypdf all
+    documents are rendered as a single group on one worker.
+    
+    Args:
+        sources: Directory searched recursively for HTML files, or a list
+                 of HTML file paths that is merged in the given order
+        output_pdf: Path of the combined PDF
+        workers: Number of parallel workers (default: CPU count, max 4)
+        pool: Existing ConverterPool to run on
+        order: How to sort files found in a directory (see MERGE_ORDERS)
+        toc: Start the PDF with a table of contents of the documents
+        max_tasks_per_worker: Documents a worker converts before it is
+              recycled (only used when no pool is given)
+        url_fetcher: Fetcher for images and stylesheets
+        profile: Output profile name (see profiles.py)
+    
+    Returns:
+        A dict with the merged, failed and page counts and the elapsed
+        time, or None if there was nothing to merge.
+    """
     start_time = time.time()
+    profile_options(profile)  # fail early on an unknown profile
+    
+    if isinstance(sources, (str, os.PathLike)):
+        html_files = order_html_files(list(iter_html_files(sources)), order)
+    else:
+        html_files = list(sources)
+    if not html_files:
+        print(f"No HTML files found in {sources}")
+        return None
+    print(f"Merging {len(html_files)} HTML files into {output_pdf}")
     
-    # Determine number of workers (use max 4 by default to avoid memory issues)
     if workers is None:
-        workers = min(os.cpu_count(), 4)
-    
-    # Create list of conversion tasks
-    conversion_tasks = []
-    for html_file in html_files:
-        pdf_path = os.path.join(output_dir, html_file.stem + '.pdf')
-        conversion_tasks.append((str(html_file), pdf_path))
-    
-    # Process files in parallel
-    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
-        futures = {executor.submit(html_to_pdf, html_path, pdf_path): html_path 
-                  for html_path, pdf_path in conversion_tasks}
-        
-        completed = 0
-        for future in concurrent.futures.as_completed(futures):
-            completed += 1
-            print(f"Progress: {completed}/{total_files} files ({(completed/total_files)*100:.1f}%)")
-    
-    end_time = time.time()
-    print(f"All conversions complete. PDFs saved to {output_dir}")
-    print(f"Total time: {end_time - start_time:.2f} seconds")
+        workers = pool.workers if pool is not None else min(os.cpu_count(), 4)
+    pypdf = load_pypdf()
+    if pypdf is None and workers > 1:
+        print("Warning: pypdf is not installed; rendering all documents in one worker "
+              "(pip install pypdf to parallelise)")
+        workers = 1
+    groups = _split_groups(html_files, min(workers, len(html_files)))
+    
+    own_pool = pool is None
+    if own_pool:
+        pool = ConverterPool(min(workers, len(groups)), max_tasks_per_worker=max_tasks_per_worker)
+    try:
+        single = len(groups) == 1
+        futures = [pool.submit(render_merge_group, group, toc=toc and single, url_fetcher=url_fetcher, profile=profile)
+                   for group in groups]
+        results = []
+        for group, future in zip(groups, futures):
+            results.append(future.result())
+            print(f"Rendered {len(group)} documents ({group[0]} ... {group[-1]})")
+    finally:
+        if own_pool:
+            pool.shutdown()
+    
+    failed = 0
+    for result in results:
+        for html_path, error in result['errors']:
+            print(f"Error converting {html_path}: {error}")
+            failed += 1
+    entries = [entry for result in results for entry in result['entries']]
+    group_pdfs = [result['pdf'] for result in results if result['pdf'] is not None]
+    if not group_pdfs:
+        print("No documents could be rendered; nothing written")
+        return {'merged': 0, 'failed': failed, 'pages': 0, 'elapsed': time.time() - start_time}
+    
+    output_dir = os.path.dirname(os.path.abspath(output_pdf))
+    os.makedirs(output_dir, exist_ok=True)
+    if len(groups) == 1:
+        with atomic_output(output_pdf) as temp_path, open(temp_path, 'wb') as f:
+            f.write(group_pdfs[0])
+    else:
+        # Concatenate the group PDFs; bookmarks of every document are kept
+        writer = pypdf.PdfWriter()
+        if toc:
+            writer.append(io.BytesIO(render_toc(entries, profile).write_pdf(**_render_options(profile))))
+        for pdf_bytes in group_pdfs:
+            writer.append(io.BytesIO(pdf_bytes))
+        # Fonts and images repeated across groups are stored once
+        if hasattr(writer, 'compress_identical_objects'):
+            writer.compress_identical_objects()
+        with atomic_output(output_pdf) as temp_path, open(temp_path, 'wb') as f:
+            writer.write(f)
+    
+    pages = sum(page_count for _, page_count in entries)
+    elapsed = time.time() - start_time
+    print(f"Merged {len(entries)} documents ({pages} pages) into {output_pdf}")
+    if failed:
+        print(f"{failed} files failed to convert and were left out")
+    print(f"Total time: {elapsed:.2f} seconds")
+    return {'merged': len(entries), 'failed': failed, 'pages': pages, 'elapsed': elapsed}
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+"""
+Per-document instrumentation and profiling helpers.
+
+ConversionMetrics records wall-clock time per conversion stage (read,
+parse, expand, layout, write, ...) and the page count of one document.
+peak_rss reports the resident set size high water mark, which on Linux can
+be reset between documents so each record reflects a single conversion. JsonlReport appends one JSON object per
+document to a run report, and profile_conversion wraps a single
+conversion in cProfile and tracemalloc.
+"""
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class ConversionMetrics:
+    """Accumulates wall-clock seconds per named stage of one conversion."""
+
+    def __init__(self):
+        self.stages = {}
+        self.pages = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def stage_seconds(self):
+        return {name: round(seconds, 4) for name, seconds in self.stages.items()}
+
+
+def reset_peak_rss():
+    """Reset the peak RSS counter of this process where the OS allows it (Linux)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in bytes, or None."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class JsonlReport:
+    """Append-only JSON-lines run report, one object per document."""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record):
+        self._file.write(json.dumps(record, default=str) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+def profile_conversion(convert, args, output_prefix, limit=40):
+    """
+    Run ``convert(*args)`` under cProfile and tracemalloc and save the results.
+
+    Writes ``<prefix>.prof`` (pstats data, e.g. for snakeviz),
+    ``<prefix>.txt`` (top functions by cumulative time) and
+    ``<prefix>.memory.txt`` (top allocation sites).
+
+    Returns:
+        The value returned by ``convert``
+    """
+    # Only needed here, so plain imports of this module stay cheap
+    import cProfile
+    import pstats
+
+    directory = os.path.dirname(os.path.abspath(output_prefix))
+    os.makedirs(directory, exist_ok=True)
+
+    profiler = cProfile.Profile()
+    tracemalloc.start(25)
+    profiler.enable()
+    try:
+        result = convert(*args)
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        profiler.dump_stats(f"{output_prefix}.prof")
+
+        text = io.StringIO()
+        stats = pstats.Stats(profiler, stream=text)
+        stats.sort_stats('cumulative').print_stats(limit)
+        with open(f"{output_prefix}.txt", 'w', encoding='utf-8') as f:
+            f.write(text.getvalue())
+
+        with open(f"{output_prefix}.memory.txt", 'w', encoding='utf-8') as f:
+            f.write(f"Peak traced memory: {peak / (1024 * 1024):.1f} MB\n")
+            f.write(f"Still allocated at the end: {current / (1024 * 1024):.1f} MB\n\n")
+            for stat in snapshot.statistics('lineno')[:limit]:
+                f.write(f"{stat}\n")
+
+        print(f"Profile saved to {output_prefix}.prof, {output_prefix}.txt and {output_prefix}.memory.txt")
+    return result
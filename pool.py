@@ -0,0 +1,608 @@
+"""
+Long-lived pool of warm worker processes for HTML to PDF conversion.
+
+Each worker loads WeasyPrint and the native Pango/cairo libraries once, in
+its initializer, and then converts documents until it has handled
+``max_tasks_per_worker`` of them, at which point it is retired and replaced
+by a fresh process to cap memory growth.
+
+A task that runs longer than ``task_timeout`` or whose worker grows past
+``max_worker_rss`` has its worker killed and replaced; only that task
+fails, with TaskTimeoutError or WorkerMemoryError. cancel() stops a task
+the same way, so a caller that gives up on a document does not leave a
+worker busy rendering it.
+
+resize() changes the number of workers while the pool runs: new workers
+start at once, and surplus ones retire as soon as they finish their
+current task.
+
+Futures are resolved outside the pool's lock, so their done callbacks may
+submit more work. A worker whose initializer fails is not replaced: its
+error fails the pending tasks, and later submit() calls raise
+WorkerStartError.
+"""
+import collections
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import pickle
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+# Number of documents a worker converts before it is replaced
+DEFAULT_MAX_TASKS_PER_WORKER = 100
+
+# Seconds between timeout and memory checks of busy workers
+LIMIT_CHECK_INTERVAL = 0.5
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+class WorkerCrashedError(RuntimeError):
+    """Raised for a task whose worker process died while running it."""
+
+
+class TaskTimeoutError(WorkerCrashedError):
+    """Raised for a task that ran past the pool's task_timeout; its worker was killed."""
+
+
+class WorkerMemoryError(WorkerCrashedError):
+    """Raised for a task whose worker grew past max_worker_rss; the worker was killed."""
+
+
+class TaskCancelledError(WorkerCrashedError):
+    """Raised for a running task cancelled with ConverterPool.cancel(); its worker was killed."""
+
+
+class WorkerStartError(RuntimeError):
+    """Raised by submit() once a worker failed to start, e.g. because its initializer raised."""
+
+
+class RemoteTraceback(Exception):
+    """Carries the formatted traceback of an exception raised in a worker."""
+
+    def __init__(self, tb):
+        self.tb = tb
+
+    def __str__(self):
+        return self.tb
+
+
+class TaskFuture(Future):
+    """Future that also records when its task was handed to a worker."""
+
+    def __init__(self):
+        super().__init__()
+        # time.monotonic() when a worker picked the task up
+        self.start_time = None
+        self._start_callbacks = []
+
+    def add_start_callback(self, fn):
+        """
+        Call ``fn(future)`` once the task starts on a worker, or right away
+        if it already has. Callbacks run on the pool's manager thread, so
+        they must be quick and thread-safe.
+        """
+        with self._condition:
+            if self.start_time is None:
+                self._start_callbacks.append(fn)
+                return
+        fn(self)
+
+    def _mark_started(self):
+        with self._condition:
+            self.start_time = time.monotonic()
+            callbacks, self._start_callbacks = self._start_callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                print(f"Error in task start callback: {str(e)}")
+
+
+def process_rss(pid):
+    """Return the resident set size of process ``pid`` in bytes, or None where unknown."""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def warm_up():
+    """
+    Worker initializer: load WeasyPrint and its native libraries, and build
+    the per-process stylesheet and font caches, before the first document.
+    """
+    import fix_libraries  # noqa: F401
+    import weasyprint  # noqa: F401
+    import cssselect2  # noqa: F401
+    import tinyhtml5  # noqa: F401
+    import expand
+    import stylesheets
+
+    stylesheets.parsed_stylesheet(expand.EXPAND_CSS)
+    stylesheets.shared_font_config()
+
+
+def _worker_main(conn, initializer):
+    """
+    Run tasks received over ``conn`` until told to stop. Tasks are answered
+    with (ok, value); the initializer's outcome is reported first as
+    (None, None), or (None, (exception, traceback)) if it raised.
+    """
+    if initializer is not None:
+        try:
+            initializer()
+        except BaseException as e:
+            try:
+                conn.send((None, (e, traceback.format_exc())))
+            except Exception:
+                # The exception could not be pickled
+                conn.send((None, (RuntimeError(repr(e)), traceback.format_exc())))
+            return
+    conn.send((None, None))
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+
+        fn, args, kwargs = task
+        try:
+            reply = (True, fn(*args, **kwargs))
+        except BaseException as e:
+            reply = (False, (e, traceback.format_exc()))
+
+        try:
+            conn.send(reply)
+        except Exception:
+            # The result or exception could not be pickled
+            error = RuntimeError(f"Could not send result of {getattr(fn, '__name__', fn)} back to the pool")
+            conn.send((False, (error, traceback.format_exc())))
+
+
+class _Worker:
+    """Parent-side handle for one worker process."""
+
+    def __init__(self, ctx, initializer):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, initializer), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.started = None
+        self.completed = 0
+        # The initializer finished and the worker takes tasks
+        self.ready = False
+
+
+class ConverterPool:
+    """
+    Pool of warm worker processes that can be reused across many
+    ``html_to_pdf`` and ``batch_convert_html_to_pdf`` calls.
+
+    Tasks are handed to one idle worker at a time, so a worker never holds
+    more than the document it is currently converting.
+
+    Args:
+        workers: Number of worker processes (default: min(CPU count, 4))
+        max_tasks_per_worker: Documents converted before a worker is recycled
+            (None to never recycle)
+        initializer: Callable run once in each new worker
+        mp_context: multiprocessing context (default: spawn)
+        task_timeout: Seconds a task may run before its worker is killed
+            (None for no limit); tasks only go to workers that have run
+            their initializer, so warm-up is not counted
+        max_worker_rss: Resident memory in bytes a busy worker may use
+            before it is killed (None for no limit; needs /proc, i.e. Linux)
+    """
+
+    def __init__(self, workers=None, max_tasks_per_worker=DEFAULT_MAX_TASKS_PER_WORKER,
+                 initializer=warm_up, mp_context=None, task_timeout=None, max_worker_rss=None):
+        if workers is None:
+            workers = min(os.cpu_count(), 4)
+        if workers <= 0:
+            raise ValueError("Number of workers must be positive")
+        if max_tasks_per_worker is not None and max_tasks_per_worker <= 0:
+            raise ValueError("max_tasks_per_worker must be positive or None")
+        if task_timeout is not None and task_timeout <= 0:
+            raise ValueError("task_timeout must be positive or None")
+        if max_worker_rss is not None and max_worker_rss <= 0:
+            raise ValueError("max_worker_rss must be positive or None")
+
+        self.workers = workers
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.task_timeout = task_timeout
+        self.max_worker_rss = max_worker_rss
+        self._initializer = initializer
+        # Spawn rather than fork: the pool forks from its manager thread
+        # when replacing workers, which is unsafe with the fork start method
+        self._ctx = mp_context or multiprocessing.get_context('spawn')
+
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        # Running tasks whose workers the manager thread should kill
+        self._cancelled = set()
+        # (future, ok, value) to resolve once the lock is released
+        self._outcomes = []
+        # Exception of a worker that failed to start; no workers are started after it
+        self._start_error = None
+        self._shutdown = False
+        self._wakeup_reader, self._wakeup_writer = self._ctx.Pipe(duplex=False)
+
+        self._workers = [_Worker(self._ctx, initializer) for _ in range(workers)]
+        self._retired = []
+
+        self._thread = threading.Thread(target=self._manage, name='ConverterPool', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+        return False
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedule ``fn(*args, **kwargs)`` on a worker and return a TaskFuture."""
+        future = TaskFuture()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("Cannot schedule new tasks after shutdown")
+            if self._start_error is not None:
+                raise WorkerStartError(f"Worker failed to start: {self._start_error!r}") from self._start_error
+            self._pending.append((future, fn, args, kwargs))
+            self._wakeup_writer.send_bytes(b'')
+        return future
+
+    def cancel(self, future):
+        """
+        Cancel a task, whether or not it has started.
+
+        A task still waiting for a worker is dropped, as with
+        Future.cancel(). A running task has its worker killed and replaced
+        by the manager thread, and fails with TaskCancelledError unless its
+        result arrives first.
+
+        Returns:
+            False if the task had already finished, else True
+        """
+        if future.cancel():
+            return True
+        with self._lock:
+            if future.done():
+                return False
+            self._cancelled.add(future)
+            self._wakeup_writer.send_bytes(b'')
+        return True
+
+    def resize(self, workers):
+        """
+        Change the number of worker processes. Workers are added right
+        away; surplus workers are retired once they are idle, so no running
+        task is interrupted.
+        """
+        if workers <= 0:
+            raise ValueError("Number of workers must be positive")
+        with self._lock:
+            if self._shutdown or self._start_error is not None:
+                return
+            self.workers = workers
+            while len(self._workers) < workers:
+                self._workers.append(_Worker(self._ctx, self._initializer))
+            for worker in list(self._workers):
+                if len(self._workers) <= workers:
+                    break
+                if worker.task is None:
+                    self._replace(worker, retire=True)
+            self._wakeup_writer.send_bytes(b'')
+
+    def worker_pids(self):
+        """Return the process IDs of the current workers."""
+        with self._lock:
+            return [worker.process.pid for worker in self._workers]
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """
+        Stop accepting tasks and stop the workers once pending tasks finish.
+
+        Args:
+            wait: Block until all workers have exited
+            cancel_futures: Cancel tasks that have not started yet
+        """
+        cancelled = []
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                cancelled = [task[0] for task in self._pending]
+                self._pending.clear()
+            self._wakeup_writer.send_bytes(b'')
+        # Outside the lock, so their callbacks may use the pool
+        for future in cancelled:
+            future.cancel()
+
+        if wait:
+            self._thread.join()
+
+    def _dispatch(self):
+        """
+        Hand pending tasks to idle workers that have finished their
+        initializer, so warm-up never counts against task_timeout. Called
+        with the lock held. Returns the futures of the tasks that were
+        started.
+        """
+        started = []
+        for worker in self._workers:
+            if worker.task is not None or not worker.ready:
+                continue
+
+            while self._pending:
+                task = self._pending.popleft()
+                future, fn, args, kwargs = task
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                try:
+                    worker.conn.send((fn, args, kwargs))
+                except (pickle.PicklingError, TypeError, AttributeError) as e:
+                    self._resolve(future, False, e)
+                    continue
+                except OSError:
+                    # The worker died while idle; its sentinel reports the crash
+                    pass
+
+                worker.task = task
+                worker.started = time.monotonic()
+                started.append(future)
+                break
+
+            if not self._pending:
+                break
+        return started
+
+    def _resolve(self, future, ok, value):
+        """Queue the outcome of a task. Called with the lock held."""
+        self._outcomes.append((future, ok, value))
+
+    def _take_outcomes(self):
+        """Return and clear the queued outcomes. Called with the lock held."""
+        outcomes, self._outcomes = self._outcomes, []
+        return outcomes
+
+    @staticmethod
+    def _deliver(outcomes):
+        """Resolve futures, without the lock, so done callbacks may submit more work."""
+        for future, ok, value in outcomes:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _receive(self, worker, reply):
+        """Handle one message from ``worker``. Called with the lock held."""
+        ok, value = reply
+        if ok is None:
+            if value is None:
+                worker.ready = True
+            else:
+                exc, tb = value
+                exc.__cause__ = RemoteTraceback(tb)
+                self._fail_start(worker, exc)
+        elif worker.task is not None:
+            self._finish_task(worker, reply)
+
+    def _fail_start(self, worker, error):
+        """
+        Give up on a worker that could not start: fail its task and every
+        pending task with error, and start no more workers, which would
+        fail the same way.
+        """
+        if self._start_error is None:
+            self._start_error = error
+        if worker.task is not None:
+            self._resolve(worker.task[0], False, error)
+            worker.task = None
+        while self._pending:
+            future = self._pending.popleft()[0]
+            if future.set_running_or_notify_cancel():
+                self._resolve(future, False, error)
+        worker.process.kill()
+        worker.process.join()
+        worker.conn.close()
+        self._workers.remove(worker)
+
+    def _finish_task(self, worker, reply):
+        """Resolve the current task of ``worker`` with its reply."""
+        future = worker.task[0]
+        worker.task = None
+        worker.started = None
+        worker.completed += 1
+
+        ok, value = reply
+        if ok:
+            self._resolve(future, True, value)
+        else:
+            exc, tb = value
+            exc.__cause__ = RemoteTraceback(tb)
+            self._resolve(future, False, exc)
+
+        if self.max_tasks_per_worker is not None and worker.completed >= self.max_tasks_per_worker:
+            self._replace(worker, retire=True)
+        elif len(self._workers) > self.workers:
+            # The pool was resized down while this worker was busy
+            self._replace(worker, retire=True)
+
+    def _replace(self, worker, retire=False):
+        """Swap ``worker`` for a fresh process."""
+        index = self._workers.index(worker)
+        if retire:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            self._retired.append(worker)
+        else:
+            worker.conn.close()
+
+        if ((self._shutdown and not self._pending) or len(self._workers) > self.workers
+                or self._start_error is not None):
+            del self._workers[index]
+        else:
+            self._workers[index] = _Worker(self._ctx, self._initializer)
+
+    def _handle_exit(self, worker):
+        """Deal with a worker process that exited on its own."""
+        # Drain messages sent just before the process went away
+        try:
+            while worker in self._workers and worker.conn.poll():
+                self._receive(worker, worker.conn.recv())
+        except (EOFError, OSError):
+            pass
+
+        if worker not in self._workers:
+            return
+
+        if not worker.ready:
+            # Died in its initializer; a replacement would do the same
+            self._fail_start(worker, WorkerCrashedError(
+                f"Worker process {worker.process.pid} exited with code {worker.process.exitcode} "
+                f"before it was ready"))
+            return
+        if worker.task is not None:
+            future = worker.task[0]
+            worker.task = None
+            self._resolve(future, False, WorkerCrashedError(
+                f"Worker process {worker.process.pid} exited with code {worker.process.exitcode}"))
+        self._replace(worker)
+
+    def _kill(self, worker, error):
+        """Kill a busy worker that broke a limit, fail its task and replace it."""
+        # A result that arrived in the meantime still counts
+        try:
+            while worker.task is not None and worker in self._workers and worker.conn.poll():
+                self._receive(worker, worker.conn.recv())
+        except (EOFError, OSError):
+            pass
+        if worker.task is None or worker not in self._workers:
+            return
+
+        future = worker.task[0]
+        worker.task = None
+        worker.started = None
+        worker.process.kill()
+        worker.process.join()
+        self._resolve(future, False, error)
+        self._replace(worker)
+
+    def _kill_cancelled(self):
+        """Kill the workers running cancelled tasks. Called with the lock held."""
+        for worker in list(self._workers):
+            if worker.task is not None and worker.task[0] in self._cancelled:
+                self._kill(worker, TaskCancelledError(
+                    f"Task was cancelled; worker process {worker.process.pid} was killed"))
+        self._cancelled.clear()
+
+    def _check_limits(self):
+        """Kill busy workers that ran too long or use too much memory. Called with the lock held."""
+        now = time.monotonic()
+        for worker in list(self._workers):
+            if worker.task is None:
+                continue
+            pid = worker.process.pid
+            if self.task_timeout is not None and now - worker.started > self.task_timeout:
+                self._kill(worker, TaskTimeoutError(
+                    f"Task ran longer than {self.task_timeout} seconds; worker process {pid} was killed"))
+                continue
+            if self.max_worker_rss is not None:
+                rss = process_rss(pid)
+                if rss is not None and rss > self.max_worker_rss:
+                    self._kill(worker, WorkerMemoryError(
+                        f"Worker process {pid} used {rss // (1024 * 1024)} MB, more than "
+                        f"{self.max_worker_rss // (1024 * 1024)} MB; it was killed"))
+
+    def _manage(self):
+        """Manager thread: dispatch tasks, collect results, replace workers."""
+        while True:
+            with self._lock:
+                started = self._dispatch()
+                busy = any(worker.task is not None for worker in self._workers)
+                stop = self._shutdown and not self._pending and not busy
+                workers = list(self._workers)
+                retired = list(self._retired)
+                outcomes = self._take_outcomes()
+
+            # Outside the lock, so start and done callbacks may submit more work
+            self._deliver(outcomes)
+            for future in started:
+                future._mark_started()
+            if stop:
+                break
+
+            waitables = {self._wakeup_reader: None}
+            for worker in workers:
+                waitables[worker.conn] = worker
+                waitables[worker.process.sentinel] = worker
+            for worker in retired:
+                waitables[worker.process.sentinel] = worker
+
+            # Wake up regularly to enforce limits while tasks are running
+            timeout = None
+            if busy and (self.task_timeout is not None or self.max_worker_rss is not None):
+                timeout = LIMIT_CHECK_INTERVAL
+
+            for ready in wait(list(waitables), timeout):
+                with self._lock:
+                    if ready is self._wakeup_reader:
+                        while self._wakeup_reader.poll():
+                            self._wakeup_reader.recv_bytes()
+                        continue
+
+                    worker = waitables[ready]
+                    if worker in self._retired:
+                        worker.process.join()
+                        worker.conn.close()
+                        self._retired.remove(worker)
+                    elif worker not in self._workers:
+                        continue
+                    elif ready is worker.conn:
+                        try:
+                            reply = worker.conn.recv()
+                        except (EOFError, OSError):
+                            worker.process.join()
+                            self._handle_exit(worker)
+                        else:
+                            self._receive(worker, reply)
+                    else:
+                        worker.process.join()
+                        self._handle_exit(worker)
+                    outcomes = self._take_outcomes()
+                self._deliver(outcomes)
+
+            with self._lock:
+                if self._cancelled:
+                    self._kill_cancelled()
+                if timeout is not None:
+                    self._check_limits()
+                outcomes = self._take_outcomes()
+            self._deliver(outcomes)
+
+        # Stop the remaining workers
+        for worker in self._workers + self._retired:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+        for worker in self._workers + self._retired:
+            worker.process.join()
+            worker.conn.close()
+        self._workers = []
+        self._retired = []
@@ -0,0 +1,52 @@
+"""
+Named output profiles trading PDF size against conversion speed.
+
+A profile is a set of WeasyPrint options applied to both layout and PDF
+writing. The 'default' profile leaves WeasyPrint's defaults alone, so
+output is unchanged unless a profile is asked for:
+
+    fast      no image re-encoding, fonts embedded whole instead of
+              subset, no hinting; quickest to write, largest files
+    balanced  images optimised, re-encoded as JPEG quality 80 and
+              downsampled to 150 dpi; much smaller image-heavy PDFs
+    archive   PDF/A-3b with sRGB output intent and losslessly optimised
+              images at full resolution, for long-term storage
+"""
+
+DEFAULT_PROFILE = 'default'
+
+PROFILES = {
+    'default': {},
+    'fast': {
+        'optimize_images': False,
+        'full_fonts': True,
+        'hinting': False,
+    },
+    'balanced': {
+        'optimize_images': True,
+        'jpeg_quality': 80,
+        'dpi': 150,
+    },
+    'archive': {
+        'pdf_variant': 'pdf/a-3b',
+        'srgb': True,
+        'optimize_images': True,
+    },
+}
+
+
+def profile_options(profile=None):
+    """
+    Return the WeasyPrint options of a profile.
+
+    Args:
+        profile: Profile name (None for the default profile)
+
+    Raises:
+        ValueError: If the profile does not exist
+    """
+    name = profile or DEFAULT_PROFILE
+    try:
+        return dict(PROFILES[name])
+    except KeyError:
+        raise ValueError(f"Unknown output profile {name!r} (choose from {', '.join(PROFILES)})") from None
@@ -0,0 +1,84 @@
+"""
+Quarantine of documents that keep failing in batch conversion.
+
+A document that still fails after its retries is recorded in a JSON-lines
+file in the output directory, together with the size and modification time
+of the file at that point. Later batches skip it without spending a worker
+on it again, until the file changes or the quarantine is released.
+"""
+import json
+import os
+import time
+
+QUARANTINE_FILE = 'quarantine.jsonl'
+
+
+def _signature(html_path):
+    try:
+        st = os.stat(html_path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+class Quarantine:
+    """
+    Append-only record of quarantined documents.
+
+    Args:
+        path: JSON-lines file; entries already in it are loaded
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get('released'):
+                        self.entries.pop(record['html_path'], None)
+                    else:
+                        self.entries[record['html_path']] = record
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def in_directory(cls, directory):
+        return cls(os.path.join(directory, QUARANTINE_FILE))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, html_path):
+        """Return the quarantine record of html_path if it applies to the file as it is now."""
+        record = self.entries.get(os.path.abspath(html_path))
+        if record is not None and record.get('signature') == _signature(html_path):
+            return record
+        return None
+
+    def add(self, html_path, error, attempts):
+        """Quarantine html_path after it failed ``attempts`` times."""
+        record = {
+            'html_path': os.path.abspath(html_path),
+            'error': error,
+            'attempts': attempts,
+            'signature': _signature(html_path),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        self.entries[record['html_path']] = record
+        self._append(record)
+
+    def release(self, html_path):
+        """Remove html_path from the quarantine, e.g. once it converts successfully."""
+        html_path = os.path.abspath(html_path)
+        if self.entries.pop(html_path, None) is not None:
+            self._append({'html_path': html_path, 'released': True})
+
+    def _append(self, record):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
@@ -0,0 +1,279 @@
+"""
+Content-addressed on-disk cache of rendered PDFs.
+
+Entries are keyed on a hash of everything that affects the output: the raw
+HTML bytes, the local files it references (images, stylesheets, and the
+fonts, images and stylesheets those stylesheets reference in turn), and
+any extra inputs the caller passes in such as the injected CSS and the
+WeasyPrint version. On a hit the cached PDF is hard-linked (or copied when
+linking is not possible) to the requested output path.
+
+Remote assets are not part of the key: a document whose remote images or
+stylesheets change keeps its cached PDF until the HTML changes, or until
+the entry is removed (delete the cache directory to start over).
+"""
+import hashlib
+import os
+import re
+import shutil
+import stat
+import tempfile
+from urllib.parse import unquote, urlsplit
+
+# Default maximum cache size (1 GiB)
+DEFAULT_CACHE_SIZE = 1024 ** 3
+
+# src="...", href="...", url(...) and @import "..." references in HTML/inline CSS
+_ASSET_RE = re.compile(rb'''(?:\b(?:src|href)\s*=\s*["']([^"']+)["']|url\(\s*["']?([^"')]+)["']?\s*\)'''
+                       rb'''|@import\s+["']([^"']+)["'])''', re.IGNORECASE)
+
+# url(...) and @import "..." references in a stylesheet
+_CSS_ASSET_RE = re.compile(rb'''url\(\s*["']?([^"')]+)["']?\s*\)|@import\s+["']([^"']+)["']''', re.IGNORECASE)
+
+# Asset content hashes so shared assets are read once: path -> (mtime_ns, size, digest).
+# A changed file replaces its entry, so the memo grows only with the number of paths.
+_asset_digests = {}
+
+# Local files referenced by a stylesheet: path -> (mtime_ns, size, paths)
+_stylesheet_references = {}
+
+
+def _umask():
+    """Return the process umask from /proc/self/status, or None where it is not listed."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _file_mode(directory):
+    """
+    Mode a newly created file gets under the current umask. The umask is
+    read without setting it, which would briefly change it for every
+    thread; without /proc a scratch file in directory shows its effect.
+    """
+    umask = _umask()
+    if umask is not None:
+        return 0o666 & ~umask
+    fd, probe = tempfile.mkstemp(dir=directory, suffix='.mode')
+    try:
+        os.close(fd)
+        os.unlink(probe)
+        fd = os.open(probe, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        os.close(fd)
+        return stat.S_IMODE(os.stat(probe).st_mode)
+    finally:
+        try:
+            os.unlink(probe)
+        except OSError:
+            pass
+
+
+def _local_asset_path(url, base_dir):
+    """Resolve a referenced URL to a local file path, or None if it is not local."""
+    parts = urlsplit(url)
+    if parts.scheme == 'file':
+        path = unquote(parts.path)
+    elif parts.scheme or parts.netloc:
+        # http:, data:, mailto:, ... are not local files
+        return None
+    else:
+        path = unquote(parts.path)
+        if not path:
+            return None
+        path = os.path.join(base_dir, path)
+    return os.path.normpath(path)
+
+
+def _asset_digest(path):
+    """Return the content hash of a local file, or None if it cannot be read."""
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    if not os.path.isfile(path):
+        return None
+
+    cached = _asset_digests.get(path)
+    if cached is not None and cached[0] == info.st_mtime_ns and cached[1] == info.st_size:
+        return cached[2]
+    h = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(block)
+    except OSError:
+        return None
+    digest = h.hexdigest()
+    _asset_digests[path] = (info.st_mtime_ns, info.st_size, digest)
+    return digest
+
+
+def _references(data, base_dir, pattern):
+    """Return the local file paths referenced in data."""
+    paths = set()
+    for match in pattern.finditer(data):
+        url = next(group for group in match.groups() if group).decode('utf-8', 'replace').strip()
+        path = _local_asset_path(url, base_dir)
+        if path is not None:
+            paths.add(path)
+    return paths
+
+
+def _stylesheet_assets(path):
+    """Return the local files a stylesheet references, or an empty set if it cannot be read."""
+    try:
+        info = os.stat(path)
+    except OSError:
+        return set()
+    cached = _stylesheet_references.get(path)
+    if cached is not None and cached[0] == info.st_mtime_ns and cached[1] == info.st_size:
+        return cached[2]
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return set()
+    references = _references(data, os.path.dirname(path), _CSS_ASSET_RE)
+    _stylesheet_references[path] = (info.st_mtime_ns, info.st_size, references)
+    return references
+
+
+class RenderCache:
+    """
+    On-disk PDF cache with size-based least-recently-used eviction.
+
+    Args:
+        cache_dir: Directory holding the cached PDFs
+        max_size: Maximum total size of the cache in bytes
+    """
+
+    def __init__(self, cache_dir, max_size=DEFAULT_CACHE_SIZE):
+        self.cache_dir = str(cache_dir)
+        self.max_size = max_size
+        self._size = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, html_bytes, base_dir, *extra):
+        """
+        Compute the cache key for a document.
+
+        Args:
+            html_bytes: Raw bytes of the HTML document
+            base_dir: Directory that relative asset references resolve against
+            extra: Further strings that affect the rendered output
+        """
+        h = hashlib.sha256()
+        h.update(hashlib.sha256(html_bytes).digest())
+
+        for part in extra:
+            h.update(b'\0')
+            h.update(str(part).encode('utf-8'))
+
+        # Follow linked and imported stylesheets to the fonts and images they use
+        assets = set()
+        unvisited = _references(html_bytes, base_dir, _ASSET_RE)
+        while unvisited:
+            path = unvisited.pop()
+            assets.add(path)
+            if path.lower().endswith('.css'):
+                unvisited |= _stylesheet_assets(path) - assets
+        for path in sorted(assets):
+            digest = _asset_digest(path)
+            if digest is not None:
+                h.update(b'\0')
+                h.update(path.encode('utf-8', 'surrogateescape'))
+                h.update(digest.encode('ascii'))
+
+        return h.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.pdf')
+
+    def get(self, key, pdf_path):
+        """
+        Materialise the cached PDF for ``key`` at ``pdf_path``.
+
+        Returns True on a cache hit, False otherwise.
+        """
+        entry = self._entry_path(key)
+        try:
+            # Touch the entry so eviction sees it as recently used
+            os.utime(entry)
+        except OSError:
+            return False
+
+        try:
+            # Entries written before put() set the mode were private
+            os.chmod(entry, _file_mode(os.path.dirname(entry)))
+            if os.path.lexists(pdf_path):
+                os.unlink(pdf_path)
+            try:
+                os.link(entry, pdf_path)
+            except OSError:
+                shutil.copyfile(entry, pdf_path)
+        except OSError as e:
+            print(f"Warning: could not reuse cached PDF for {pdf_path}: {e}")
+            return False
+        return True
+
+    def put(self, key, pdf_path):
+        """Store the rendered PDF at ``pdf_path`` under ``key``."""
+        entry = self._entry_path(key)
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry), suffix='.tmp')
+            os.close(fd)
+            try:
+                shutil.copyfile(pdf_path, tmp_path)
+                # mkstemp creates the file private; hits are linked to output paths
+                os.chmod(tmp_path, _file_mode(os.path.dirname(entry)))
+                os.replace(tmp_path, entry)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            size = os.path.getsize(entry)
+        except OSError as e:
+            print(f"Warning: could not add {pdf_path} to the render cache: {e}")
+            return
+
+        if self._size is None:
+            self._size = self._scan_size()
+        else:
+            self._size += size
+        if self._size > self.max_size:
+            self.evict()
+
+    def _entries(self):
+        """Yield (mtime, size, path) for every cached PDF."""
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.pdf'):
+                    try:
+                        info = entry.stat()
+                    except OSError:
+                        continue
+                    yield info.st_mtime, info.st_size, entry.path
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_size."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+        self._size = total
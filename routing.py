@@ -0,0 +1,313 @@
+"""
+Routing of documents between the calling process and the worker pool by
+estimated cost.
+
+Every task handed to a ConverterPool worker pays for pickling, two pipe
+messages and a worker wake-up, however small the document. For a 5 KB
+notification page that overhead is a noticeable share of the conversion,
+while a large report needs a process of its own. AdaptiveExecutor
+estimates each document's cost (see cost.py) and routes it:
+
+- 'pool': documents costing small_cost or more get a pool task each
+- 'local': smaller ones are rendered on a thread of the calling process
+  when one of local_threads is free
+- 'batched': otherwise small documents are grouped, up to small_batch to
+  a pool task, so they share one round trip
+
+Small documents wait while every worker is busy and are sent as soon as a
+worker falls idle, shared out between the idle workers, so batches grow
+under load and stay at a single document while the pool has room. Only
+when every worker is busy is a full batch queued in the pool at once. A batch shares one
+worker, so a crash or timeout fails all of its documents: each gets a
+BatchFailedError, which says nothing about the document itself, and
+callers should submit it again with alone=True to find out.
+"""
+import concurrent.futures
+import threading
+
+from cost import estimate_cost
+from main import convert_file
+from pool import TaskFuture
+
+# Estimated cost (cost.py units) below which a document counts as small;
+# a 5 KB page with a few tables or one image costs about 30
+DEFAULT_SMALL_COST = 50.0
+
+# Most small documents sent to a worker in one task
+DEFAULT_SMALL_BATCH = 8
+
+
+class BatchFailedError(RuntimeError):
+    """
+    The pool task of a batch of small documents crashed, timed out or ran
+    out of memory, so none of its documents was converted. The document may
+    not be the cause; submit it again with alone=True. The pool's error is
+    the __cause__.
+    """
+
+
+def convert_files(pairs, url_fetcher=None, profile=None):
+    """
+    Worker task: convert several small HTML files in one round trip.
+
+    Args:
+        pairs: (html_path, pdf_path) tuples
+        url_fetcher: Fetcher for images and stylesheets
+        profile: Output profile name (see profiles.py)
+
+    Returns:
+        One (record, None) or (None, error message) tuple per pair, in
+        order; records are those of convert_file
+    """
+    results = []
+    for html_path, pdf_path in pairs:
+        try:
+            results.append((convert_file(html_path, pdf_path, url_fetcher, profile), None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
+
+
+def _resolve(future, record=None, error=None):
+    """Complete a document's future, unless its caller cancelled it."""
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(record)
+    except concurrent.futures.InvalidStateError:
+        pass
+
+
+class AdaptiveExecutor:
+    """
+    Converts documents on a ConverterPool or in the calling process,
+    depending on their estimated cost.
+
+    The executor does not own the pool: close() stops routing and sends
+    any waiting documents, but leaves the pool running.
+
+    Args:
+        pool: ConverterPool that runs heavy documents and batches
+        small_cost: Documents estimated below this many cost units are
+            small (default: DEFAULT_SMALL_COST; 0 gives every document a
+            pool task of its own)
+        small_batch: Most small documents per pool task (default:
+            DEFAULT_SMALL_BATCH)
+        local_threads: Threads in the calling process that render small
+            documents; 0 keeps every document in the pool. Each thread has
+            its own image cache and font configuration, and the records of
+            its documents have no peak_rss, which would be the calling
+            process's. Documents rendered locally load WeasyPrint into the
+            calling process and are not covered by the pool's timeout and
+            memory limits; one that crashes its renderer takes the calling
+            process with it.
+    """
+
+    def __init__(self, pool, small_cost=None, small_batch=None, local_threads=0):
+        if small_cost is None:
+            small_cost = DEFAULT_SMALL_COST
+        if small_batch is None:
+            small_batch = DEFAULT_SMALL_BATCH
+        if small_cost < 0:
+            raise ValueError("small_cost must not be negative")
+        if small_batch <= 0:
+            raise ValueError("small_batch must be positive")
+        if local_threads < 0:
+            raise ValueError("local_threads must not be negative")
+
+        self.pool = pool
+        self.small_cost = small_cost
+        self.small_batch = small_batch
+        self.local_threads = local_threads
+        # Documents converted by each route, and the pool tasks sent with batches
+        self.routes = {'pool': 0, 'local': 0, 'batched': 0, 'batches': 0}
+
+        self._condition = threading.Condition()
+        # (id(url_fetcher), profile) -> small documents waiting for a batch,
+        # as (html_path, pdf_path, url_fetcher, profile, future)
+        self._waiting = {}
+        # Pool tasks sent and not finished yet
+        self._outstanding = 0
+        self._local_busy = 0
+        self._closed = False
+        self._local = None
+        if local_threads:
+            self._local = concurrent.futures.ThreadPoolExecutor(local_threads, thread_name_prefix='local-render')
+        self._thread = threading.Thread(target=self._send_batches, name='AdaptiveExecutor', daemon=True)
+        self._thread.start()
+
+    @property
+    def workers(self):
+        return self.pool.workers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def submit_file(self, html_path, pdf_path, url_fetcher=None, profile=None, cost=None, alone=False):
+        """
+        Route the conversion of one HTML file.
+
+        Args:
+            html_path: Path of the HTML file
+            pdf_path: Output path
+            url_fetcher: Fetcher for images and stylesheets
+            profile: Output profile name (see profiles.py)
+            cost: Estimated cost, if the caller has it (see cost.py)
+            alone: Give the document a pool task of its own whatever its
+                cost, e.g. to retry it after its batch failed
+
+        Returns:
+            A TaskFuture for the convert_file record, which gains a 'route'
+            entry; start callbacks run on the pool's manager thread or on
+            a local thread. It fails with BatchFailedError if the document's
+            batch failed as a whole.
+        """
+        if cost is None and not alone:
+            cost = estimate_cost(html_path)
+        future = TaskFuture()
+        entry = (html_path, pdf_path, url_fetcher, profile, future)
+        batch = None
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Cannot schedule new conversions after close")
+            if alone or cost >= self.small_cost:
+                route = 'pool'
+                self._outstanding += 1
+            elif self._local_busy < self.local_threads:
+                route = 'local'
+                self._local_busy += 1
+            else:
+                route = 'batched'
+                waiting = self._waiting.setdefault((id(url_fetcher), profile), [])
+                waiting.append(entry)
+                if len(waiting) >= self.small_batch and self._outstanding >= self.pool.workers:
+                    # Queue it behind the busy workers rather than wait for one to finish
+                    batch = self._take_batch((id(url_fetcher), profile))
+                else:
+                    # Sent by the batch thread once a worker is idle
+                    self._condition.notify()
+
+        if route == 'pool':
+            self._send([entry], route)
+        elif route == 'local':
+            self._local.submit(self._convert_locally, entry)
+        elif batch is not None:
+            self._send(batch, route)
+        return future
+
+    def close(self):
+        """Send the documents still waiting for a batch and stop the local threads."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        if self._local is not None:
+            self._local.shutdown(wait=True)
+
+    def _take_batch(self, key, size=None):
+        """Remove up to size (at most small_batch) waiting documents. Called with the condition held."""
+        size = min(size or self.small_batch, self.small_batch)
+        waiting = self._waiting[key]
+        batch = waiting[:size]
+        del waiting[:size]
+        if not waiting:
+            del self._waiting[key]
+        self._outstanding += 1
+        self.routes['batches'] += 1
+        return batch
+
+    def _send_batches(self):
+        """Send waiting small documents whenever a worker may be idle."""
+        while True:
+            with self._condition:
+                while not self._waiting or (self._outstanding >= self.pool.workers and not self._closed):
+                    if self._closed and not self._waiting:
+                        return
+                    self._condition.wait()
+                key = next(iter(self._waiting))
+                # Share the waiting documents out between the idle workers
+                idle = max(1, self.pool.workers - self._outstanding)
+                batch = self._take_batch(key, -(-len(self._waiting[key]) // idle))
+            self._send(batch, 'batched')
+
+    def _send(self, entries, route):
+        """Hand entries to the pool as one task."""
+        html_path, pdf_path, url_fetcher, profile, _ = entries[0]
+        try:
+            if len(entries) == 1:
+                task = self.pool.submit(convert_file, html_path, pdf_path, url_fetcher, profile)
+            else:
+                pairs = [(entry[0], entry[1]) for entry in entries]
+                task = self.pool.submit(convert_files, pairs, url_fetcher, profile)
+        except Exception as e:
+            with self._condition:
+                self._outstanding -= 1
+                self._condition.notify()
+            for entry in entries:
+                _resolve(entry[4], error=e)
+            return
+
+        def started(task):
+            for entry in entries:
+                entry[4]._mark_started()
+
+        task.add_start_callback(started)
+        task.add_done_callback(lambda task: self._task_done(task, entries, route))
+
+    def _task_done(self, task, entries, route):
+        """Hand a pool task's outcome to its documents. Runs on the pool's manager thread."""
+        with self._condition:
+            self._outstanding -= 1
+            self._condition.notify()
+
+        if task.cancelled():
+            for entry in entries:
+                entry[4].cancel()
+            return
+        try:
+            result = task.result()
+        except Exception as e:
+            if len(entries) == 1:
+                _resolve(entries[0][4], error=e)
+                return
+            # The worker crashed or timed out on one of the documents, or on all of them together
+            for entry in entries:
+                error = BatchFailedError(f"batch of {len(entries)} documents failed: {e}")
+                error.__cause__ = e
+                _resolve(entry[4], error=error)
+            return
+
+        results = [(result, None)] if len(entries) == 1 else result
+        with self._condition:
+            self.routes[route] += sum(error is None for _, error in results)
+        for entry, (record, error) in zip(entries, results):
+            if error is not None:
+                _resolve(entry[4], error=RuntimeError(error))
+            else:
+                record['route'] = route
+                _resolve(entry[4], record)
+
+    def _convert_locally(self, entry):
+        html_path, pdf_path, url_fetcher, profile, future = entry
+        future._mark_started()
+        try:
+            record = convert_file(html_path, pdf_path, url_fetcher, profile, per_thread=True)
+        except Exception as e:
+            error = e
+        else:
+            error = None
+            record['route'] = 'local'
+        # Free the thread before the caller hears back and submits the next document
+        with self._condition:
+            self._local_busy -= 1
+            if error is None:
+                self.routes['local'] += 1
+        if error is not None:
+            _resolve(future, error=error)
+        else:
+            _resolve(future, record)
@@ -0,0 +1,280 @@
+"""
+Chunked rendering of one very large document on several cores.
+
+A report made of hundreds of top-level ``.collapsible`` sections is parsed
+once and cut at section boundaries into chunks of similar size. Every
+chunk keeps the document's <head> (title, styles, linked stylesheets) and
+the attributes of <html>, <body> and any wrapper elements around the
+sections, so it renders with the same styles. The chunks are expanded and
+laid out by different workers, and their PDFs are concatenated with pypdf.
+Each worker only ever holds the layout of its own chunk, so both the time
+and the peak memory per process fall with the number of chunks.
+
+Every chunk starts on a new page and page counters restart in each chunk,
+so a section that would have started mid-page in a whole-document render
+starts on a fresh page instead.
+"""
+import io
+import math
+import os
+import time
+from xml.etree.ElementTree import Element
+
+import assets
+import stylesheets
+from expand import INJECTED_CSS, expand_tree
+from main import (_render_options, atomic_output, decode_html, html_to_pdf, load_pypdf, load_weasyprint,
+                  render_tree)
+from metrics import ConversionMetrics
+from pool import ConverterPool, DEFAULT_MAX_TASKS_PER_WORKER
+from profiles import profile_options
+
+# Approximate amount of document text per chunk
+DEFAULT_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def _is_section_start(element):
+    return isinstance(element.tag, str) and 'collapsible' in element.get('class', '').split()
+
+
+def _weight(element):
+    """Rough size of an element's subtree in bytes of source."""
+    return sum(len(e.text or '') + len(e.tail or '') + 16 for e in element.iter())
+
+
+def section_path(root):
+    """
+    Find the element whose children are the top-level sections.
+
+    Returns:
+        The path [body, ..., container] to the shallowest element with at
+        least two .collapsible children, or None if there is none
+    """
+    body = next((child for child in root if child.tag == 'body'), None)
+    if body is None:
+        return None
+    level = [[body]]
+    while level:
+        next_level = []
+        for path in level:
+            children = [child for child in path[-1] if isinstance(child.tag, str)]
+            if sum(1 for child in children if _is_section_start(child)) >= 2:
+                return path
+            next_level.extend(path + [child] for child in children)
+        level = next_level
+    return None
+
+
+def split_sections(container):
+    """
+    Group the children of container into sections. A section starts at
+    each .collapsible element; content before the first one joins it.
+    """
+    sections = [[]]
+    started = False
+    for child in container:
+        if _is_section_start(child):
+            if started:
+                sections.append([])
+            started = True
+        sections[-1].append(child)
+    return sections
+
+
+def _group(weights, count):
+    """Split indexes 0..len(weights) into at most count contiguous ranges of similar total weight."""
+    target = sum(weights) / count
+    ranges = []
+    start = 0
+    total = 0
+    for index, weight in enumerate(weights):
+        total += weight
+        remaining_items = len(weights) - index - 1
+        remaining_ranges = count - len(ranges) - 1
+        # Close the range once it is full, keeping an item for every range still to come
+        if remaining_ranges > 0 and remaining_items > 0 and (total >= target or remaining_items <= remaining_ranges):
+            ranges.append((start, index + 1))
+            start = index + 1
+            total = 0
+    ranges.append((start, len(weights)))
+    return ranges
+
+
+def _chunk_copy(path, children, first, last):
+    """
+    Copy the elements of path down to the section container, holding
+    children instead of all sections. Content around the sections stays in
+    the first chunk (before them) or the last chunk (after them).
+    """
+    element = path[0]
+    shell = Element(element.tag, element.attrib)
+    shell.text = element.text if first else None
+    shell.tail = element.tail if last else None
+    if len(path) == 1:
+        shell.extend(children)
+        return shell
+    siblings = list(element)
+    index = siblings.index(path[1])
+    if first:
+        shell.extend(siblings[:index])
+    shell.append(_chunk_copy(path[1:], children, first, last))
+    if last:
+        shell.extend(siblings[index + 1:])
+    return shell
+
+
+def split_document(root, min_chunks=1, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Split a parsed document at its top-level section boundaries.
+
+    Args:
+        root: Root element returned by tinyhtml5.parse
+        min_chunks: Cut into at least this many chunks if there are enough sections
+        chunk_bytes: Cut into more chunks when they would be larger than this
+
+    Returns:
+        A list of root elements, one per chunk, that share the document's
+        <head>; [root] if the document has no sections to split at
+    """
+    path = section_path(root)
+    if path is None:
+        return [root]
+    sections = split_sections(path[-1])
+    weights = [sum(_weight(element) for element in section) for section in sections]
+    count = max(min_chunks, math.ceil(sum(weights) / chunk_bytes))
+    count = min(count, len(sections))
+    if count <= 1:
+        return [root]
+
+    ranges = _group(weights, count)
+    chunks = []
+    for number, (start, end) in enumerate(ranges):
+        children = [element for section in sections[start:end] for element in section]
+        chunk = Element(root.tag, root.attrib)
+        for child in root:
+            if child is path[0]:
+                chunk.append(_chunk_copy(path, children, number == 0, number == len(ranges) - 1))
+            else:
+                chunk.append(child)
+        chunks.append(chunk)
+    return chunks
+
+
+def render_chunk(root, base_url, own_fonts=False, url_fetcher=None, profile=None):
+    """
+    Worker task: expand and lay out one chunk of a document.
+
+    Args:
+        root: Root element of the chunk
+        base_url: Base used to resolve relative URLs (the source document)
+        own_fonts: The document declares @font-face rules of its own
+        url_fetcher: Fetcher for images and stylesheets
+        profile: Output profile name (see profiles.py)
+
+    Returns:
+        A dict with the chunk's PDF bytes ('pdf'), its page count ('pages')
+        and its stage timings ('stages')
+    """
+    metrics = ConversionMetrics()
+    with metrics.stage('setup'):
+        load_weasyprint()
+        font_config = stylesheets.font_config_for(None, own_fonts=own_fonts)
+    with metrics.stage('expand'):
+        expand_tree(root, INJECTED_CSS)
+    image_cache = assets.image_cache(profile)
+    try:
+        document = render_tree(root, font_config, base_url, metrics, image_cache, url_fetcher, profile)
+        with metrics.stage('write'):
+            pdf_bytes = document.write_pdf(**_render_options(profile))
+    finally:
+        image_cache.trim()
+    return {'pdf': pdf_bytes, 'pages': metrics.pages, 'stages': metrics.stage_seconds()}
+
+
+def chunked_html_to_pdf(html_path, pdf_path=None, workers=None, pool=None, chunk_bytes=DEFAULT_CHUNK_BYTES,
+                        max_tasks_per_worker=DEFAULT_MAX_TASKS_PER_WORKER, url_fetcher=None, profile=None):
+    """
+    Convert one large HTML file to PDF, laying out its sections in parallel.
+
+    The document is cut into at least one chunk per worker, and more when
+    chunks would exceed chunk_bytes of source. Documents without
+    .collapsible sections, or without pypdf installed, are converted whole.
+
+    Args:
+        html_path: Path of the HTML file
+        pdf_path: Output path (default: html_path with .pdf)
+        workers: Number of parallel workers (default: CPU count, max 4)
+        pool: Existing ConverterPool to run on
+        chunk_bytes: Largest amount of document source per chunk
+        max_tasks_per_worker: Chunks a worker renders before it is recycled
+              (only used when no pool is given)
+        url_fetcher: Fetcher for images and stylesheets
+        profile: Output profile name (see profiles.py)
+
+    Returns:
+        A dict with the pdf_path, the chunk and page counts and the elapsed
+        time, or None if the conversion failed
+    """
+    start_time = time.time()
+    profile_options(profile)  # fail early on an unknown profile
+    if pdf_path is None:
+        pdf_path = os.path.splitext(html_path)[0] + '.pdf'
+
+    pypdf = load_pypdf()
+    if pypdf is None:
+        print(f"Warning: pypdf is not installed; converting {html_path} as one document "
+              f"(pip install pypdf to split it)")
+        result = html_to_pdf(html_path, pdf_path, pool=pool, url_fetcher=url_fetcher, profile=profile)
+        return result and {'pdf_path': result, 'chunks': 1, 'pages': None, 'elapsed': time.time() - start_time}
+
+    if workers is None:
+        workers = pool.workers if pool is not None else min(os.cpu_count(), 4)
+    own_pool = pool is None
+    futures = []
+    try:
+        # 1. Parse once and cut at section boundaries
+        import tinyhtml5
+        source_path = os.path.abspath(html_path)
+        with open(source_path, 'rb') as f:
+            html_content = decode_html(f.read())
+        own_fonts = stylesheets.declares_fonts(html_content, os.path.dirname(source_path))
+        root = tinyhtml5.parse(html_content, namespace_html_elements=False)
+        del html_content
+        chunks = split_document(root, workers, chunk_bytes)
+        del root
+        print(f"Split {html_path} into {len(chunks)} chunks")
+
+        # 2. Lay the chunks out in parallel; each is pickled when a worker takes it
+        if own_pool:
+            pool = ConverterPool(min(workers, len(chunks)), max_tasks_per_worker=max_tasks_per_worker)
+        futures = [pool.submit(render_chunk, chunk, source_path, own_fonts, url_fetcher, profile)
+                   for chunk in chunks]
+        del chunks
+
+        # 3. Stitch the pages together in document order as the chunks arrive
+        writer = pypdf.PdfWriter()
+        pages = 0
+        for number, future in enumerate(futures, 1):
+            result = future.result()
+            writer.append(io.BytesIO(result['pdf']))
+            pages += result['pages']
+            print(f"Rendered chunk {number}/{len(futures)} ({result['pages']} pages)")
+        # Fonts and images repeated across chunks are stored once
+        if hasattr(writer, 'compress_identical_objects'):
+            writer.compress_identical_objects()
+        output_dir = os.path.dirname(os.path.abspath(pdf_path))
+        os.makedirs(output_dir, exist_ok=True)
+        with atomic_output(pdf_path) as temp_path, open(temp_path, 'wb') as f:
+            writer.write(f)
+    except Exception as e:
+        print(f"Error converting {html_path}: {str(e)}")
+        for future in futures:
+            pool.cancel(future)
+        return None
+    finally:
+        if own_pool and pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    elapsed = time.time() - start_time
+    print(f"Converted {html_path} to {pdf_path} ({pages} pages) in {elapsed:.2f} seconds")
+    return {'pdf_path': pdf_path, 'chunks': len(futures), 'pages': pages, 'elapsed': elapsed}
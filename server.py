@@ -0,0 +1,305 @@
+"""
+Local HTTP conversion service.
+
+Runs an asyncio HTTP server in front of a warm ConverterPool so that a
+sidecar can convert documents without paying the import cost per request:
+
+    POST /convert   HTML in the request body, PDF in the response; the
+                    base_url and profile query parameters are optional
+    GET  /health    Liveness plus queue and conversion counters (JSON)
+    GET  /metrics   Same counters as /health (JSON)
+
+Requests beyond the worker count plus the configured queue depth are
+rejected with 429 so callers can back off, and every conversion is bounded
+by a per-request timeout (504). The capacity check happens before the body
+is read, so an overloaded server does not buffer uploads it will refuse;
+it answers and closes the connection instead.
+
+Request bodies come from clients, so by default documents may only fetch
+http, https and data URLs: a file: base_url is refused with 400, and a
+document that references local files has them refused by the fetcher.
+Pass local_files=True (--allow-local-files) to let trusted callers render
+against files on the server.
+"""
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit, parse_qs
+
+from assets import RemoteOnlyFetcher
+from main import convert_html
+from pool import ConverterPool, DEFAULT_MAX_TASKS_PER_WORKER
+from profiles import PROFILES
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+DEFAULT_QUEUE_DEPTH = 32
+DEFAULT_TIMEOUT = 120
+# Largest request body accepted (bytes)
+DEFAULT_MAX_BODY = 32 * 1024 * 1024
+
+# Size of the chunks the PDF is streamed back in
+_WRITE_CHUNK = 256 * 1024
+
+_REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    411: 'Length Required', 413: 'Payload Too Large', 429: 'Too Many Requests',
+    500: 'Internal Server Error', 504: 'Gateway Timeout',
+}
+
+
+class _BadRequest(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class _Body:
+    """Request body, left unread until the request has been accepted."""
+
+    def __init__(self, reader, length):
+        self.reader = reader
+        self.length = length
+        self.consumed = not length
+
+    async def read(self):
+        self.consumed = True
+        return await self.reader.readexactly(self.length) if self.length else b''
+
+
+class ConversionServer:
+    """
+    HTTP front end for a ConverterPool.
+
+    Args:
+        pool: ConverterPool that renders the documents
+        queue_depth: Requests allowed to wait for a free worker before
+                     new ones are rejected with 429
+        timeout: Seconds a single conversion may take before a 504
+        max_body: Largest accepted request body in bytes
+        url_fetcher: Fetcher for the images and stylesheets of documents
+        profile: Output profile used when a request does not name one
+        local_files: Let documents and base_url read files on the server
+                     (only for trusted callers)
+    """
+
+    def __init__(self, pool, queue_depth=DEFAULT_QUEUE_DEPTH, timeout=DEFAULT_TIMEOUT,
+                 max_body=DEFAULT_MAX_BODY, url_fetcher=None, profile=None, local_files=False):
+        self.pool = pool
+        self.local_files = local_files
+        self.url_fetcher = url_fetcher if local_files else RemoteOnlyFetcher(url_fetcher)
+        self.profile = profile
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.max_body = max_body
+        self.started = time.time()
+        self.in_flight = 0
+        self.stats = {
+            'requests': 0,
+            'converted': 0,
+            'failed': 0,
+            'rejected': 0,
+            'timeouts': 0,
+            'render_seconds': 0.0,
+        }
+
+    @property
+    def capacity(self):
+        """Maximum number of conversions running or queued at once."""
+        return self.pool.workers + self.queue_depth
+
+    def metrics(self):
+        """Return a snapshot of the service counters."""
+        converted = self.stats['converted']
+        return {
+            'status': 'ok',
+            'uptime_seconds': round(time.time() - self.started, 1),
+            'workers': self.pool.workers,
+            'queue_depth': self.queue_depth,
+            'in_flight': self.in_flight,
+            'queued': max(0, self.in_flight - self.pool.workers),
+            **self.stats,
+            'render_seconds': round(self.stats['render_seconds'], 3),
+            'average_render_seconds': round(self.stats['render_seconds'] / converted, 3) if converted else None,
+        }
+
+    async def handle_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection until it is closed."""
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except _BadRequest as e:
+                    await self._respond(writer, e.status, str(e).encode() + b'\n', keep_alive=False)
+                    break
+                if request is None:
+                    break
+
+                method, target, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                status, content_type, payload = await self._route(method, target, body)
+                # A body that was never read would be taken for the next request
+                keep_alive = keep_alive and body.consumed
+                await self._respond(writer, status, payload, content_type, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader):
+        """
+        Read the head of one request; return None when the client closed
+        the connection. The body is returned as a _Body, read on demand.
+        """
+        try:
+            request_line = await reader.readline()
+        except ValueError:
+            raise _BadRequest(400, 'Request line too long')
+        if not request_line:
+            return None
+
+        try:
+            method, target, _ = request_line.decode('latin-1').split()
+        except ValueError:
+            raise _BadRequest(400, 'Malformed request line')
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = 0
+        if 'transfer-encoding' in headers:
+            raise _BadRequest(411, 'Chunked bodies are not supported; send Content-Length')
+        if 'content-length' in headers:
+            try:
+                length = int(headers['content-length'])
+            except ValueError:
+                raise _BadRequest(400, 'Invalid Content-Length')
+            if length < 0:
+                raise _BadRequest(400, 'Invalid Content-Length')
+            if length > self.max_body:
+                raise _BadRequest(413, f'Body larger than {self.max_body} bytes')
+
+        return method.upper(), target, headers, _Body(reader, length)
+
+    async def _route(self, method, target, body):
+        """Dispatch a request and return (status, content type, payload)."""
+        path = urlsplit(target).path
+        if path in ('/health', '/metrics'):
+            if method != 'GET':
+                return 405, 'text/plain', b'Use GET\n'
+            return 200, 'application/json', json.dumps(self.metrics()).encode() + b'\n'
+
+        if path != '/convert':
+            return 404, 'text/plain', b'Not found\n'
+        if method != 'POST':
+            return 405, 'text/plain', b'Use POST\n'
+
+        self.stats['requests'] += 1
+        if self.in_flight >= self.capacity:
+            self.stats['rejected'] += 1
+            return 429, 'text/plain', b'Conversion queue is full, retry later\n'
+        if not body.length:
+            return 400, 'text/plain', b'Empty request body\n'
+
+        query = parse_qs(urlsplit(target).query)
+        base_url = query.get('base_url', [None])[0]
+        # A path or file: URL would resolve the document's relative URLs on this machine
+        if (base_url is not None and not self.local_files
+                and urlsplit(base_url).scheme.lower() not in ('http', 'https')):
+            return 400, 'text/plain', b'base_url must be an http or https URL\n'
+        profile = query.get('profile', [self.profile])[0]
+        if profile is not None and profile not in PROFILES:
+            return 400, 'text/plain', f'Unknown profile {profile!r}\n'.encode()
+
+        # Hold the slot while the body arrives, so concurrent uploads cannot overshoot capacity
+        self.in_flight += 1
+        try:
+            return await self._convert(await body.read(), base_url, profile)
+        finally:
+            self.in_flight -= 1
+
+    async def _convert(self, body, base_url, profile=None):
+        """Run one conversion on the pool, bounded by the request timeout."""
+        start_time = time.monotonic()
+        future = self.pool.submit(convert_html, body, base_url=base_url, url_fetcher=self.url_fetcher,
+                                  profile=profile)
+        try:
+            pdf_bytes = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.pool.cancel(future)
+            self.stats['timeouts'] += 1
+            return 504, 'text/plain', f'Conversion took longer than {self.timeout} seconds\n'.encode()
+        except Exception as e:
+            self.stats['failed'] += 1
+            return 500, 'text/plain', f'Conversion failed: {e}\n'.encode()
+
+        self.stats['converted'] += 1
+        self.stats['render_seconds'] += time.monotonic() - start_time
+        return 200, 'application/pdf', pdf_bytes
+
+    async def _respond(self, writer, status, payload, content_type='text/plain', keep_alive=True):
+        """Write a response, streaming large payloads in chunks."""
+        head = [
+            f'HTTP/1.1 {status} {_REASONS.get(status, "")}',
+            f'Content-Type: {content_type}',
+            f'Content-Length: {len(payload)}',
+            f'Connection: {"keep-alive" if keep_alive else "close"}',
+        ]
+        if status == 429:
+            head.append('Retry-After: 1')
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+
+        view = memoryview(payload)
+        for offset in range(0, len(view), _WRITE_CHUNK):
+            writer.write(view[offset:offset + _WRITE_CHUNK])
+            await writer.drain()
+        await writer.drain()
+
+
+async def _serve(server, host, port):
+    listener = await asyncio.start_server(server.handle_connection, host, port)
+    addresses = ', '.join(f'{sock.getsockname()[0]}:{sock.getsockname()[1]}' for sock in listener.sockets)
+    print(f"Serving HTML to PDF conversions on {addresses} "
+          f"({server.pool.workers} workers, queue depth {server.queue_depth})")
+    async with listener:
+        await listener.serve_forever()
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None, queue_depth=DEFAULT_QUEUE_DEPTH,
+          timeout=DEFAULT_TIMEOUT, max_tasks_per_worker=DEFAULT_MAX_TASKS_PER_WORKER, url_fetcher=None,
+          profile=None, max_body=DEFAULT_MAX_BODY, local_files=False):
+    """
+    Run the conversion service until interrupted.
+
+    Args:
+        host: Interface to listen on
+        port: TCP port to listen on
+        workers: Number of render worker processes
+        queue_depth: Requests allowed to wait for a worker before 429s
+        timeout: Per-request conversion timeout in seconds
+        max_tasks_per_worker: Documents a worker converts before it is recycled
+        url_fetcher: Fetcher for images and stylesheets, e.g. an offline
+                     assets.AssetFetcher so no request waits on the network
+        profile: Output profile for requests without a profile parameter
+        max_body: Largest accepted request body in bytes (413 beyond it)
+        local_files: Let documents and base_url read files on the server
+    """
+    # Kill renders that outlive the request instead of leaving them running
+    with ConverterPool(workers, max_tasks_per_worker=max_tasks_per_worker, task_timeout=timeout) as pool:
+        server = ConversionServer(pool, queue_depth=queue_depth, timeout=timeout, max_body=max_body,
+                                  url_fetcher=url_fetcher, profile=profile, local_files=local_files)
+        try:
+            asyncio.run(_serve(server, host, port))
+        except KeyboardInterrupt:
+            print("Shutting down")
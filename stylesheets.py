@@ -0,0 +1,130 @@
+"""
+Process-local cache of parsed stylesheets and font configuration.
+
+Every conversion in a worker process shares the same pre-parsed expand
+stylesheet and, when the document declares no fonts of its own, the same
+FontConfiguration, so CSS parsing and fontconfig setup are paid once per
+process instead of once per document. Local stylesheets that documents link
+to are read once and kept in memory, keyed by path and modification time.
+
+WeasyPrint is imported by the functions that need it, after the caller has
+loaded it (see main.load_weasyprint), so importing this module is cheap.
+"""
+import os
+import re
+import threading
+from urllib.parse import unquote, urlsplit
+
+# <link ... href="..."> tags whose href looks like a stylesheet
+_LINK_RE = re.compile(r'''<link\b[^>]*?\bhref\s*=\s*["']([^"']+\.css)(?:[?#][^"']*)?["']''', re.IGNORECASE)
+
+# Parsed CSS objects, keyed by stylesheet source text
+_parsed_stylesheets = {}
+
+# Local stylesheet sources: path -> (mtime_ns, size, bytes)
+_stylesheet_sources = {}
+
+_shared_font_config = None
+
+# Font configurations of the threads that render documents side by side
+_thread_state = threading.local()
+
+
+def parsed_stylesheet(css_text):
+    """Return a CSS object for ``css_text``, parsing it only once per process."""
+    css = _parsed_stylesheets.get(css_text)
+    if css is None:
+        from weasyprint import CSS
+        css = CSS(string=css_text)
+        _parsed_stylesheets[css_text] = css
+    return css
+
+
+def shared_font_config(per_thread=False):
+    """
+    Return the FontConfiguration shared by documents in this process, or
+    with per_thread by the documents of the calling thread.
+    """
+    global _shared_font_config
+    if per_thread:
+        font_config = getattr(_thread_state, 'font_config', None)
+        if font_config is None:
+            from weasyprint.text.fonts import FontConfiguration
+            font_config = _thread_state.font_config = FontConfiguration()
+        return font_config
+    if _shared_font_config is None:
+        from weasyprint.text.fonts import FontConfiguration
+        _shared_font_config = FontConfiguration()
+    return _shared_font_config
+
+
+def read_stylesheet(path):
+    """Return the bytes of a local stylesheet, re-reading it only when it changes."""
+    stat = os.stat(path)
+    cached = _stylesheet_sources.get(path)
+    if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    _stylesheet_sources[path] = (stat.st_mtime_ns, stat.st_size, data)
+    return data
+
+
+def _local_stylesheet_path(url, base_dir=None):
+    """Return the local path of a stylesheet URL, or None if it is not a local file."""
+    parts = urlsplit(url)
+    if parts.scheme == 'file':
+        return unquote(parts.path)
+    if parts.scheme or parts.netloc or base_dir is None:
+        return None
+    return os.path.normpath(os.path.join(base_dir, unquote(parts.path)))
+
+
+def url_fetcher(url, timeout=10, ssl_context=None):
+    """WeasyPrint URL fetcher that serves local stylesheets from the cache."""
+    path = _local_stylesheet_path(url)
+    if path is not None and path.lower().endswith('.css'):
+        try:
+            data = read_stylesheet(path)
+        except OSError:
+            pass
+        else:
+            return {'string': data, 'mime_type': 'text/css', 'redirected_url': url}
+    from weasyprint import default_url_fetcher
+    return default_url_fetcher(url, timeout=timeout, ssl_context=ssl_context)
+
+
+def declares_fonts(html_content, base_dir=None):
+    """True if a document has @font-face rules, inline or in a linked local stylesheet."""
+    if '@font-face' in html_content:
+        return True
+
+    for href in _LINK_RE.findall(html_content):
+        path = _local_stylesheet_path(href, base_dir)
+        if path is None:
+            continue
+        try:
+            if b'@font-face' in read_stylesheet(path):
+                return True
+        except OSError:
+            continue
+    return False
+
+
+def font_config_for(html_content, base_dir=None, own_fonts=None, per_thread=False):
+    """
+    Return the FontConfiguration to render a document with.
+
+    Documents that declare their own @font-face rules, inline or in a linked
+    local stylesheet, get a fresh configuration so that fonts with the same
+    family name in different documents cannot leak into each other. Pass
+    own_fonts when that is already known (html_content is then ignored).
+    The others share the configuration of the process, or with per_thread
+    that of the calling thread.
+    """
+    from weasyprint.text.fonts import FontConfiguration
+    
+    if own_fonts is None:
+        own_fonts = declares_fonts(html_content, base_dir)
+    return FontConfiguration() if own_fonts else shared_font_config(per_thread)
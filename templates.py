@@ -0,0 +1,386 @@
+"""
+Template and data mode: many PDFs from one HTML template and a record feed.
+
+The template is an HTML file with ``$name`` or ``${name}`` placeholders
+(string.Template syntax) in its text and attribute values; records come
+from a JSON-lines or CSV file, which is read as a stream, so a feed of
+any length is rendered in constant memory.
+
+Each worker parses the template, expands its hidden content and finds its
+placeholders once, then renders every record by filling the placeholders
+in that same tree, so no HTML is serialised or parsed per record. Values
+are inserted as text, never as markup, so they need no escaping. Records
+travel to the workers in chunks, which keeps the per-task IPC overhead low
+for small documents.
+"""
+import concurrent.futures
+import csv
+import json
+import os
+import string
+import sys
+import time
+
+import assets
+import stylesheets
+from expand import INJECTED_CSS, expand_element, expand_tree
+from main import (BatchEvent, _render_options, atomic_output, decode_html, load_weasyprint,
+                  print_progress, render_tree)
+from metrics import ConversionMetrics
+from pool import ConverterPool, DEFAULT_MAX_TASKS_PER_WORKER, WorkerCrashedError
+from profiles import profile_options
+
+DATA_FORMATS = ('jsonl', 'csv')
+
+# Records sent to a worker in one task
+DEFAULT_CHUNK_SIZE = 25
+
+# Output file name; $index is the record number, zero padded
+DEFAULT_NAME_PATTERN = 'record-$index.pdf'
+
+_DATA_EXTENSIONS = {'.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'jsonl', '.csv': 'csv'}
+
+# Compiled templates of this process: path -> (mtime_ns, size, CompiledTemplate)
+_compiled_templates = {}
+
+
+def placeholders(text):
+    """Return the names of the $name / ${name} placeholders in text."""
+    template = string.Template(text)
+    names = set()
+    for match in template.pattern.finditer(text):
+        name = match.group('named') or match.group('braced')
+        if name:
+            names.add(name)
+    return names
+
+
+def data_format_for(path):
+    """Guess the format of a record file from its extension."""
+    data_format = _DATA_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if data_format is None:
+        raise ValueError(f"Cannot tell the format of {path}; use .jsonl or .csv, or name the format")
+    return data_format
+
+
+def iter_records(data_path, data_format=None):
+    """
+    Yield the records of a JSON-lines or CSV file as dicts, one at a time.
+
+    Args:
+        data_path: Path of the file, or '-' for stdin
+        data_format: 'jsonl' or 'csv' (default: from the file extension)
+
+    Raises:
+        ValueError: On a line that is not a JSON object
+    """
+    if data_format is None:
+        data_format = 'jsonl' if data_path == '-' else data_format_for(data_path)
+    if data_format not in DATA_FORMATS:
+        raise ValueError(f"Unknown data format {data_format!r}; choose from {', '.join(DATA_FORMATS)}")
+
+    if data_path == '-':
+        stream = sys.stdin
+    else:
+        stream = open(data_path, encoding='utf-8-sig', newline='')
+    try:
+        if data_format == 'csv':
+            yield from csv.DictReader(stream)
+            return
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{data_path}:{line_number}: invalid JSON: {str(e)}") from None
+            if not isinstance(record, dict):
+                raise ValueError(f"{data_path}:{line_number}: expected a JSON object")
+            yield record
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+class CompiledTemplate:
+    """
+    An HTML template parsed and expanded once, with the location of every
+    placeholder, ready to be filled in and rendered for each record.
+    """
+
+    _TEXT = object()
+    _TAIL = object()
+
+    def __init__(self, template_path):
+        load_weasyprint()
+        import tinyhtml5
+
+        self.path = os.path.abspath(template_path)
+        with open(self.path, 'rb') as f:
+            html_content = decode_html(f.read())
+        self.root = tinyhtml5.parse(html_content, namespace_html_elements=False)
+        expand_tree(self.root, INJECTED_CSS)
+        self.font_config = stylesheets.font_config_for(html_content, os.path.dirname(self.path))
+
+        # (element, _TEXT, _TAIL or attribute name, string.Template)
+        self.slots = []
+        self.fields = set()
+        # Original attributes of the elements with attribute slots, which
+        # expand_element may add to for one record (e.g. checked)
+        self._attributes = {}
+        for element in self.root.iter():
+            if not isinstance(element.tag, str):
+                continue  # comments and processing instructions
+            for where, text in ((self._TEXT, element.text), (self._TAIL, element.tail),
+                                *element.attrib.items()):
+                names = placeholders(text) if text and '$' in text else None
+                if names:
+                    self.slots.append((element, where, string.Template(text)))
+                    self.fields.update(names)
+                    if where is not self._TEXT and where is not self._TAIL:
+                        self._attributes.setdefault(element, dict(element.attrib))
+
+    def fill(self, record):
+        """
+        Put the values of record into the template tree, in place.
+
+        Raises:
+            ValueError: If the record lacks a field the template uses
+        """
+        missing = self.fields.difference(record)
+        if missing:
+            raise ValueError(f"record has no {', '.join(sorted(missing))} field")
+        values = {name: '' if value is None else str(value) for name, value in record.items()}
+        # Start from the template's attributes, not those the previous record left
+        for element, attributes in self._attributes.items():
+            element.attrib.clear()
+            element.attrib.update(attributes)
+        for element, where, template in self.slots:
+            # safe_substitute leaves a stray $ (e.g. "$5.00") as it is
+            text = template.safe_substitute(values)
+            if where is self._TEXT:
+                element.text = text
+            elif where is self._TAIL:
+                element.tail = text
+            else:
+                element.set(where, text)
+                # A filled in style or type may need expanding
+                expand_element(element)
+
+    def render(self, record, target, metrics=None, url_fetcher=None, profile=None):
+        """Render the template for one record to target (path, stream or None for bytes)."""
+        if metrics is None:
+            metrics = ConversionMetrics()
+        with metrics.stage('fill'):
+            self.fill(record)
+        image_cache = assets.image_cache(profile)
+        try:
+            document = render_tree(self.root, self.font_config, self.path, metrics, image_cache, url_fetcher,
+                                   profile)
+            with metrics.stage('write'):
+                return document.write_pdf(target, **_render_options(profile))
+        finally:
+            image_cache.trim()
+
+
+def compiled_template(template_path):
+    """Return the CompiledTemplate of template_path, compiling it once per process (again if it changes)."""
+    stat = os.stat(template_path)
+    cached = _compiled_templates.get(template_path)
+    if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+    template = CompiledTemplate(template_path)
+    _compiled_templates[template_path] = (stat.st_mtime_ns, stat.st_size, template)
+    return template
+
+
+def render_records(template_path, chunk, url_fetcher=None, profile=None):
+    """
+    Worker task: render a chunk of records with one template.
+
+    Args:
+        template_path: Path of the HTML template
+        chunk: List of (index, record, pdf_path)
+        url_fetcher: Fetcher for images and stylesheets
+        profile: Output profile name (see profiles.py)
+
+    Returns:
+        A list of (index, pdf_path, elapsed, pages, error) in chunk order;
+        error is None on success
+    """
+    template = compiled_template(template_path)
+    results = []
+    for index, record, pdf_path in chunk:
+        start_time = time.time()
+        metrics = ConversionMetrics()
+        try:
+            os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+            with atomic_output(pdf_path) as temp_path:
+                template.render(record, temp_path, metrics, url_fetcher, profile)
+        except Exception as e:
+            results.append((index, pdf_path, time.time() - start_time, None, str(e) or type(e).__name__))
+            continue
+        results.append((index, pdf_path, time.time() - start_time, metrics.pages, None))
+    return results
+
+
+def output_path_for(name_pattern, record, index, output_dir):
+    """
+    Return the PDF path of a record from the name pattern, e.g.
+    'invoice-$customer-$number.pdf'.
+
+    Raises:
+        ValueError: If the pattern uses a field the record lacks, or the
+            name would leave the output directory
+    """
+    values = {name: '' if value is None else str(value) for name, value in record.items()}
+    values.setdefault('index', f"{index:06d}")
+    missing = placeholders(name_pattern).difference(values)
+    if missing:
+        raise ValueError(f"record has no {', '.join(sorted(missing))} field for the file name")
+    name = string.Template(name_pattern).safe_substitute(values)
+    if not name.lower().endswith('.pdf'):
+        name += '.pdf'
+    pdf_path = os.path.normpath(os.path.join(output_dir, name))
+    if os.path.commonpath([output_dir, pdf_path]) != output_dir or pdf_path == output_dir:
+        raise ValueError(f"file name {name!r} is outside the output directory")
+    return pdf_path
+
+
+def render_template(template_path, records, output_dir='.', workers=None, pool=None,
+                    chunk_size=DEFAULT_CHUNK_SIZE, name_pattern=DEFAULT_NAME_PATTERN, data_format=None,
+                    max_tasks_per_worker=DEFAULT_MAX_TASKS_PER_WORKER, timeout=None, max_worker_rss=None,
+                    url_fetcher=None, profile=None, progress=print_progress):
+    """
+    Render one PDF per record from an HTML template.
+
+    Records are read lazily and at most two chunks per worker are in
+    flight, so the feed can be much larger than memory. A chunk whose
+    worker crashes is split up and its records are rendered one by one, so
+    only the record that caused the crash fails.
+
+    Args:
+        template_path: HTML template with $field placeholders
+        records: Path of a JSON-lines or CSV file ('-' for stdin), or an
+                 iterable of dicts
+        output_dir: Directory for the PDFs
+        workers: Number of worker processes (default: min(CPU count, 4))
+        pool: Existing ConverterPool to run on
+        chunk_size: Records per worker task
+        name_pattern: Output file name, with $field placeholders and $index
+        data_format: 'jsonl' or 'csv' when records is a path (default: from
+                 its extension)
+        max_tasks_per_worker: Chunks a worker renders before it is recycled
+                 (only used when no pool is given)
+        timeout: Seconds one chunk may take before its worker is killed
+                 (only used when no pool is given)
+        max_worker_rss: Resident memory in bytes a worker may use (only
+                 used when no pool is given)
+        url_fetcher: Fetcher for images and stylesheets
+        profile: Output profile name (see profiles.py)
+        progress: Callable receiving a BatchEvent for every record, or None
+
+    Returns:
+        A dict with the found, completed and failed counts and the elapsed time
+    """
+    start_time = time.time()
+    profile_options(profile)  # fail early on an unknown profile
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    template_path = os.path.abspath(template_path)
+    output_dir = os.path.abspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    if isinstance(records, (str, os.PathLike)):
+        source_name = os.path.basename(records) if records != '-' else 'stdin'
+        records = iter_records(os.fspath(records), data_format)
+    else:
+        source_name = 'records'
+
+    stats = {'found': 0, 'completed': 0, 'failed': 0}
+    scanning = True
+
+    def report(kind, index=None, pdf_path=None, elapsed=None, error=None, pages=None):
+        if kind == 'done':
+            stats['completed'] += 1
+        elif kind == 'failed':
+            stats['failed'] += 1
+        if progress is None:
+            return
+        label = f"{source_name} record {index}" if index is not None else template_path
+        metrics = {'pages': pages} if kind == 'done' else None
+        if kind == 'finished':
+            pdf_path = output_dir
+            metrics = stats
+        progress(BatchEvent(kind, label, pdf_path, elapsed, stats['completed'], stats['failed'], 0,
+                            stats['found'], scanning, error, metrics))
+
+    own_pool = pool is None
+    if own_pool:
+        pool = ConverterPool(workers, max_tasks_per_worker=max_tasks_per_worker, task_timeout=timeout,
+                             max_worker_rss=max_worker_rss)
+    max_in_flight = pool.workers * 2
+    # Future -> its chunk
+    in_flight = {}
+
+    def submit(chunk):
+        in_flight[pool.submit(render_records, template_path, chunk, url_fetcher, profile)] = chunk
+
+    def collect(block):
+        """Report finished chunks, waiting for one if block is set."""
+        done, _ = concurrent.futures.wait(list(in_flight), timeout=None if block else 0,
+                                          return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            chunk = in_flight.pop(future)
+            try:
+                results = future.result()
+            except WorkerCrashedError as e:
+                if len(chunk) > 1:
+                    # Find the record that brings the worker down
+                    for entry in chunk:
+                        submit([entry])
+                    continue
+                index, _, pdf_path = chunk[0]
+                report('failed', index, pdf_path, error=str(e))
+                continue
+            except Exception as e:
+                for index, _, pdf_path in chunk:
+                    report('failed', index, pdf_path, error=str(e))
+                continue
+            for index, pdf_path, elapsed, pages, error in results:
+                if error is None:
+                    report('done', index, pdf_path, elapsed, pages=pages)
+                else:
+                    report('failed', index, pdf_path, elapsed, error=error)
+
+    try:
+        # 1. Stream the records into chunks, never more than max_in_flight ahead
+        chunk = []
+        for record in records:
+            stats['found'] += 1
+            index = stats['found']
+            try:
+                pdf_path = output_path_for(name_pattern, record, index, output_dir)
+            except ValueError as e:
+                report('failed', index, error=str(e))
+                continue
+            chunk.append((index, record, pdf_path))
+            if len(chunk) < chunk_size:
+                continue
+            submit(chunk)
+            chunk = []
+            collect(block=len(in_flight) >= max_in_flight)
+        if chunk:
+            submit(chunk)
+        scanning = False
+
+        # 2. Wait for the rest
+        while in_flight:
+            collect(block=True)
+    finally:
+        if own_pool:
+            pool.shutdown(cancel_futures=True)
+
+    stats['elapsed'] = round(time.time() - start_time, 4)
+    report('finished', elapsed=stats['elapsed'])
+    return stats
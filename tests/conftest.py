@@ -0,0 +1,29 @@
+"""
+Shared fixtures. The tests run without WeasyPrint: pools use the fork start
+method and plain functions or stubs in place of conversions.
+"""
+import multiprocessing
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pool import ConverterPool  # noqa: E402
+
+
+@pytest.fixture
+def make_pool():
+    """Return a factory for fork-context pools without the WeasyPrint initializer, shut down after the test."""
+    pools = []
+
+    def make(workers=1, **options):
+        options.setdefault('initializer', None)
+        pool = ConverterPool(workers, mp_context=multiprocessing.get_context('fork'), **options)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.shutdown(cancel_futures=True)
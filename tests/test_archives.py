@@ -0,0 +1,49 @@
+"""Archive batches with a stub in place of render_member."""
+import os
+import zipfile
+
+import pytest
+
+import archives
+
+
+def fake_render_member(data, url_fetcher=None, profile=None):
+    if b'crash' in data:
+        os._exit(9)
+    return b'%PDF-1.7 ' + data, {'elapsed': 0.0}
+
+
+@pytest.fixture
+def make_archive(tmp_path, monkeypatch):
+    monkeypatch.setattr(archives, 'render_member', fake_render_member)
+
+    def make(members):
+        path = tmp_path / 'docs.zip'
+        with zipfile.ZipFile(path, 'w') as archive:
+            for name, data in members.items():
+                archive.writestr(name, data)
+        return str(path)
+
+    return make
+
+
+def test_retried_counts_each_member_once(make_pool, make_archive, tmp_path):
+    archive = make_archive({'good.html': b'<p>good</p>', 'bad.html': b'<p>crash</p>'})
+    stats = archives.convert_archive(archive, str(tmp_path / 'out'), pool=make_pool(), retries=2, progress=None)
+    assert stats['completed'] == 1
+    assert stats['failed'] == 1
+    assert stats['retried'] == 1
+
+
+def test_write_error_fails_the_archive_without_a_retry(make_pool, make_archive, tmp_path, monkeypatch):
+    archive = make_archive({'a.html': b'<p>a</p>'})
+    events = []
+
+    def add(self, pdf_name, pdf_bytes, date_time):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(archives._DirectoryOutput, 'add', add)
+    with pytest.raises(OSError, match="disk full"):
+        archives.convert_archive(archive, str(tmp_path / 'out'), pool=make_pool(), retry_errors=True,
+                                 progress=events.append)
+    assert [event.kind for event in events if event.kind == 'retry'] == []
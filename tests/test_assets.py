@@ -0,0 +1,23 @@
+"""Process and per-thread image caches."""
+import threading
+
+import assets
+
+
+def test_per_thread_image_caches_are_not_shared():
+    caches = []
+
+    def render():
+        caches.append((assets.image_cache('fast', per_thread=True), assets.image_cache('fast', per_thread=True)))
+
+    threads = [threading.Thread(target=render) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    (first, first_again), (second, second_again) = caches
+    assert first is first_again and second is second_again
+    assert first is not second
+    shared = assets.image_cache('fast')
+    assert shared is not first and shared is not second
@@ -0,0 +1,23 @@
+import cost
+
+
+def test_large_file_is_estimated_from_a_sample(tmp_path, monkeypatch):
+    path = tmp_path / 'doc.html'
+    path.write_bytes(b'<table><tr><td>cell</td></tr></table>\n' * 10000)
+    full = cost.estimate_cost(str(path))
+
+    monkeypatch.setattr(cost, 'FULL_SCAN_BYTES', 64 * 1024)
+    monkeypatch.setattr(cost, 'SAMPLE_BYTES', 16 * 1024)
+    # A uniform document scales up from its start to about the same cost
+    assert abs(cost.estimate_cost(str(path)) - full) / full < 0.01
+
+    # Only the start is read: images past the sample are not seen
+    with open(path, 'ab') as f:
+        f.write(b'<img src="a.png">' * 1000)
+    sampled = cost.estimate_cost(str(path))
+    monkeypatch.setattr(cost, 'FULL_SCAN_BYTES', path.stat().st_size)
+    assert cost.estimate_cost(str(path)) - sampled > 500 * cost.COST_WEIGHTS['images']
+
+
+def test_unreadable_file_costs_nothing(tmp_path):
+    assert cost.estimate_cost(str(tmp_path / 'missing.html')) == 0.0
@@ -0,0 +1,104 @@
+import operator
+import os
+import threading
+import time
+
+import pytest
+
+from pool import WorkerCrashedError, WorkerStartError
+
+
+def failing_initializer():
+    raise ValueError("cannot load libraries")
+
+
+def crashing_initializer():
+    os._exit(3)
+
+
+def slow_initializer():
+    time.sleep(1.5)
+
+
+def crash():
+    os._exit(9)
+
+
+def test_done_callback_can_submit(make_pool):
+    pool = make_pool()
+    submitted = []
+
+    def resubmit(future):
+        submitted.append(pool.submit(operator.add, future.result(), 1))
+
+    first = pool.submit(operator.add, 1, 2)
+    first.add_done_callback(resubmit)
+    assert first.result(timeout=10) == 3
+    deadline = time.monotonic() + 10
+    while not submitted and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert submitted[0].result(timeout=10) == 4
+    # The manager thread is still responsive for other callers
+    assert pool.submit(operator.mul, 2, 3).result(timeout=10) == 6
+
+
+def test_done_callback_on_failure_can_submit(make_pool):
+    pool = make_pool()
+    submitted = threading.Event()
+    results = []
+
+    def resubmit(future):
+        results.append(pool.submit(operator.add, 1, 1))
+        submitted.set()
+
+    failed = pool.submit(operator.truediv, 1, 0)
+    failed.add_done_callback(resubmit)
+    with pytest.raises(ZeroDivisionError):
+        failed.result(timeout=10)
+    assert submitted.wait(10)
+    assert results[0].result(timeout=10) == 2
+
+
+def _submit_and_wait(pool):
+    """Submit a task and return its exception; a pool that already gave up raises from submit()."""
+    try:
+        future = pool.submit(operator.add, 1, 2)
+    except WorkerStartError as e:
+        return e.__cause__
+    return future.exception(timeout=10)
+
+
+def test_initializer_failure_is_reported_once(make_pool):
+    pool = make_pool(2, initializer=failing_initializer)
+    for _ in range(3):
+        error = _submit_and_wait(pool)
+        assert isinstance(error, ValueError) and "cannot load libraries" in str(error)
+
+    # No replacement workers are spawned
+    time.sleep(0.5)
+    assert pool.worker_pids() == []
+    with pytest.raises(WorkerStartError, match="cannot load libraries"):
+        pool.submit(operator.add, 1, 2)
+
+
+def test_initializer_crash_stops_respawning(make_pool):
+    pool = make_pool(initializer=crashing_initializer)
+    error = _submit_and_wait(pool)
+    assert isinstance(error, WorkerCrashedError) and "before it was ready" in str(error)
+    time.sleep(0.5)
+    assert pool.worker_pids() == []
+
+
+def test_worker_crash_during_task_is_not_a_start_failure(make_pool):
+    pool = make_pool()
+    crashed = pool.submit(crash)
+    with pytest.raises(WorkerCrashedError, match="exited with code 9"):
+        crashed.result(timeout=10)
+    assert pool.submit(operator.add, 2, 2).result(timeout=10) == 4
+
+
+def test_warm_up_does_not_count_against_the_task_timeout(make_pool):
+    pool = make_pool(initializer=slow_initializer, task_timeout=1.0, max_tasks_per_worker=1)
+    assert pool.submit(operator.add, 1, 2).result(timeout=10) == 3
+    # The replacement worker warms up again before its first task
+    assert pool.submit(operator.add, 2, 3).result(timeout=10) == 5
@@ -0,0 +1,74 @@
+import os
+import stat
+
+import pytest
+
+import render_cache
+from render_cache import RenderCache
+
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+@pytest.mark.parametrize('umask, expected', [(0o022, 0o644), (0o027, 0o640)])
+def test_cached_pdf_gets_default_permissions(tmp_path, umask, expected):
+    # Set before anything is cached: the mode follows the umask of the moment
+    previous = os.umask(umask)
+    try:
+        cache = RenderCache(tmp_path / 'cache')
+        rendered = tmp_path / 'rendered.pdf'
+        rendered.write_bytes(b'%PDF-1.7 test')
+        cache.put('ab' * 32, str(rendered))
+
+        served = tmp_path / 'served.pdf'
+        assert cache.get('ab' * 32, str(served))
+        assert served.read_bytes() == b'%PDF-1.7 test'
+        assert _mode(served) == expected
+    finally:
+        os.umask(previous)
+
+
+def test_fallback_file_mode_matches_the_umask(tmp_path, monkeypatch):
+    monkeypatch.setattr(render_cache, '_umask', lambda: None)
+    previous = os.umask(0o027)
+    try:
+        assert render_cache._file_mode(str(tmp_path)) == 0o640
+    finally:
+        os.umask(previous)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_memo_keeps_one_entry_per_changed_asset(tmp_path):
+    asset = tmp_path / 'logo.png'
+    before = len(render_cache._asset_digests)
+    digests = set()
+    for version in range(3):
+        asset.write_bytes(b'png' * (version + 1))
+        digests.add(render_cache._asset_digest(str(asset)))
+    assert len(digests) == 3
+    assert len(render_cache._asset_digests) == before + 1
+
+
+def test_key_follows_assets_of_linked_stylesheets(tmp_path):
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'css' / 'site.css').write_text('@import "print.css"; body { background: url(../bg.png); }')
+    (tmp_path / 'css' / 'print.css').write_text('@font-face { src: url("font.woff2"); }')
+    (tmp_path / 'bg.png').write_bytes(b'png 1')
+    (tmp_path / 'css' / 'font.woff2').write_bytes(b'font 1')
+    html = b'<link rel="stylesheet" href="css/site.css"><p>Hello</p>'
+    cache = RenderCache(tmp_path / 'cache')
+
+    def key():
+        return cache.key(html, str(tmp_path))
+
+    first = key()
+    assert key() == first
+
+    (tmp_path / 'bg.png').write_bytes(b'png 2, a different size')
+    second = key()
+    assert second != first
+
+    # A font reached through @import in the linked stylesheet
+    (tmp_path / 'css' / 'font.woff2').write_bytes(b'font 2, a different size')
+    assert key() != second
@@ -0,0 +1,114 @@
+"""
+AdaptiveExecutor routing and batching, with a stub in place of convert_file.
+
+The stub is installed before the fork-context pool starts, so the workers
+inherit it; a document whose name contains 'crash' kills its worker, and
+one whose name contains 'slow' keeps it busy for a moment.
+"""
+import os
+import time
+
+import pytest
+
+import routing
+from pool import WorkerCrashedError
+
+
+def fake_convert_file(html_path, pdf_path, url_fetcher=None, profile=None, per_thread=False):
+    if 'crash' in os.path.basename(html_path):
+        os._exit(9)
+    if 'slow' in os.path.basename(html_path):
+        time.sleep(0.5)
+    return {'html_path': html_path, 'pid': os.getpid(), 'elapsed': 0.0, 'peak_rss': None}
+
+
+@pytest.fixture
+def make_router(make_pool, monkeypatch):
+    """Return a factory for executors over a fork-context pool that runs fake_convert_file."""
+    monkeypatch.setattr(routing, 'convert_file', fake_convert_file)
+    routers = []
+
+    def make(workers=1, **options):
+        router = routing.AdaptiveExecutor(make_pool(workers), **options)
+        routers.append(router)
+        return router
+
+    yield make
+    for router in routers:
+        router.close()
+
+
+def test_idle_workers_share_the_small_documents(make_router):
+    router = make_router(workers=2, small_batch=4)
+    futures = [router.submit_file(f'doc{i}.html', f'doc{i}.pdf', cost=1) for i in range(4)]
+    records = [future.result(timeout=30) for future in futures]
+    assert [record['route'] for record in records] == ['batched'] * 4
+    # One batch of four would leave the second worker idle
+    assert router.routes['batches'] >= 2
+
+
+def _write_documents(directory, names):
+    for name in names:
+        (directory / name).write_text(f'<p>{name}</p>')
+    return [str(directory / name) for name in names]
+
+
+def test_batch_crash_fails_the_batch_not_each_document(make_router, tmp_path):
+    router = make_router(workers=1, small_batch=8)
+    # Keep the only worker busy, so the eight small documents go as one batch
+    busy = router.submit_file('slow.html', 'slow.pdf', alone=True)
+    names = [f'doc{i}.html' for i in range(7)] + ['crash.html']
+    futures = [router.submit_file(name, name + '.pdf', cost=1) for name in names]
+    assert busy.result(timeout=30)['route'] == 'pool'
+
+    for future in futures:
+        with pytest.raises(routing.BatchFailedError):
+            future.result(timeout=30)
+    assert router.routes['batches'] == 1
+
+    # On their own only the culprit fails, and each document counts once
+    retried = {name: router.submit_file(name, name + '.pdf', alone=True) for name in names}
+    with pytest.raises(WorkerCrashedError):
+        retried.pop('crash.html').result(timeout=30)
+    for future in retried.values():
+        assert future.result(timeout=30)['route'] == 'pool'
+    assert router.routes['pool'] == 8
+    assert router.routes['batched'] == 0
+
+
+@pytest.mark.parametrize('retries', [0, 1])
+def test_batch_crash_quarantines_only_the_culprit(make_router, tmp_path, retries):
+    import main
+
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    names = [f'doc{i}.html' for i in range(7)] + ['crash.html']
+    _write_documents(input_dir, names)
+    # The costliest document is submitted first and takes the only worker
+    (input_dir / 'slow.html').write_text('<table><tr><td>slow</td></tr></table>' * 200)
+    small_cost = main.estimate_cost(str(input_dir / 'slow.html'))
+    router = make_router(workers=1, small_cost=small_cost, small_batch=8)
+
+    stats = main.batch_convert_html_to_pdf(str(input_dir), str(tmp_path / 'out'), pool=router, retries=retries,
+                                           progress=None)
+    assert router.routes['batches'] >= 1
+    assert stats['completed'] == 8
+    assert stats['failed'] == 1
+    assert stats['quarantined'] == 1
+    assert stats['retried'] == retries
+    assert stats['routes']['pool'] + stats['routes']['batched'] + stats['routes']['local'] == 8
+
+
+def test_batch_reports_only_its_own_routes(make_router, tmp_path):
+    import main
+
+    router = make_router(workers=1)
+    for batch in ('first', 'second'):
+        input_dir = tmp_path / batch
+        input_dir.mkdir()
+        _write_documents(input_dir, [f'doc{i}.html' for i in range(3)])
+        stats = main.batch_convert_html_to_pdf(str(input_dir), str(tmp_path / f'{batch}-out'), pool=router,
+                                               progress=None)
+        assert stats['completed'] == 3
+        assert stats['routes']['pool'] + stats['routes']['batched'] + stats['routes']['local'] == 3
+    assert router.routes['pool'] + router.routes['batched'] + router.routes['local'] == 6
@@ -0,0 +1,58 @@
+"""Request handling of the conversion service, without a pool behind it."""
+import asyncio
+
+import pytest
+
+from assets import LocalFileFetchError
+from server import ConversionServer
+
+
+class _IdlePool:
+    workers = 1
+
+
+async def _exchange(server, request):
+    listener = await asyncio.start_server(server.handle_connection, '127.0.0.1', 0)
+    async with listener:
+        reader, writer = await asyncio.open_connection('127.0.0.1', listener.sockets[0].getsockname()[1])
+        writer.write(request)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        return response
+
+
+def test_full_queue_rejects_before_reading_the_body():
+    server = ConversionServer(_IdlePool(), queue_depth=0)
+    server.in_flight = server.capacity
+    # The body is never sent: the server must answer from the headers alone
+    response = asyncio.run(_exchange(server, b'POST /convert HTTP/1.1\r\nContent-Length: 1000000\r\n\r\n'))
+    assert response.startswith(b'HTTP/1.1 429 ')
+    assert b'Connection: close' in response
+    assert server.stats['rejected'] == 1
+
+
+def test_body_over_the_limit_is_refused():
+    server = ConversionServer(_IdlePool(), max_body=1000)
+    response = asyncio.run(_exchange(server, b'POST /convert HTTP/1.1\r\nContent-Length: 1001\r\n\r\n'))
+    assert response.startswith(b'HTTP/1.1 413 ')
+
+
+def test_local_base_url_is_refused():
+    server = ConversionServer(_IdlePool())
+    for base_url in (b'file:///etc/', b'/etc/'):
+        request = b'POST /convert?base_url=' + base_url + b' HTTP/1.1\r\nContent-Length: 4\r\n\r\n<p/>'
+        response = asyncio.run(_exchange(server, request))
+        assert response.startswith(b'HTTP/1.1 400 ')
+
+
+def test_documents_cannot_fetch_local_files():
+    fetched = []
+    server = ConversionServer(_IdlePool(), url_fetcher=lambda url, **kwargs: fetched.append(url) or {'string': b''})
+    with pytest.raises(LocalFileFetchError):
+        server.url_fetcher('file:///etc/passwd')
+    server.url_fetcher('https://example.com/logo.png')
+    assert fetched == ['https://example.com/logo.png']
+
+    trusted = ConversionServer(_IdlePool(), local_files=True)
+    assert trusted.url_fetcher is None
@@ -0,0 +1,46 @@
+"""Filling a compiled template record after record, without WeasyPrint."""
+import pytest
+
+import templates
+
+
+@pytest.fixture
+def compile_template(tmp_path, monkeypatch):
+    """Return a factory compiling HTML text to a CompiledTemplate; rendering is never needed."""
+    monkeypatch.setattr(templates, 'load_weasyprint', lambda: None)
+    monkeypatch.setattr(templates.stylesheets, 'font_config_for', lambda html, base_dir: None)
+
+    def compile(html):
+        path = tmp_path / 'template.html'
+        path.write_text(html)
+        return templates.CompiledTemplate(str(path))
+
+    return compile
+
+
+def _element(template, tag):
+    return next(template.root.iter(tag))
+
+
+def test_attributes_of_one_record_do_not_leak_into_the_next(compile_template):
+    template = compile_template('<p><input type="$kind" value="$value"></p>')
+
+    template.fill({'kind': 'checkbox', 'value': 'yes'})
+    assert _element(template, 'input').get('checked') == 'checked'
+
+    template.fill({'kind': 'text', 'value': 'Jane'})
+    field = _element(template, 'input')
+    assert field.get('checked') is None
+    assert field.get('type') == 'text'
+    assert field.get('value') == 'Jane'
+
+
+def test_expanded_style_is_filled_again_for_every_record(compile_template):
+    template = compile_template('<div style="display:$display; color:$color">x</div>')
+
+    template.fill({'display': 'none', 'color': 'red'})
+    assert 'display:block' in _element(template, 'div').get('style').replace(' ', '')
+
+    template.fill({'display': 'inline', 'color': 'blue'})
+    style = _element(template, 'div').get('style')
+    assert 'inline' in style and 'blue' in style
@@ -0,0 +1,331 @@
+"""
+Watch mode: keep a directory of PDFs in step with a tree of HTML files.
+
+watch() first runs a resumed batch over the whole tree, so only documents
+that changed since the last run are converted, then waits for changes.
+Linux inotify (through ctypes, no extra packages) reports them as they
+happen; elsewhere, when inotify runs out of watches, or on request the
+tree is polled instead. A file is converted once it has been quiet for the
+debounce interval, so an editor's burst of writes renders once, on the
+same warm ConverterPool for the lifetime of the process.
+
+When an HTML file (or a directory of them) is deleted, the PDFs the
+journal records for it are deleted too. Only PDFs this tool wrote are ever
+removed, even when the output directory is the input directory.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from journal import Journal
+from main import batch_convert_html_to_pdf, iter_html_files, print_progress
+from pool import ConverterPool, DEFAULT_MAX_TASKS_PER_WORKER
+
+# Seconds a file must be left alone before it is converted
+DEFAULT_DEBOUNCE = 1.0
+
+# Seconds between scans of the tree when polling
+DEFAULT_POLL_INTERVAL = 2.0
+
+_HTML_EXTENSIONS = ('.html', '.htm')
+
+# inotify(7) constants
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = os.O_CLOEXEC
+
+_WATCH_MASK = (_IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+               | _IN_DELETE_SELF | _IN_ONLYDIR)
+
+# struct inotify_event: wd, mask, cookie, len, then len bytes of name
+_EVENT = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+
+def is_html(path):
+    return path.lower().endswith(_HTML_EXTENSIONS)
+
+
+class InotifyWatcher:
+    """
+    Recursive watch of a directory tree with Linux inotify.
+
+    read() returns the HTML files that were written, created, moved in or
+    deleted, and directories that were deleted or moved away. Directories
+    created or moved into the tree are watched as well, and the HTML files
+    already in them are reported.
+
+    Raises:
+        OSError: If inotify is unavailable or runs out of watches
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1: {os.strerror(err)}")
+        # Watch descriptor -> directory path, and the reverse
+        self._paths = {}
+        self._watches = {}
+        try:
+            self._watch_tree(self.root)
+        except OSError:
+            self.close()
+            raise
+
+    def _watch(self, directory):
+        wd = self._add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return  # gone again already
+            raise OSError(err, f"inotify_add_watch {directory}: {os.strerror(err)}")
+        self._paths[wd] = directory
+        self._watches[directory] = wd
+
+    def _watch_tree(self, directory):
+        """Watch directory and every directory below it."""
+        self._watch(directory)
+        for dirpath, dirnames, _ in os.walk(directory):
+            for name in dirnames:
+                self._watch(os.path.join(dirpath, name))
+
+    def _unwatch_tree(self, directory):
+        """Stop watching a directory that left the tree, and everything below it."""
+        prefix = directory + os.sep
+        for path in [path for path in self._watches if path == directory or path.startswith(prefix)]:
+            wd = self._watches.pop(path)
+            self._paths.pop(wd, None)
+            self._rm_watch(self._fd, wd)
+
+    def read(self, timeout=None):
+        """
+        Wait up to timeout seconds (None: indefinitely) for changes.
+
+        Returns:
+            (set of changed paths, True if events were lost and the whole
+            tree must be rescanned)
+        """
+        changed = set()
+        rescan = False
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return changed, rescan
+
+        while True:
+            try:
+                data = os.read(self._fd, _READ_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0')
+                offset += _EVENT.size + length
+
+                if mask & _IN_Q_OVERFLOW:
+                    rescan = True
+                    continue
+                directory = self._paths.get(wd)
+                if mask & _IN_IGNORED:
+                    if directory is not None and self._watches.get(directory) == wd:
+                        del self._watches[directory]
+                    self._paths.pop(wd, None)
+                    continue
+                if directory is None or not name:
+                    continue
+                path = os.path.join(directory, os.fsdecode(name))
+
+                if mask & _IN_ISDIR:
+                    if mask & (_IN_CREATE | _IN_MOVED_TO):
+                        self._watch_tree(path)
+                        # Files may have landed before the watch was in place
+                        changed.update(iter_html_files(path))
+                    elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                        self._unwatch_tree(path)
+                        changed.add(path)
+                elif is_html(path):
+                    changed.add(path)
+        return changed, rescan
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher:
+    """
+    Watch a directory tree by comparing the size and modification time of
+    its HTML files every interval seconds. Works on every platform and on
+    network filesystems that do not deliver inotify events.
+    """
+
+    def __init__(self, root, interval=DEFAULT_POLL_INTERVAL):
+        self.root = os.path.abspath(root)
+        self.interval = interval
+        self._snapshot = self._scan()
+        self._next_scan = time.monotonic() + interval
+
+    def _scan(self):
+        snapshot = {}
+        for path in iter_html_files(self.root):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def read(self, timeout=None):
+        """Wait up to timeout seconds (None: until the next scan) and return (changed paths, False)."""
+        wait = max(0.0, self._next_scan - time.monotonic())
+        if timeout is not None and timeout < wait:
+            time.sleep(timeout)
+            return set(), False
+        time.sleep(wait)
+
+        snapshot = self._scan()
+        self._next_scan = time.monotonic() + self.interval
+        changed = {path for path, signature in snapshot.items() if self._snapshot.get(path) != signature}
+        changed.update(path for path in self._snapshot if path not in snapshot)
+        self._snapshot = snapshot
+        return changed, False
+
+    def close(self):
+        pass
+
+
+def open_watcher(root, poll_interval=None):
+    """
+    Return an InotifyWatcher for root on Linux, or a PollingWatcher when
+    poll_interval is given or inotify cannot be used.
+    """
+    if poll_interval is None and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({str(e)}); polling for changes instead")
+    return PollingWatcher(root, poll_interval or DEFAULT_POLL_INTERVAL)
+
+
+def remove_orphans(job_journal, path):
+    """
+    Delete the PDFs recorded for HTML files at or below path that no longer
+    exist, and forget them.
+
+    Returns:
+        The number of PDFs deleted
+    """
+    removed = 0
+    for html_path, pdf_path in job_journal.documents_under(path):
+        if os.path.exists(html_path):
+            continue
+        if pdf_path and os.path.exists(pdf_path):
+            try:
+                os.unlink(pdf_path)
+            except OSError as e:
+                print(f"Warning: could not remove {pdf_path}: {str(e)}")
+                continue
+            print(f"Removed {pdf_path} ({html_path} was deleted)")
+            removed += 1
+        job_journal.forget(html_path)
+    job_journal.commit()
+    return removed
+
+
+def watch(input_dir, output_dir=None, workers=None, debounce=DEFAULT_DEBOUNCE, poll_interval=None,
+          max_tasks_per_worker=DEFAULT_MAX_TASKS_PER_WORKER, timeout=None, max_worker_rss=None,
+          progress=print_progress, **batch_options):
+    """
+    Convert input_dir, then keep converting changed files until interrupted.
+
+    Args:
+        input_dir: Directory containing HTML files (watched recursively)
+        output_dir: Directory for output PDFs (default: input_dir)
+        workers: Number of worker processes, kept warm for the whole run
+        debounce: Seconds a file must stay unchanged before it is converted
+        poll_interval: Poll the tree every this many seconds instead of
+              using inotify (e.g. on network filesystems)
+        max_tasks_per_worker: Documents a worker converts before it is
+              recycled, which keeps memory flat over a long run
+        timeout: Seconds one document may take before its worker is killed
+        max_worker_rss: Bytes of resident memory a worker may use
+        progress: Progress callback passed to every batch
+        batch_options: Further batch_convert_html_to_pdf options (cache,
+              retries, url_fetcher, profile, report_path, ...)
+    """
+    input_dir = os.path.abspath(input_dir)
+    output_dir = os.path.abspath(output_dir or input_dir)
+
+    def convert(files=None):
+        batch_convert_html_to_pdf(input_dir, output_dir, pool=pool, progress=progress, files=files,
+                                  journal=True, resume=files is None, **batch_options)
+
+    with ConverterPool(workers, max_tasks_per_worker=max_tasks_per_worker, task_timeout=timeout,
+                       max_worker_rss=max_worker_rss) as pool:
+        # 1. Watch first, so nothing changed during the first pass is missed
+        watcher = open_watcher(input_dir, poll_interval)
+        job_journal = Journal.in_directory(output_dir)
+        try:
+            # 2. Catch up with everything that changed while not watching
+            convert()
+            remove_orphans(job_journal, input_dir)
+            print(f"Watching {input_dir} for changes (Ctrl-C to stop)")
+
+            # 3. Path -> time of its latest change, until it has been quiet for debounce seconds
+            pending = {}
+            while True:
+                wait = None
+                if pending:
+                    wait = max(0.0, min(pending.values()) + debounce - time.monotonic())
+                changed, rescan = watcher.read(wait)
+
+                now = time.monotonic()
+                if rescan:
+                    print("Change events were lost; rescanning")
+                    pending.clear()
+                    convert()
+                    remove_orphans(job_journal, input_dir)
+                    continue
+                for path in changed:
+                    pending[path] = now
+
+                ready = [path for path, changed_at in pending.items() if now - changed_at >= debounce]
+                if not ready:
+                    continue
+                for path in ready:
+                    del pending[path]
+
+                # 4. Convert what exists, clean up after what does not
+                files = sorted(path for path in ready if is_html(path) and os.path.isfile(path))
+                for path in ready:
+                    if not os.path.exists(path):
+                        remove_orphans(job_journal, path)
+                if files:
+                    convert(files)
+        except KeyboardInterrupt:
+            print("Stopped watching")
+        finally:
+            watcher.close()
+            job_journal.close()